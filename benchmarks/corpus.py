@@ -0,0 +1,171 @@
+import io
+import os
+import random
+import logging
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Kinds of synthetic documents: born-digital PDFs with a text layer, scanned PDFs and photos
+KINDS = ("pdf", "scanned_pdf", "png", "jpg")
+
+TITLES = ("INVOICE", "BANK STATEMENT", "DRIVER'S LICENSE", "MEMO")
+WORDS = (
+    "account", "amount", "balance", "date", "description", "payment", "total", "customer", "number", "address",
+    "reference", "quantity", "price", "tax", "due", "period", "issued", "expires", "class", "name",
+)
+
+def document_lines(rng, title, line_count=None):
+    """
+    Generate the text of a synthetic document.
+
+    Args:
+        rng (random.Random): Random generator.
+        title (str): Title on the first line.
+        line_count (int, optional): Number of lines after the title, random by default.
+
+    Returns:
+        list: Lines of the document.
+    """
+    lines = [title]
+    for _ in range(line_count or rng.randint(10, 35)):
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 7)))
+        lines.append(f"{words.capitalize()} {rng.randint(1, 99999) / 100:.2f}")
+    return lines
+
+def render_page(rng, lines, size=(1240, 1754), noise=True):
+    """
+    Render lines of text to a page image, like an A4 page scanned at 150 DPI.
+
+    The layout (margins, a logo and a table) is randomised so that documents are
+    not near-duplicates of each other.
+
+    Args:
+        rng (random.Random): Random generator.
+        lines (list): Lines of text.
+        size (tuple): Width and height of the page in pixels.
+        noise (bool): Whether to add blur and a slight rotation, as in scans and photos.
+
+    Returns:
+        PIL.Image.Image: The RGB page image.
+    """
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    for _ in range(rng.randint(2, 4)):
+        # Logos, stamps and shaded boxes
+        box_x, box_y = rng.randint(0, width - 500), rng.randint(0, height - 500)
+        draw.rectangle((box_x, box_y, box_x + rng.randint(150, 500), box_y + rng.randint(100, 500)),
+                       fill=tuple(rng.randint(60, 230) for _ in range(3)))
+    table_y = rng.randint(height // 3, height - 400)
+    for row in range(rng.randint(3, 10)):
+        draw.line((60, table_y + row * 36, width - 60, table_y + row * 36), fill="gray", width=2)
+    margin, top = rng.randint(40, 400), rng.randint(60, 300)
+    for i, line in enumerate(lines):
+        draw.text((margin, top + i * 40), line, fill="black", font=font)
+    if noise:
+        image = image.rotate(0.7, expand=False, fillcolor="white").filter(ImageFilter.GaussianBlur(0.6))
+    return image
+
+def _escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def text_pdf(pages):
+    """
+    Write a born-digital PDF with a text layer.
+
+    Args:
+        pages (list): Lines of text of each page.
+
+    Returns:
+        bytes: The PDF.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        text = "".join(f"({_escape_pdf_text(line)}) Tj T* " for line in lines)
+        stream = f"BT /F1 11 Tf 14 TL 50 800 Td {text}ET".encode('latin-1', errors='replace')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids)
+    )
+
+    pdf = io.BytesIO()
+    pdf.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(pdf.tell())
+        pdf.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref_offset = pdf.tell()
+    pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        pdf.write(b"%010d 00000 n \n" % offset)
+    pdf.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+    return pdf.getvalue()
+
+def generate_document(rng, kind, pages=1):
+    """
+    Generate a synthetic document.
+
+    Args:
+        rng (random.Random): Random generator.
+        kind (str): Kind of document, one of KINDS.
+        pages (int): Number of pages of PDFs.
+
+    Returns:
+        bytes: The encoded document.
+
+    Raises:
+        ValueError: If the kind is not supported.
+    """
+    title = rng.choice(TITLES)
+    page_lines = [document_lines(rng, title) for _ in range(pages if kind.endswith("pdf") else 1)]
+    output = io.BytesIO()
+    if kind == "pdf":
+        return text_pdf(page_lines)
+    elif kind == "scanned_pdf":
+        images = [render_page(rng, lines) for lines in page_lines]
+        images[0].save(output, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    elif kind == "png":
+        render_page(rng, page_lines[0]).save(output, format="PNG")
+    elif kind == "jpg":
+        render_page(rng, page_lines[0]).save(output, format="JPEG", quality=90)
+    else:
+        raise ValueError(f"Unsupported document kind: {kind}")
+    return output.getvalue()
+
+def generate_corpus(directory, count, kinds=KINDS, pages=1, seed=0):
+    """
+    Write a corpus of synthetic documents, cycling through the kinds.
+
+    Args:
+        directory (str): Directory the documents are written to.
+        count (int): Number of documents.
+        kinds (iterable): Kinds of documents, see KINDS.
+        pages (int): Number of pages of PDFs.
+        seed (int): Seed of the generated content, so that corpora can be reproduced.
+
+    Returns:
+        list: Paths of the documents.
+    """
+    rng = random.Random(seed)
+    kinds = list(kinds)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        extension = "pdf" if kind.endswith("pdf") else kind
+        path = os.path.join(directory, f"{kind}_{i:05d}.{extension}")
+        with open(path, 'wb') as document:
+            document.write(generate_document(rng, kind, pages))
+        paths.append(path)
+    logger.info(f"Generated {count} documents in {directory}")
+    return paths
@@ -0,0 +1,254 @@
+import re
+import json
+import time
+import uuid
+import zlib
+import random
+import logging
+import threading
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import make_server
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class MockOpenAI:
+    def __init__(self, categories, latency=0.5, latency_jitter=0.1, error_rate=0.0, requests_per_minute=None,
+                 batch_latency=5, host="127.0.0.1", port=0, seed=0):
+        """
+        Initialize a local stand-in for the chat completions, files and batches endpoints of OpenAI.
+
+        Chat completions answer after a simulated latency with a category picked
+        deterministically from the request, so repeated runs classify alike. Batches
+        complete `batch_latency` seconds after they are created, with one result per task.
+
+        Args:
+            categories (list): Categories returned by the classifications.
+            latency (float): Mean seconds a chat completion takes.
+            latency_jitter (float): Standard deviation in seconds of the latency.
+            error_rate (float): Share of chat completions answered with a 500 error.
+            requests_per_minute (int, optional): Chat completions allowed per minute, further
+                requests are answered with a 429 error. Unlimited by default.
+            batch_latency (float): Seconds after which a batch is completed.
+            host (str): Interface the server listens on.
+            port (int): Port the server listens on, 0 to pick a free one.
+            seed (int): Seed of the simulated latencies and errors.
+        """
+        self.categories = categories
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.batch_latency = batch_latency
+        self.random = random.Random(seed)
+        self.files = {}
+        self.batches = {}
+        self.counters = {"chat_completions": 0, "errors": 0, "rate_limited": 0, "files": 0, "batches": 0, "batch_tasks": 0}
+        self._request_times = []
+        self._lock = threading.Lock()
+        self.app = self._create_app()
+        self._server = make_server(host, port, self.app, threaded=True)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """
+        Returns:
+            str: Base URL to give the OpenAI client, e.g. through OPENAI_BASE_URL.
+        """
+        return f"http://{self._server.host}:{self._server.port}/v1"
+
+    def start(self):
+        """
+        Start serving in a daemon thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        logger.info(f"Mock OpenAI server listening on {self.base_url}")
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+
+    def classify(self, body):
+        """
+        Build the content of the answer to a chat completion request.
+
+        Args:
+            body (dict): Body of the chat completion request.
+
+        Returns:
+            str: JSON classification, with a category per page for page classification requests.
+        """
+        user_content = body["messages"][-1]["content"]
+        seed = zlib.crc32(json.dumps(user_content, sort_keys=True).encode('utf-8'))
+        result = {"category": self.categories[seed % len(self.categories)]}
+        if body.get("response_format", {}).get("json_schema", {}).get("name") == "PagesClassification":
+            texts = [item["text"] for item in user_content if isinstance(item, dict) and item.get("type") == "text"]
+            result["pages"] = [
+                {"page": int(page), "category": result["category"]}
+                for page in re.findall(r"^Page (\d+):", "\n".join(texts), re.MULTILINE)
+            ]
+        return json.dumps(result)
+
+    def completion(self, body):
+        """
+        Build a chat completion answering a request.
+
+        Args:
+            body (dict): Body of the chat completion request.
+
+        Returns:
+            dict: The chat completion, with a token usage estimated from the request size.
+        """
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.classify(body), "refusal": None},
+                "logprobs": None,
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 10, "total_tokens": prompt_tokens + 10},
+        }
+
+    def _rate_limit_wait(self):
+        # Seconds until the next request is allowed, or 0 if it is allowed now
+        if self.requests_per_minute is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            self._request_times = [t for t in self._request_times if t > now - 60]
+            if len(self._request_times) >= self.requests_per_minute:
+                return self._request_times[0] + 60 - now
+            self._request_times.append(now)
+            return 0
+
+    def _count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def _error(self, status_code, message, headers=None):
+        response = jsonify({"error": {"message": message, "type": "mock_error", "code": None}})
+        response.status_code = status_code
+        for name, value in (headers or {}).items():
+            response.headers[name] = value
+        return response
+
+    def _batch_object(self, batch):
+        completed = not batch.get("cancelled") and time.time() >= batch["created_at"] + self.batch_latency
+        if completed and batch["output_file_id"] is None:
+            batch["output_file_id"] = self._complete_batch(batch)
+        return {
+            "id": batch["id"],
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "input_file_id": batch["input_file_id"],
+            "completion_window": batch["completion_window"],
+            "status": "cancelled" if batch.get("cancelled") else "completed" if completed else "in_progress",
+            "output_file_id": batch["output_file_id"],
+            "created_at": int(batch["created_at"]),
+            "request_counts": {"total": batch["total"], "completed": batch["total"] if completed else 0, "failed": 0},
+        }
+
+    def _complete_batch(self, batch):
+        output_lines = []
+        for line in self.files[batch["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            output_lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": task["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": self.completion(task["body"])},
+                "error": None,
+            }))
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        self.files[output_file_id] = ("\n".join(output_lines) + "\n").encode('utf-8')
+        return output_file_id
+
+    def _create_app(self):
+        app = Flask(__name__)
+
+        @app.route('/v1/chat/completions', methods=['POST'])
+        def chat_completions():
+            self._count("chat_completions")
+            wait = self._rate_limit_wait()
+            if wait > 0:
+                self._count("rate_limited")
+                return self._error(429, "Rate limit reached", {"retry-after": f"{wait:.3f}"})
+            with self._lock:
+                latency = max(0.0, self.random.gauss(self.latency, self.latency_jitter))
+                failed = self.random.random() < self.error_rate
+            time.sleep(latency)
+            if failed:
+                self._count("errors")
+                return self._error(500, "Simulated server error")
+            return jsonify(self.completion(request.get_json()))
+
+        @app.route('/v1/files', methods=['POST'])
+        def create_file():
+            self._count("files")
+            uploaded_file = request.files["file"]
+            file_id = f"file-{uuid.uuid4().hex}"
+            self.files[file_id] = uploaded_file.read()
+            return jsonify({
+                "id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": int(time.time()),
+                "filename": uploaded_file.filename, "purpose": request.form.get("purpose", "batch"), "status": "processed",
+            })
+
+        @app.route('/v1/files/<file_id>/content', methods=['GET'])
+        def file_content(file_id):
+            if file_id not in self.files:
+                return self._error(404, f"No such file: {file_id}")
+            return Response(self.files[file_id], mimetype="application/octet-stream")
+
+        @app.route('/v1/batches', methods=['POST'])
+        def create_batch():
+            body = request.get_json()
+            if body["input_file_id"] not in self.files:
+                return self._error(400, f"No such file: {body['input_file_id']}")
+            total = sum(1 for line in self.files[body["input_file_id"]].splitlines() if line.strip())
+            self._count("batches")
+            self._count("batch_tasks", total)
+            batch = {
+                "id": f"batch_{uuid.uuid4().hex}",
+                "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"],
+                "completion_window": body["completion_window"],
+                "created_at": time.time(),
+                "output_file_id": None,
+                "total": total,
+            }
+            with self._lock:
+                self.batches[batch["id"]] = batch
+            return jsonify(self._batch_object(batch))
+
+        @app.route('/v1/batches/<batch_id>', methods=['GET'])
+        def retrieve_batch(batch_id):
+            with self._lock:
+                batch = self.batches.get(batch_id)
+                if batch is None:
+                    return self._error(404, f"No such batch: {batch_id}")
+                return jsonify(self._batch_object(batch))
+
+        @app.route('/v1/batches/<batch_id>/cancel', methods=['POST'])
+        def cancel_batch(batch_id):
+            with self._lock:
+                batch = self.batches.get(batch_id)
+                if batch is None:
+                    return self._error(404, f"No such batch: {batch_id}")
+                if batch["output_file_id"] is None:
+                    batch["cancelled"] = True
+                return jsonify(self._batch_object(batch))
+
+        return app
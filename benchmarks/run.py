@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import mimetypes
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
+
+from benchmarks.corpus import KINDS, generate_corpus
+from benchmarks.mock_openai import MockOpenAI
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Categories returned by the mock server, as configured in the application
+CATEGORIES = ["invoice", "bank statement", "driver's license", "other"]
+
+# Metrics compared with the baseline, and whether higher values are better
+REGRESSION_METRICS = {
+    ("realtime", "docs_per_second"): True,
+    ("realtime", "latency_seconds", "p95"): False,
+    ("batch", "docs_per_second"): True,
+}
+
+def summarize(durations):
+    """
+    Summarize a list of durations.
+
+    Args:
+        durations (list): Durations in seconds.
+
+    Returns:
+        dict: Count, mean and p50/p95/p99 percentiles of the durations.
+    """
+    if not durations:
+        return {"count": 0}
+    values = np.asarray(durations)
+    return {
+        "count": len(durations),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+def peak_rss_mb():
+    """
+    Returns:
+        dict: Peak resident set size in MB of this process (the application, mock server and
+            clients) and of its largest terminated child, e.g. a conversion worker.
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    }
+
+def timed(durations, stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        durations.setdefault(stage, []).append(time.perf_counter() - start)
+
+def measure_stages(services, file_paths, use_text_layer=True):
+    """
+    Time each stage of the realtime pipeline, one document at a time.
+
+    Args:
+        services (Services): Components of the application.
+        file_paths (list): Paths of the documents.
+        use_text_layer (bool): Whether PDFs are classified from their text layer when they have one.
+
+    Returns:
+        dict: Summary of the durations of each stage: text extraction, rasterization,
+            image preparation and encoding, and classification.
+    """
+    file_processor, image_encoder, image_classifier = services.file_processor, services.image_encoder, services.image_classifier
+    durations = {}
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        try:
+            if use_text_layer and mimetypes.guess_type(file_path)[0] == "application/pdf":
+                text = timed(durations, "extract_text", file_processor.extract_pdf_text, content)
+                if text is not None:
+                    timed(durations, "classify", image_classifier.classify_text, text, filename=file_path)
+                    continue
+            image = timed(durations, "rasterize", file_processor.process_bytes, content, file_path)
+            prepared_image, _ = timed(durations, "prepare_image", image_encoder.prepare_image, image)
+            encoded_image = timed(durations, "encode", image_encoder.encode_bytes, prepared_image)
+            timed(durations, "classify", image_classifier.classify_image, encoded_image,
+                  mime_type=image_encoder.mime_type, filename=file_path)
+        except Exception as e:
+            logger.error(f"Error measuring stages of {file_path}: {e}")
+    return {stage: summarize(stage_durations) for stage, stage_durations in durations.items()}
+
+def run_realtime(base_url, file_paths, concurrency):
+    """
+    Classify each document with the 'classify_file' endpoint, from concurrent clients.
+
+    Args:
+        base_url (str): URL of the application.
+        file_paths (list): Paths of the documents.
+        concurrency (int): Number of concurrent clients.
+
+    Returns:
+        dict: Throughput, latency summary and number of failed requests.
+    """
+    latencies = []
+    errors = []
+
+    def classify(client, file_path):
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        start = time.perf_counter()
+        response = client.post(f"{base_url}/classify_file", files={"file": (os.path.basename(file_path), content)})
+        latency = time.perf_counter() - start
+        if response.status_code == 200:
+            latencies.append(latency)
+        else:
+            errors.append(f"{file_path}: {response.status_code} {response.text[:200]}")
+
+    start = time.perf_counter()
+    with httpx.Client(timeout=None) as client, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda file_path: classify(client, file_path), file_paths))
+    elapsed = time.perf_counter() - start
+    for error in errors[:5]:
+        logger.error(f"Realtime request failed: {error}")
+    return {
+        "documents": len(file_paths),
+        "errors": len(errors),
+        "elapsed_seconds": elapsed,
+        "docs_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": summarize(latencies),
+    }
+
+def run_batch(base_url, document_count, timeout, poll_interval=0.2):
+    """
+    Classify the documents of the files directory with the 'classify_files' endpoint and wait for the batch job.
+
+    Args:
+        base_url (str): URL of the application.
+        document_count (int): Number of documents in the files directory.
+        timeout (float): Seconds after which the batch job is given up.
+        poll_interval (float): Seconds between checks of the job status.
+
+    Returns:
+        dict: Throughput, submission time and time spent waiting for the batch job.
+    """
+    with httpx.Client(timeout=None) as client:
+        start = time.perf_counter()
+        response = client.get(f"{base_url}/classify_files")
+        submitted = time.perf_counter()
+        body = response.json()
+        if response.status_code not in (200, 202):
+            raise RuntimeError(f"Batch submission failed: {response.status_code} {body}")
+        classifications = body.get("classifications", [])
+        status = "completed"
+        if "job_id" in body:
+            while True:
+                job = client.get(f"{base_url}/batches/{body['job_id']}").json()
+                status = job["status"]
+                if status in ("completed", "failed") or time.perf_counter() - submitted > timeout:
+                    break
+                time.sleep(poll_interval)
+            classifications = job["classifications"]
+        end = time.perf_counter()
+    return {
+        "documents": document_count,
+        "classified": len(classifications),
+        "status": status,
+        "submit_seconds": submitted - start,
+        "batch_poll_seconds": end - submitted,
+        "elapsed_seconds": end - start,
+        "docs_per_second": len(classifications) / (end - start) if end > start else 0.0,
+    }
+
+def pipeline_stages(metrics):
+    """
+    Summarize the stage durations recorded by the application while serving the benchmark.
+
+    Args:
+        metrics (Metrics): Metrics registry of the application.
+
+    Returns:
+        dict: Count and mean duration of each stage, including those of the conversion workers.
+    """
+    stages = {}
+    for key, (_, _, total, count) in metrics.histograms.get("stage_duration_seconds", {}).items():
+        labels = dict(key)
+        stage = labels.pop("stage")
+        if labels.pop("error") == "true":
+            stage += ":error"
+        name = ",".join([stage] + [f"{label}={value}" for label, value in sorted(labels.items())])
+        stages[name] = {"count": count, "mean": total / count if count else 0.0}
+    return stages
+
+def metric(report, path):
+    for key in path:
+        report = report.get(key) if isinstance(report, dict) else None
+    return report
+
+def find_regressions(report, baseline, max_regression):
+    """
+    Compare a report with a baseline report.
+
+    Args:
+        report (dict): Report of this run.
+        baseline (dict): Report of a previous run.
+        max_regression (float): Tolerated relative change for the worse, e.g. 0.2 for 20%.
+
+    Returns:
+        list: Description of each metric that regressed beyond the tolerance.
+    """
+    regressions = []
+    for path, higher_is_better in REGRESSION_METRICS.items():
+        value, baseline_value = metric(report, path), metric(baseline, path)
+        if not value or not baseline_value:
+            continue
+        change = (baseline_value - value) / baseline_value if higher_is_better else (value - baseline_value) / baseline_value
+        if change > max_regression:
+            regressions.append(f"{'.'.join(path)}: {baseline_value:.4g} -> {value:.4g} ({change:.0%} worse)")
+    return regressions
+
+def configure_environment(args, work_dir, mock_url):
+    # The application reads its settings on import, so they are set before it is imported
+    os.environ.update({
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-benchmark"),
+        "OPENAI_BASE_URL": mock_url,
+        "FILES_DIRECTORY": os.path.join(work_dir, "files"),
+        "CLASSIFICATION_CACHE_PATH": os.path.join(work_dir, "classification_cache.db"),
+        "BATCH_REGISTRY_PATH": os.path.join(work_dir, "batch_jobs.db"),
+        "FILE_MANIFEST_PATH": os.path.join(work_dir, "file_manifest.db"),
+        "WORK_QUEUE_PATH": os.path.join(work_dir, "work_queue.db"),
+        "PRE_CLASSIFIER_INDEX_PATH": os.path.join(work_dir, "pre_classifier_index.npz"),
+        "BATCH_POLL_INITIAL_SECONDS": str(args.batch_poll_interval),
+        "BATCH_POLL_MAX_SECONDS": str(max(args.batch_poll_interval, 1)),
+        "CONVERSION_EXECUTOR": args.conversion_executor,
+    })
+
+def main(argv=None):
+    """
+    Benchmark the application offline against a mock OpenAI server, on a synthetic corpus.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--documents", type=int, default=40, help="Number of documents in the corpus")
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"Comma-separated document kinds among {', '.join(KINDS)}")
+    parser.add_argument("--pages", type=int, default=1, help="Number of pages of PDFs")
+    parser.add_argument("--phases", default="stages,realtime,batch", help="Comma-separated phases to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients of the realtime endpoint")
+    parser.add_argument("--warmup", type=int, help="Documents classified before the realtime phase is timed, "
+                                                   "to start the conversion workers (default: the concurrency)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mean latency in seconds of mock chat completions")
+    parser.add_argument("--latency-jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock chat completions failing with a 500")
+    parser.add_argument("--requests-per-minute", type=int, help="Rate limit of mock chat completions")
+    parser.add_argument("--batch-latency", type=float, default=2, help="Seconds a mock batch takes to complete")
+    parser.add_argument("--batch-poll-interval", type=float, default=0.5, help="Seconds between batch status checks")
+    parser.add_argument("--batch-timeout", type=float, default=300, help="Seconds after which the batch job is given up")
+    parser.add_argument("--conversion-executor", default="process", choices=["process", "thread"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path of the JSON report")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Tolerated relative regression of throughput and p95 latency against the baseline")
+    args = parser.parse_args(argv)
+    phases = args.phases.split(",")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        mock = MockOpenAI(
+            CATEGORIES, latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+            requests_per_minute=args.requests_per_minute, batch_latency=args.batch_latency, seed=args.seed,
+        )
+        mock.start()
+        configure_environment(args, work_dir, mock.base_url)
+        import src.app as app_module
+        import src.pipeline as pipeline
+        from src.utils.classification_cache import ClassificationCache
+        from src.utils.metrics import metrics
+        from werkzeug.serving import make_server
+
+        file_paths = generate_corpus(os.path.join(work_dir, "files"), args.documents, args.kinds.split(","),
+                                     args.pages, args.seed)
+        server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="benchmark-app", daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.port}"
+
+        report = {"settings": vars(args)}
+        try:
+            if "stages" in phases:
+                logger.info("Timing pipeline stages")
+                report["stages"] = measure_stages(app_module.get_services(), file_paths, app_module.USE_TEXT_LAYER)
+            if "realtime" in phases:
+                logger.info("Benchmarking the classify_file endpoint")
+                pipeline.classification_cache = ClassificationCache(os.path.join(work_dir, "realtime_cache.db"))
+                warmup = args.concurrency if args.warmup is None else args.warmup
+                if warmup:
+                    warmup_paths = generate_corpus(os.path.join(work_dir, "warmup"), warmup, args.kinds.split(","),
+                                                   args.pages, args.seed + 1)
+                    run_realtime(base_url, warmup_paths, args.concurrency)
+                report["realtime"] = run_realtime(base_url, file_paths, args.concurrency)
+            if "batch" in phases:
+                # A fresh cache, so that documents classified by the previous phase are classified again
+                logger.info("Benchmarking the classify_files endpoint")
+                pipeline.classification_cache = ClassificationCache(os.path.join(work_dir, "batch_cache.db"))
+                report["batch"] = run_batch(base_url, len(file_paths), args.batch_timeout)
+        finally:
+            server.shutdown()
+            if app_module.batch_poller is not None:
+                app_module.batch_poller.stop()
+            if app_module.conversion_executor is not None:
+                app_module.conversion_executor.shutdown()
+            mock.stop()
+        report["pipeline_stages"] = pipeline_stages(metrics)
+        report["mock_openai"] = dict(mock.counters)
+        report["routing"] = app_module.get_services().router.stats()
+        report["peak_rss_mb"] = peak_rss_mb()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = find_regressions(report, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
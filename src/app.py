@@ -1,17 +1,20 @@
-
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError
 import os
+import json
+import time
 import logging
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
-
-from src.file_processor import FileProcessor
-from src.image_classifier import ImageClassifier
-from src.image_encoder import ImageEncoder
-from src.utils.batch_monitor import BatchMonitor
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 
-# Load environment variables
-load_dotenv()
+from src.pipeline import (
+    BATCH_POLL_INITIAL_INTERVAL, CONVERSION_TIMEOUT, FILES_DIRECTORY, PAGE_SAMPLING, USE_TEXT_LAYER, classify_converted,
+    encode_pages, enqueue_files, get_batch_registry, get_classification_cache, get_file_manifest, get_pre_classifier,
+    get_services, get_work_queue, pre_classify,
+)
+from src.utils.batch_poller import BatchPoller
+from src.utils.conversion_executor import convert_document, create_conversion_executor, iter_converted_files
+from src.utils.metrics import SIZE_BUCKETS, call_measured, metrics
+from src.utils.near_duplicates import NearDuplicateIndex, fan_out_duplicates
+from src.utils.work_queue import STATUSES
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,12 +22,119 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Rescans and re-exports of the same document are classified once per batch
+NEAR_DUPLICATE_DETECTION = os.getenv("NEAR_DUPLICATE_DETECTION", "true").lower() == "true"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+
+# Executor converting documents to images, shared by both endpoints
+CONVERSION_EXECUTOR = os.getenv("CONVERSION_EXECUTOR", "process")
+CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", "0")) or os.cpu_count() or 1
+conversion_executor = None
+
+def get_conversion_executor():
+    """
+    Returns:
+        Executor: The conversion executor of this worker, created on first use.
+    """
+    global conversion_executor
+    if conversion_executor is None:
+        conversion_executor = create_conversion_executor(CONVERSION_EXECUTOR, CONVERSION_WORKERS)
+    return conversion_executor
+
+# Background poller of the registry of submitted batch jobs
+BATCH_POLL_MAX_ERRORS = int(os.getenv("BATCH_POLL_MAX_ERRORS", "10"))
+batch_poller = None
+
+# Threads of the ASGI application serving the Flask endpoints and advancing blocking response bodies
+ASGI_BRIDGE_THREADS = int(os.getenv("ASGI_BRIDGE_THREADS", "16"))
+
+# Split of the files classified within a deadline by the ASGI application between realtime and batch
+DISPATCH_MIN_REALTIME = int(os.getenv("DISPATCH_MIN_REALTIME", "0"))
+DISPATCH_EXPECTED_LATENCY = float(os.getenv("DISPATCH_EXPECTED_LATENCY_SECONDS", "10"))
+DISPATCH_SAFETY_FACTOR = float(os.getenv("DISPATCH_SAFETY_FACTOR", "2"))
+DISPATCH_MIN_BATCH_WINDOW = float(os.getenv("DISPATCH_MIN_BATCH_WINDOW_SECONDS", "900"))
+
+# Seconds between checks of the registry for new results while streaming them
+RESULTS_STREAM_POLL_INTERVAL = float(os.getenv("RESULTS_STREAM_POLL_SECONDS", "2"))
+# Seconds after which a streaming response ends with a cursor to resume from, so that it does not hold a worker for the life of the job
+RESULTS_STREAM_MAX_DURATION = float(os.getenv("RESULTS_STREAM_MAX_SECONDS", "300"))
+
+def ensure_batch_poller():
+    """
+    Start the background batch poller of this worker if needed and wake it up.
+    """
+    global batch_poller
+    if batch_poller is None:
+        batch_poller = BatchPoller(get_batch_registry(), get_services().batch_monitor, get_classification_cache(),
+                                   max_errors=BATCH_POLL_MAX_ERRORS)
+    batch_poller.start()
+    batch_poller.wake()
+
+def iter_batch_tasks(image_classifier, image_encoder, converted_files, classifications=None, cache_keys=None,
+                     near_duplicates=None):
+    """
+    Create a batch task for each converted file, from its text when there is one.
+
+    Files the pre-classifier is confident about are not turned into tasks; their
+    classifications are appended to `classifications` and cached instead. Near-duplicates
+    of a file already seen are skipped, their representative's result is fanned out
+    to them with `fan_out_duplicates`.
+
+    Args:
+        image_classifier (ImageClassifier): Classifier creating the tasks.
+        image_encoder (ImageEncoder): Encoder used to encode the images.
+        converted_files (iterable): File paths and converted documents from `iter_converted_files`.
+        classifications (list, optional): Receives the classifications of pre-classified files.
+        cache_keys (dict, optional): Classification cache key of each file path.
+        near_duplicates (NearDuplicateIndex, optional): Index of the files seen so far, by custom_id.
+
+    Yields:
+        dict: Task for batch processing.
+    """
+    for file_path, converted in converted_files:
+        if near_duplicates is not None:
+            with metrics.span("near_duplicates"):
+                representative = near_duplicates.add(f"task-{file_path}", converted)
+            if representative is not None:
+                metrics.inc("documents_total", endpoint="classify_files", outcome="duplicate")
+                continue
+        category = pre_classify(converted)
+        metrics.inc("documents_total", endpoint="classify_files", outcome="batched" if category is None else "pre_classified")
+        if category is not None:
+            if classifications is not None:
+                classifications.append({"custom_id": f"task-{file_path}", "category": category, "pre_classified": True})
+            if cache_keys is not None:
+                get_classification_cache().set(cache_keys[file_path], json.dumps({"category": category}))
+        elif "pages" in converted:
+            pages = encode_pages(image_encoder, converted["pages"])
+            yield image_classifier.create_batch_task(file_path, mime_type=image_encoder.mime_type, pages=pages)
+        elif "text" in converted:
+            yield image_classifier.create_batch_task(file_path, text=converted["text"])
+        else:
+            encoded_image = image_encoder.encode_bytes(converted["image"])
+            yield image_classifier.create_batch_task(file_path, base64_image=encoded_image, mime_type=image_encoder.mime_type)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    metrics.inc("requests_total", endpoint=endpoint, status=str(response.status_code))
+    if "request_start" in g:
+        metrics.observe("request_duration_seconds", time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
 # Flask Endpoint for Single File Classification
 @app.route('/classify_file', methods=['POST'])
 def classify_file():
     """
     Flask endpoint to classify an uploaded file.
 
+    An optional 'domain' form field routes the file to the fine-tuned model of that
+    domain instead of detecting it.
+
     Returns:
         Response: JSON response containing the classification result.
     """
@@ -40,29 +150,48 @@ def classify_file():
         if not file:
             return jsonify({"error": "No file provided"}), 400
 
-        # Save the uploaded file to a temporary directory
-        file_path = os.path.join("data/uploads", file.filename)
-        os.makedirs("data/uploads", exist_ok=True)
-        file.save(file_path)
+        image_classifier = get_services().image_classifier
+        domain = request.form.get('domain') or None
 
-        # Process the file to generate an image
-        file_processor = FileProcessor()
-        image_path = file_processor.process_file(file_path)
+        # Return the cached result if this exact document was classified before
+        with metrics.span("read_upload"):
+            content = file.read()
+        metrics.observe("document_bytes", len(content), buckets=SIZE_BUCKETS, endpoint="classify_file")
+        with metrics.span("cache_lookup"):
+            cache_key = image_classifier.cache_key(content, PAGE_SAMPLING, domain, USE_TEXT_LAYER)
+            cached_result = get_classification_cache().get(cache_key)
+        if cached_result is not None:
+            logger.info(f"Cache hit for uploaded file: {file.filename}")
+            metrics.inc("documents_total", endpoint="classify_file", outcome="cached")
+            return jsonify({"classification": cached_result}), 200
 
-        # Encode the image for classification
-        image_encoder = ImageEncoder()
-        encoded_image = image_encoder.encode_image(image_path)
+        # Process the file in memory to extract its text or generate an image prepared for the model
+        file_processor = get_services().file_processor
+        image_encoder = get_services().image_encoder
+        future = get_conversion_executor().submit(call_measured, convert_document, file_processor, image_encoder, content, file.filename, USE_TEXT_LAYER, PAGE_SAMPLING)
+        try:
+            with metrics.span("convert"):
+                converted, worker_metrics = future.result(timeout=CONVERSION_TIMEOUT)
+            metrics.merge(worker_metrics)
+        except TimeoutError:
+            future.cancel()
+            logger.error(f"Timed out converting uploaded file: {file.filename}")
+            return jsonify({"error": f"Timed out converting file after {CONVERSION_TIMEOUT} seconds"}), 504
 
-        # Set up classification categories and models
-        categories = ["invoice", "bank statement", "driver's license", "other"]
-        fine_tuned_models = {
-            "finance": "gpt-4o-finetuned-finance",
-            "healthcare": "gpt-4o-finetuned-healthcare",
-        }
+        # Answer locally when the pre-classifier is confident, otherwise escalate to the LLM
+        category = pre_classify(converted)
+        if category is not None:
+            logger.info(f"Pre-classified uploaded file {file.filename} as {category}")
+            metrics.inc("documents_total", endpoint="classify_file", outcome="pre_classified")
+            classification_result = json.dumps({"category": category})
+            get_classification_cache().set(cache_key, classification_result)
+            return jsonify({"classification": classification_result, "pre_classified": True}), 200
 
-        # Perform classification
-        image_classifier = ImageClassifier(api_key=os.getenv('OPENAI_API_KEY'), categories=categories, fine_tuned_models=fine_tuned_models)
-        classification_result = image_classifier.classify_image(encoded_image)
+        # Perform classification, from the text layer when there is one
+        classification_result = classify_converted(image_classifier, image_encoder, converted, file.filename, domain)
+        metrics.inc("documents_total", endpoint="classify_file", outcome="classified")
+        with metrics.span("cache_store"):
+            get_classification_cache().set(cache_key, classification_result)
 
         return jsonify({"classification": classification_result}), 200
     except Exception as e:
@@ -73,70 +202,511 @@ def classify_file():
 @app.route('/classify_files', methods=['GET'])
 def classify_files():
     """
-    Flask endpoint to classify multiple files from the 'files' directory.
+    Flask endpoint to classify multiple files from the FILES_DIRECTORY directory ('files' by default).
+
+    Cached results are returned right away. The remaining files are submitted as a
+    batch job whose progress is available from the 'batches/<job_id>' endpoint.
+
+    With the 'stream=true' query parameter, the response is NDJSON instead: one line
+    per classification as soon as it is known, including those of the batch job as
+    they are downloaded, and a final line with the status of the job.
+
+    With the 'incremental=true' query parameter, only the files that are new or changed
+    since the previous incremental call are read and classified, see `classify_changed_files`.
 
     Returns:
-        Response: JSON response containing the classification results.
+        Response: JSON response containing the cached classifications and the batch job ID.
     """
+    incremental = request.args.get("incremental", "false").lower() == "true"
+    stream = request.args.get("stream", "false").lower() == "true"
+    if incremental and stream:
+        return jsonify({"error": "Incremental classification does not support streaming"}), 400
+    if "deadline" in request.args:
+        # Holding a sync worker until the deadline would block it, see src/asgi_app.py
+        return jsonify({"error": "Classification within a deadline is served by the ASGI application"}), 400
     try:
-        # Directory containing files to classify
-        files_directory = "files"
-        file_paths = [os.path.join(files_directory, f) for f in os.listdir(files_directory) if os.path.isfile(os.path.join(files_directory, f))]
-
-        # Process each file concurrently to generate images
-        file_processor = FileProcessor()
-        processed_images = []
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {executor.submit(file_processor.process_file, file_path): file_path for file_path in file_paths}
-            for future in as_completed(futures):
-                try:
-                    image_path = future.result()
-                    processed_images.append(image_path)
-                    logger.info(f"Successfully processed file: {futures[future]}")
-                except Exception as e:
-                    logger.error(f"Error processing file {futures[future]}: {e}")
-
-        # Encode images for classification
-        image_encoder = ImageEncoder()
-        #encoded_images = [image_encoder.encode_image(image_path) for image_path in processed_images]
-        encoded_images_dict = {image_path: image_encoder.encode_image(image_path) for image_path in processed_images}
-
-        # Set up classification categories and models
-        categories = ["invoice", "bank statement", "driver's license", "other"]
-        fine_tuned_models = {
-            "finance": "gpt-4o-finetuned-finance",
-            "healthcare": "gpt-4o-finetuned-healthcare",
-        }
-
-        # Perform batch classification
-        image_classifier = ImageClassifier(api_key=os.getenv('OPENAI_API_KEY'), categories=categories, fine_tuned_models=fine_tuned_models)
-        tasks = image_classifier.create_batch_request(encoded_images_dict)
-        batch_job_id = image_classifier.execute_batch_job(tasks)
-
-        # Monitor the batch job using BatchMonitor
-        batch_monitor = BatchMonitor(api_key=os.getenv('OPENAI_API_KEY'))
-        classifications = batch_monitor.monitor_batch_job(batch_job_id)
-
-        return jsonify({"classifications": classifications}), 200
+        image_classifier = get_services().image_classifier
+        if incremental:
+            body, status = classify_changed_files(image_classifier)
+            return jsonify(body), status
+
+        cache_keys, classifications = scan_files(image_classifier)
+
+        if stream:
+            lines = iter_classify_files_lines(image_classifier, cache_keys, classifications)
+            return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+        if not cache_keys:
+            return jsonify({"classifications": classifications}), 200
+
+        job_id = submit_files(image_classifier, cache_keys, classifications)
+        if job_id is None:
+            return jsonify({"classifications": classifications}), 200
+
+        return jsonify({
+            "job_id": job_id,
+            "status": "in_progress",
+            "status_url": batch_status_url(job_id),
+            "classifications": classifications,
+        }), 202
     except Exception as e:
         logger.error(f"Error in classify_files endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
-# # Flask Endpoint for testing Batch Classification
-# @app.route('/test_batch', methods=['GET'])
-# def monitor_jobs():
-# # Assuming there's a batch query endpoint
-#     openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-#     response = openai_client.batches.list()  # Replace 'Batch.list()' with the correct method
-#     # Monitor the batch job using BatchMonitor
-#     batch_monitor = BatchMonitor(api_key=os.getenv('OPENAI_API_KEY'))
-    
-#     for batch in response:
-#         print(f"Batch {batch}")
-#         classifications = batch_monitor.monitor_batch_job(batch.id) #batch_673a72a5bd04819091cf899764b681e2
-        
-#         return jsonify({"classifications": classifications}), 200
-        
+def scan_files(image_classifier):
+    """
+    List the files of FILES_DIRECTORY and look up their classifications in the cache.
+
+    Args:
+        image_classifier (ImageClassifier): Classifier whose settings are part of the cache keys.
+
+    Returns:
+        tuple: Cache key of each file path to classify, and the cached classifications.
+    """
+    file_paths = [os.path.join(FILES_DIRECTORY, f) for f in os.listdir(FILES_DIRECTORY) if os.path.isfile(os.path.join(FILES_DIRECTORY, f))]
+
+    # Serve previously classified documents from the cache
+    classifications = []
+    cache_keys = {}
+    for file_path in file_paths:
+        with metrics.span("read_file"), open(file_path, 'rb') as f:
+            content = f.read()
+        metrics.observe("document_bytes", len(content), buckets=SIZE_BUCKETS, endpoint="classify_files")
+        with metrics.span("cache_lookup"):
+            cache_key = image_classifier.cache_key(content, PAGE_SAMPLING, use_text_layer=USE_TEXT_LAYER)
+            cached_result = get_classification_cache().get(cache_key)
+        if cached_result is None:
+            cache_keys[file_path] = cache_key
+            continue
+        metrics.inc("documents_total", endpoint="classify_files", outcome="cached")
+        if isinstance(cached_result, str):
+            cached_result = json.loads(cached_result)
+        classification = {"custom_id": f"task-{file_path}", "category": cached_result.get("category"), "cached": True}
+        if "pages" in cached_result:
+            classification["pages"] = cached_result["pages"]
+        classifications.append(classification)
+    logger.info(f"Cache hits: {len(classifications)}, files to classify: {len(cache_keys)}")
+    return cache_keys, classifications
+
+def classify_changed_files(image_classifier):
+    """
+    Classify the files of FILES_DIRECTORY that are new or changed since the previous call.
+
+    Files are compared with the manifest by their metadata, so unchanged files are not
+    read. Only new and changed files missing from the cache are submitted as a batch
+    job, along with unchanged files whose classification is neither known nor expected
+    from a job in progress, e.g. because their job failed. Deleted files are removed
+    from the manifest.
+
+    Args:
+        image_classifier (ImageClassifier): Classifier creating the batch jobs.
+
+    Returns:
+        tuple: Body of the response, with the number of new, changed, unchanged and deleted
+            files, the classifications that became known and the batch job ID, and its status code.
+    """
+    file_manifest = get_file_manifest()
+    with metrics.span("scan_manifest"):
+        changes = file_manifest.diff(FILES_DIRECTORY)
+    file_manifest.remove(changes["deleted"])
+
+    classifications = []
+    cache_keys = {}
+    results = {}
+    in_progress = 0
+
+    def add_cached(file_path, cached_result):
+        if isinstance(cached_result, str):
+            cached_result = json.loads(cached_result)
+        results[file_path] = {field: cached_result[field] for field in ("category", "pages") if field in cached_result}
+        classifications.append({"custom_id": f"task-{file_path}", **results[file_path], "cached": True})
+
+    for entry in changes["unchanged"]:
+        if entry["result"] is not None:
+            continue
+        # The results of batch jobs are stored in the cache once downloaded
+        cached_result = get_classification_cache().get(entry["cache_key"])
+        if cached_result is not None:
+            add_cached(entry["path"], cached_result)
+            continue
+        job = get_batch_registry().get(entry["job_id"], include_results=False) if entry["job_id"] else None
+        if job is not None and job["status"] in ("in_progress", "downloading"):
+            in_progress += 1
+            continue
+        cache_keys[entry["path"]] = entry["cache_key"]
+
+    for file_path, stat in changes["new"] + changes["changed"]:
+        with metrics.span("read_file"), open(file_path, 'rb') as f:
+            content = f.read()
+        metrics.observe("document_bytes", len(content), buckets=SIZE_BUCKETS, endpoint="classify_files")
+        with metrics.span("cache_lookup"):
+            cache_key = image_classifier.cache_key(content, PAGE_SAMPLING, use_text_layer=USE_TEXT_LAYER)
+            cached_result = get_classification_cache().get(cache_key)
+        file_manifest.record(file_path, stat, cache_key)
+        if cached_result is None:
+            cache_keys[file_path] = cache_key
+        else:
+            metrics.inc("documents_total", endpoint="classify_files", outcome="cached")
+            add_cached(file_path, cached_result)
+    logger.info(
+        f"Files new: {len(changes['new'])}, changed: {len(changes['changed'])}, deleted: {len(changes['deleted'])}, "
+        f"to classify: {len(cache_keys)}"
+    )
+
+    body = {
+        "new": len(changes["new"]),
+        "changed": len(changes["changed"]),
+        "unchanged": len(changes["unchanged"]),
+        "deleted": len(changes["deleted"]),
+        "in_progress": in_progress,
+    }
+    job_id = None
+    if cache_keys:
+        known = len(classifications)
+        job_id = submit_files(image_classifier, cache_keys, classifications)
+        # Pre-classified files and their near-duplicates are known without the batch
+        for classification in classifications[known:]:
+            results[classification["custom_id"][len("task-"):]] = {"category": classification["category"]}
+    file_manifest.set_results(results)
+    body["classifications"] = classifications
+    if job_id is None:
+        return body, 200
+
+    file_manifest.set_job([file_path for file_path in cache_keys if file_path not in results], job_id)
+    body.update({"job_id": job_id, "status": "in_progress", "status_url": batch_status_url(job_id)})
+    return body, 202
+
+def batch_status_url(job_id):
+    """
+    Returns:
+        str: Path of the status endpoint of a batch job, also outside of a Flask request.
+    """
+    return app.url_map.bind("").build('get_batch', {"job_id": job_id})
+
+def submit_files(image_classifier, cache_keys, classifications):
+    """
+    Convert files and submit those that need the LLM as a batch job.
+
+    Args:
+        image_classifier (ImageClassifier): Classifier creating the batch jobs.
+        cache_keys (dict): Classification cache key of each file path to classify.
+        classifications (list): Classifications known so far; receives those known without the batch,
+            e.g. pre-classified files.
+
+    Returns:
+        str: ID of the registered job, or None if no file had to be submitted.
+    """
+    # Convert and encode files one at a time while streaming them into batch input files
+    image_encoder = get_services().image_encoder
+    converted_files = iter_converted_files(
+        get_conversion_executor(), cache_keys, get_services().file_processor, image_encoder,
+        max_pending=CONVERSION_WORKERS, timeout=CONVERSION_TIMEOUT, use_text_layer=USE_TEXT_LAYER,
+        page_sampling=PAGE_SAMPLING,
+    )
+    near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_MAX_DISTANCE) if NEAR_DUPLICATE_DETECTION else None
+    tasks = iter_batch_tasks(image_classifier, image_encoder, converted_files, classifications, cache_keys, near_duplicates)
+    with metrics.span("submit_batch"):
+        batch_job_ids = image_classifier.execute_batch_jobs(tasks)
+
+    # Near-duplicates of pre-classified files are known right away, the others once the batch completes
+    duplicates = near_duplicates.duplicates if near_duplicates is not None else {}
+    duplicate_classifications = fan_out_duplicates(classifications, duplicates)
+    for classification in duplicate_classifications:
+        file_path = classification["custom_id"][len("task-"):]
+        get_classification_cache().set(cache_keys[file_path], json.dumps({"category": classification["category"]}))
+    classifications.extend(duplicate_classifications)
+
+    if not batch_job_ids:
+        return None
+
+    # Register the batch jobs and return without waiting for them
+    job_id = get_batch_registry().create(
+        batch_job_ids,
+        cache_keys={f"task-{file_path}": cache_key for file_path, cache_key in cache_keys.items()},
+        classifications=classifications,
+        duplicates=duplicates,
+        poll_interval=BATCH_POLL_INITIAL_INTERVAL,
+    )
+    ensure_batch_poller()
+    return job_id
+
+def follow_classify_files(image_classifier, cache_keys, classifications):
+    """
+    Classify files, yielding each classification as an NDJSON line as soon as it is known.
+
+    Waits are yielded instead of slept, so that an asynchronous server can wait without
+    holding a thread, see `iter_classify_files_lines` for a blocking iterator.
+
+    Args:
+        image_classifier (ImageClassifier): Classifier creating the batch jobs.
+        cache_keys (dict): Classification cache key of each file path to classify.
+        classifications (list): Classifications already known, e.g. cache hits.
+
+    Yields:
+        str or float: NDJSON lines with a classification, or with the status of the batch job,
+            and seconds to wait before the next line.
+    """
+    try:
+        for classification in classifications:
+            yield json.dumps(classification) + "\n"
+        known = len(classifications)
+        job_id = submit_files(image_classifier, cache_keys, classifications) if cache_keys else None
+        for classification in classifications[known:]:
+            yield json.dumps(classification) + "\n"
+        if job_id is None:
+            return
+        yield json.dumps({
+            "job_id": job_id,
+            "status": "in_progress",
+            "status_url": batch_status_url(job_id),
+        }) + "\n"
+        yield from follow_job_results(job_id, skip={classification["custom_id"] for classification in classifications})
+    except Exception as e:
+        logger.error(f"Error streaming classify_files results: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
+
+def follow_job_results(job_id, skip=(), after=0):
+    """
+    Follow the classifications of a batch job as they are stored, until the job ends or
+    for at most RESULTS_STREAM_MAX_DURATION seconds.
+
+    Waits are yielded instead of slept, see `follow_classify_files`.
+
+    Args:
+        job_id (str): ID of the job.
+        skip (set): Custom IDs of classifications that are not yielded, e.g. because the client already has them.
+        after (int): Only yield classifications stored after this sequence number, to resume a previous stream.
+
+    Yields:
+        str or float: NDJSON lines with a classification, then a final line with the status of the job, and
+            seconds to wait before the next line. If the job is still running when the time is up, the final
+            line holds the "next_url" resuming the stream.
+    """
+    stop_at = time.monotonic() + RESULTS_STREAM_MAX_DURATION
+    batch_registry = get_batch_registry()
+    job = batch_registry.get(job_id, include_results=False)
+    # Jobs registered before results were stored separately keep them on the job
+    if not after:
+        for classification in job["classifications"]:
+            if classification["custom_id"] not in skip:
+                yield json.dumps(classification) + "\n"
+    while True:
+        # Read the status first, so that every result stored before the job ended is yielded below
+        job = batch_registry.get(job_id, include_results=False)
+        while True:
+            results = batch_registry.results(job_id, after=after, limit=1000)
+            if not results:
+                break
+            for after, classification in results:
+                if classification["custom_id"] not in skip:
+                    yield json.dumps(classification) + "\n"
+        if job["status"] in ("completed", "failed"):
+            yield json.dumps({"job_id": job_id, "status": job["status"], "error": job["error"]}) + "\n"
+            return
+        remaining = stop_at - time.monotonic()
+        if remaining <= 0:
+            next_url = app.url_map.bind("").build('stream_batch_results', {"job_id": job_id, "after": after})
+            yield json.dumps({"job_id": job_id, "status": "in_progress", "next_url": next_url}) + "\n"
+            return
+        yield min(RESULTS_STREAM_POLL_INTERVAL, remaining)
+
+def sleep_between_lines(items):
+    """
+    Turn the output of `follow_classify_files` or `follow_job_results` into a blocking iterator of lines.
+
+    Args:
+        items (iterable): Lines and seconds to wait.
+
+    Yields:
+        str: The lines, after sleeping through the waits.
+    """
+    for item in items:
+        if isinstance(item, str):
+            yield item
+        else:
+            time.sleep(item)
+
+def iter_classify_files_lines(image_classifier, cache_keys, classifications):
+    """
+    Classify files, yielding each classification as an NDJSON line as soon as it is known, see `follow_classify_files`.
+
+    Returns:
+        iterator: NDJSON lines with a classification, or with the status of the batch job.
+    """
+    return sleep_between_lines(follow_classify_files(image_classifier, cache_keys, classifications))
+
+def iter_job_results_lines(job_id, skip=(), after=0):
+    """
+    Follow the classifications of a batch job as they are stored, see `follow_job_results`.
+
+    Returns:
+        iterator: NDJSON lines with a classification, then a final line with the status of the job.
+    """
+    return sleep_between_lines(follow_job_results(job_id, skip, after))
+
+# Flask Endpoint for Batch Job Status
+@app.route('/batches/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    """
+    Flask endpoint reporting the status of a batch classification job.
+
+    Args:
+        job_id (str): ID of the job returned by the 'classify_files' endpoint.
+
+    Returns:
+        Response: JSON response containing the job status and, once completed, its classifications.
+    """
+    try:
+        job = get_batch_registry().get(job_id)
+        if job is None:
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+        if job["status"] in ("in_progress", "downloading"):
+            # Make sure jobs submitted before a restart are still polled
+            ensure_batch_poller()
+
+        return jsonify({
+            "job_id": job_id,
+            "status": "in_progress" if job["status"] == "downloading" else job["status"],
+            "classifications": job["classifications"],
+            "error": job["error"],
+        }), 200
+    except Exception as e:
+        logger.error(f"Error in get_batch endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Flask Endpoint for Streaming Batch Job Results
+@app.route('/batches/<job_id>/results', methods=['GET'])
+def stream_batch_results(job_id):
+    """
+    Flask endpoint streaming the classifications of a batch job as NDJSON while they are downloaded.
+
+    The stream ends after RESULTS_STREAM_MAX_DURATION seconds, with a final line holding the
+    "next_url" to resume from, which passes the 'after' query parameter.
+
+    Args:
+        job_id (str): ID of the job returned by the 'classify_files' endpoint.
+
+    Returns:
+        Response: NDJSON response with one classification per line and a final line with the job status.
+    """
+    after = request.args.get("after", "0")
+    if not after.isdigit():
+        return jsonify({"error": "after must be a non-negative integer"}), 400
+    try:
+        job = get_batch_registry().get(job_id, include_results=False)
+        if job is None:
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+        if job["status"] in ("in_progress", "downloading"):
+            ensure_batch_poller()
+        return Response(iter_job_results_lines(job_id, after=int(after)), mimetype="application/x-ndjson")
+    except Exception as e:
+        logger.error(f"Error in stream_batch_results endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Flask Endpoint for Enqueuing Files
+@app.route('/queue', methods=['POST'])
+def enqueue_files_endpoint():
+    """
+    Flask endpoint adding the files of FILES_DIRECTORY to the work queue processed by the queue workers.
+
+    Files already enqueued with the same content are not added again, so calling it
+    repeatedly only enqueues new and changed files.
+
+    Returns:
+        Response: JSON response with the number of enqueued files and the queue statistics.
+    """
+    try:
+        counts = enqueue_files()
+        return jsonify({**counts, "queue": get_work_queue().stats()}), 200
+    except Exception as e:
+        logger.error(f"Error in enqueue_files endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Flask Endpoint for Work Queue Items
+@app.route('/queue/items', methods=['GET'])
+def queue_items():
+    """
+    Flask endpoint listing the items of the work queue with their results, e.g. the
+    dead-lettered ones with '?status=dead'. Pages follow with '?after=<item_id>'.
+
+    Returns:
+        Response: JSON response containing the items and the queue statistics.
+    """
+    status = request.args.get("status")
+    if status is not None and status not in STATUSES:
+        return jsonify({"error": f"Unknown status: {status}"}), 400
+    try:
+        work_queue = get_work_queue()
+        items = work_queue.items(status, after=request.args.get("after", 0, type=int),
+                                 limit=request.args.get("limit", 100, type=int))
+        return jsonify({"items": items, "queue": work_queue.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error in queue_items endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Flask Endpoint for Retrying Dead-Lettered Items
+@app.route('/queue/retry', methods=['POST'])
+def retry_dead_items():
+    """
+    Flask endpoint putting the dead-lettered items of the work queue back in the queue.
+
+    Returns:
+        Response: JSON response with the number of items put back.
+    """
+    try:
+        work_queue = get_work_queue()
+        return jsonify({"retried": work_queue.retry_dead(), "queue": work_queue.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error in retry_dead_items endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Flask Endpoint for Classification Cache Statistics
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Flask endpoint reporting classification cache hit/miss counters.
+
+    Returns:
+        Response: JSON response containing the cache statistics.
+    """
+    return jsonify(get_classification_cache().stats()), 200
+
+# Flask Endpoint for Pre-Classifier Statistics
+@app.route('/pre_classifier/stats', methods=['GET'])
+def pre_classifier_stats():
+    """
+    Flask endpoint reporting how many documents the pre-classifier escalated to the LLM.
+
+    Returns:
+        Response: JSON response containing the pre-classifier statistics.
+    """
+    classifier = get_pre_classifier()
+    if classifier is None:
+        return jsonify({"error": "Pre-classifier is disabled"}), 404
+    return jsonify(classifier.stats()), 200
+
+# Flask Endpoint for Prometheus Metrics
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Flask endpoint exposing stage durations, request and document counters, payload sizes
+    and token usage of this worker in the Prometheus text format.
+
+    Returns:
+        Response: The metrics in the Prometheus text exposition format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Flask Endpoint for Model Routing Statistics
+@app.route('/routing/stats', methods=['GET'])
+def routing_stats():
+    """
+    Flask endpoint reporting the traffic, latency and estimated cost of each model route.
+
+    Returns:
+        Response: JSON response containing the statistics of each route.
+    """
+    return jsonify(get_services().router.stats()), 200
 
 if __name__ == "__main__":
     # Run the Flask application
@@ -0,0 +1,474 @@
+import io
+import os
+import re
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wrappers import Request
+
+import src.app as app_module
+import src.pipeline as pipeline
+from src.hybrid_dispatcher import HybridDispatcher
+from src.utils.conversion_executor import convert_document, iter_converted_files
+from src.utils.metrics import SIZE_BUCKETS, call_measured, metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# ASGI application serving the classification endpoints asynchronously, e.g. with
+# `uvicorn src.asgi_app:app`. While a document waits on OpenAI it only holds a coroutine,
+# not a worker, so a single process serves as many classifications at once as
+# ASYNC_MAX_CONCURRENCY allows. Conversion runs on the conversion executor, and blocking
+# cache and batch calls on threads. The other endpoints are served by the Flask application.
+# Settings and shared components are read from `src.app` and `src.pipeline` when a request is handled.
+# Flask endpoints and blocking response bodies run on a pool of ASGI_BRIDGE_THREADS
+# threads of their own, so that they cannot take the threads of the `asyncio.to_thread`
+# calls of the classification endpoints. Result streams wait without holding a thread.
+
+bridge_executor = None
+
+def get_bridge_executor():
+    """
+    Returns:
+        ThreadPoolExecutor: Pool serving the Flask endpoints and advancing blocking response bodies,
+            created on first use.
+    """
+    global bridge_executor
+    if bridge_executor is None:
+        bridge_executor = ThreadPoolExecutor(max_workers=app_module.ASGI_BRIDGE_THREADS, thread_name_prefix="asgi-bridge")
+    return bridge_executor
+
+def build_environ(scope, body):
+    """
+    Build the WSGI environ of an HTTP request received over ASGI.
+
+    Args:
+        scope (dict): ASGI connection scope of the request.
+        body (bytes): Body of the request.
+
+    Returns:
+        dict: The WSGI environ.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode('utf-8').decode('latin-1'),
+        "PATH_INFO": scope["path"].encode('utf-8').decode('latin-1'),
+        "QUERY_STRING": scope.get("query_string", b"").decode('latin-1'),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode('latin-1').upper().replace("-", "_")
+        value = value.decode('latin-1')
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def read_body(receive):
+    """
+    Returns:
+        bytes: The whole body of the request.
+    """
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+async def send_json(send, body, status=200):
+    """
+    Send a JSON response.
+
+    Returns:
+        int: The status code, for the request metrics.
+    """
+    content = json.dumps(body).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(content)).encode('latin-1'))],
+    })
+    await send({"type": "http.response.body", "body": content})
+    return status
+
+async def send_chunks(send, status, headers, chunks, context=None):
+    """
+    Send a response whose body is produced by a blocking iterator, e.g. a generator
+    of NDJSON lines or a WSGI response, iterated on the bridge executor.
+
+    Args:
+        send (callable): ASGI send callable.
+        status (int): Status code of the response.
+        headers (list): Header names and values, as strings.
+        chunks (iterable): Chunks of the body, as strings or bytes, and seconds to wait
+            before the next chunk, waited without holding a thread.
+        context (contextvars.Context, optional): Context the iterator is advanced in, so that
+            context variables it sets are kept from one chunk to the next.
+    """
+    context = context or contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    iterator = iter(chunks)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    while True:
+        chunk = await loop.run_in_executor(get_bridge_executor(), context.run, next, iterator, None)
+        if chunk is None:
+            break
+        if isinstance(chunk, (int, float)):
+            await asyncio.sleep(chunk)
+        elif chunk:
+            await send({"type": "http.response.body", "body": chunk.encode('utf-8') if isinstance(chunk, str) else chunk,
+                        "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+async def call_wsgi(wsgi_app, scope, receive, send):
+    """
+    Serve a request with a WSGI application on the bridge executor, streaming its response.
+
+    Returns:
+        int: The status code of the response.
+    """
+    environ = build_environ(scope, await read_body(receive))
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+        return lambda data: None
+
+    # Flask keeps its request context in context variables, set by the application
+    # and used again while a streamed response is iterated
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    body = await loop.run_in_executor(get_bridge_executor(), context.run, wsgi_app, environ, start_response)
+    try:
+        await send_chunks(send, response["status"], response["headers"], body, context)
+    finally:
+        if hasattr(body, "close"):
+            await loop.run_in_executor(get_bridge_executor(), context.run, body.close)
+    return response["status"]
+
+async def classify_file(scope, receive, send):
+    """
+    ASGI endpoint to classify an uploaded file, like the 'classify_file' endpoint of the Flask application.
+
+    Returns:
+        int: The status code of the response.
+    """
+    request = Request(build_environ(scope, await read_body(receive)))
+    if 'file' not in request.files:
+        return await send_json(send, {"error": "No file part in the request"}, 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return await send_json(send, {"error": "No selected file"}, 400)
+
+    try:
+        services = app_module.get_services()
+        image_classifier = services.async_image_classifier
+        domain = request.form.get('domain') or None
+
+        # Return the cached result if this exact document was classified before
+        with metrics.span("read_upload"):
+            content = file.read()
+        metrics.observe("document_bytes", len(content), buckets=SIZE_BUCKETS, endpoint="classify_file")
+        with metrics.span("cache_lookup"):
+            cache_key = image_classifier.cache_key(content, app_module.PAGE_SAMPLING, domain, app_module.USE_TEXT_LAYER)
+            cached_result = await asyncio.to_thread(app_module.get_classification_cache().get, cache_key)
+        if cached_result is not None:
+            logger.info(f"Cache hit for uploaded file: {file.filename}")
+            metrics.inc("documents_total", endpoint="classify_file", outcome="cached")
+            return await send_json(send, {"classification": cached_result})
+
+        # Convert the file on the conversion executor, without blocking the event loop
+        image_encoder = services.image_encoder
+        future = asyncio.get_running_loop().run_in_executor(
+            app_module.get_conversion_executor(), call_measured, convert_document, services.file_processor,
+            image_encoder, content, file.filename, app_module.USE_TEXT_LAYER, app_module.PAGE_SAMPLING,
+        )
+        try:
+            with metrics.span("convert"):
+                converted, worker_metrics = await asyncio.wait_for(future, app_module.CONVERSION_TIMEOUT)
+            metrics.merge(worker_metrics)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out converting uploaded file: {file.filename}")
+            return await send_json(send, {"error": f"Timed out converting file after {app_module.CONVERSION_TIMEOUT} seconds"}, 504)
+
+        # Answer locally when the pre-classifier is confident, otherwise escalate to the LLM
+        category = await asyncio.to_thread(app_module.pre_classify, converted)
+        if category is not None:
+            logger.info(f"Pre-classified uploaded file {file.filename} as {category}")
+            metrics.inc("documents_total", endpoint="classify_file", outcome="pre_classified")
+            classification_result = json.dumps({"category": category})
+            await asyncio.to_thread(app_module.get_classification_cache().set, cache_key, classification_result)
+            return await send_json(send, {"classification": classification_result, "pre_classified": True})
+
+        # Perform classification, from the text layer when there is one
+        if "pages" in converted:
+            pages = await asyncio.to_thread(app_module.encode_pages, image_encoder, converted["pages"])
+            classification_result = await image_classifier.classify_pages(pages, mime_type=image_encoder.mime_type,
+                                                                          filename=file.filename, domain=domain)
+        elif "text" in converted:
+            classification_result = await image_classifier.classify_text(converted["text"], filename=file.filename,
+                                                                         domain=domain)
+        else:
+            encoded_image = await asyncio.to_thread(image_encoder.encode_bytes, converted["image"])
+            classification_result = await image_classifier.classify_image(encoded_image, mime_type=image_encoder.mime_type,
+                                                                          filename=file.filename, domain=domain)
+        metrics.inc("documents_total", endpoint="classify_file", outcome="classified")
+        with metrics.span("cache_store"):
+            await asyncio.to_thread(app_module.get_classification_cache().set, cache_key, classification_result)
+
+        return await send_json(send, {"classification": classification_result})
+    except Exception as e:
+        logger.error(f"Error in classify_file endpoint: {e}")
+        return await send_json(send, {"error": str(e)}, 500)
+
+async def classify_files(scope, receive, send):
+    """
+    ASGI endpoint to classify the files of FILES_DIRECTORY, like the 'classify_files' endpoint of the Flask application.
+
+    Returns:
+        int: The status code of the response.
+    """
+    request = Request(build_environ(scope, await read_body(receive)))
+    incremental = request.args.get("incremental", "false").lower() == "true"
+    stream = request.args.get("stream", "false").lower() == "true"
+    deadline = request.args.get("deadline")
+    if deadline is not None:
+        try:
+            deadline = float(deadline)
+        except ValueError:
+            deadline = math.nan
+        if not 0 < deadline < math.inf:
+            return await send_json(send, {"error": "The deadline must be a positive number of seconds"}, 400)
+    if incremental and stream:
+        return await send_json(send, {"error": "Incremental classification does not support streaming"}, 400)
+    if deadline is not None and (incremental or stream):
+        return await send_json(send, {"error": "Classification within a deadline does not support incremental or streaming"}, 400)
+    try:
+        image_classifier = app_module.get_services().image_classifier
+        if deadline is not None:
+            urgent = [os.path.join(app_module.FILES_DIRECTORY, name) for name in request.args.getlist("urgent")]
+            return await send_json(send, await classify_files_within(deadline, urgent))
+        if incremental:
+            body, status = await asyncio.to_thread(app_module.classify_changed_files, image_classifier)
+            return await send_json(send, body, status)
+
+        cache_keys, classifications = await asyncio.to_thread(app_module.scan_files, image_classifier)
+
+        if stream:
+            lines = app_module.follow_classify_files(image_classifier, cache_keys, classifications)
+            await send_chunks(send, 200, [("Content-Type", "application/x-ndjson")], lines)
+            return 200
+
+        if not cache_keys:
+            return await send_json(send, {"classifications": classifications})
+
+        job_id = await asyncio.to_thread(app_module.submit_files, image_classifier, cache_keys, classifications)
+        if job_id is None:
+            return await send_json(send, {"classifications": classifications})
+
+        return await send_json(send, {
+            "job_id": job_id,
+            "status": "in_progress",
+            "status_url": app_module.batch_status_url(job_id),
+            "classifications": classifications,
+        }, 202)
+    except Exception as e:
+        logger.error(f"Error in classify_files endpoint: {e}")
+        return await send_json(send, {"error": str(e)}, 500)
+
+def convert_files(cache_keys, classifications):
+    """
+    Convert files for the hybrid dispatcher, answering those the pre-classifier is confident about.
+
+    Args:
+        cache_keys (dict): Classification cache key of each file path to classify.
+        classifications (list): Receives the classifications of pre-classified files.
+
+    Returns:
+        dict: Converted documents to classify, by file path.
+    """
+    services = app_module.get_services()
+    converted_files = iter_converted_files(
+        app_module.get_conversion_executor(), cache_keys, services.file_processor, services.image_encoder,
+        max_pending=app_module.CONVERSION_WORKERS, timeout=app_module.CONVERSION_TIMEOUT,
+        use_text_layer=app_module.USE_TEXT_LAYER, page_sampling=app_module.PAGE_SAMPLING,
+    )
+    documents = {}
+    for file_path, converted in converted_files:
+        category = app_module.pre_classify(converted)
+        if category is None:
+            documents[file_path] = converted
+            continue
+        metrics.inc("documents_total", endpoint="classify_files", outcome="pre_classified")
+        classifications.append({"custom_id": f"task-{file_path}", "category": category, "pre_classified": True})
+        app_module.get_classification_cache().set(cache_keys[file_path], json.dumps({"category": category}))
+    return documents
+
+async def classify_files_within(deadline, urgent=()):
+    """
+    Classify the files of FILES_DIRECTORY within a deadline, across realtime requests and
+    a batch job, see HybridDispatcher.
+
+    Every file is converted before dispatching, and held in memory until the response is
+    sent. The conversion time counts against the deadline but is not bounded by it, so a
+    large directory can use up the deadline before any file is classified. The batches are
+    not recorded in the BatchJobRegistry, so their results are lost if the process stops
+    before the response is sent.
+
+    Args:
+        deadline (float): Seconds within which the files should be classified.
+        urgent (list): Paths of files classified in realtime regardless of the deadline.
+
+    Returns:
+        dict: Body of the response, with the classification of every file and the path it was classified by.
+    """
+    start = time.monotonic()
+    services = app_module.get_services()
+    cache_keys, classifications = await asyncio.to_thread(app_module.scan_files, services.image_classifier)
+    documents = await asyncio.to_thread(convert_files, cache_keys, classifications)
+    dispatcher = HybridDispatcher(
+        services.image_classifier, services.async_image_classifier, services.batch_monitor, services.image_encoder,
+        min_realtime=app_module.DISPATCH_MIN_REALTIME, expected_latency=app_module.DISPATCH_EXPECTED_LATENCY,
+        safety_factor=app_module.DISPATCH_SAFETY_FACTOR, min_batch_window=app_module.DISPATCH_MIN_BATCH_WINDOW,
+    )
+    results = await dispatcher.dispatch(documents, deadline - (time.monotonic() - start), urgent)
+    for file_path, result in results.items():
+        if result["category"] is not None:
+            cached_result = {field: result[field] for field in ("category", "pages") if field in result}
+            await asyncio.to_thread(app_module.get_classification_cache().set, cache_keys[file_path], json.dumps(cached_result))
+        classifications.append({"custom_id": f"task-{file_path}", **result})
+    return {"classifications": classifications, "elapsed_seconds": time.monotonic() - start}
+
+async def stream_batch_results(scope, receive, send):
+    """
+    ASGI endpoint streaming the classifications of a batch job, like the 'stream_batch_results'
+    endpoint of the Flask application, waiting for new results without holding a thread.
+
+    Returns:
+        int: The status code of the response.
+    """
+    request = Request(build_environ(scope, await read_body(receive)))
+    job_id = scope["path_params"]["job_id"]
+    after = request.args.get("after", "0")
+    if not after.isdigit():
+        return await send_json(send, {"error": "after must be a non-negative integer"}, 400)
+    try:
+        job = await asyncio.to_thread(app_module.get_batch_registry().get, job_id, include_results=False)
+        if job is None:
+            return await send_json(send, {"error": f"Unknown job: {job_id}"}, 404)
+        if job["status"] in ("in_progress", "downloading"):
+            await asyncio.to_thread(app_module.ensure_batch_poller)
+    except Exception as e:
+        logger.error(f"Error in stream_batch_results endpoint: {e}")
+        return await send_json(send, {"error": str(e)}, 500)
+    lines = app_module.follow_job_results(job_id, after=int(after))
+    await send_chunks(send, 200, [("Content-Type", "application/x-ndjson")], lines)
+    return 200
+
+# Endpoints served asynchronously, by method and path
+ROUTES = {
+    ("POST", "/classify_file"): ("classify_file", classify_file),
+    ("GET", "/classify_files"): ("classify_files", classify_files),
+}
+# Endpoints served asynchronously whose path holds parameters, by method and path pattern
+PATTERN_ROUTES = [
+    ("GET", re.compile(r"/batches/(?P<job_id>[^/]+)/results"), ("stream_batch_results", stream_batch_results)),
+]
+
+def match_route(scope):
+    """
+    Find the asynchronous endpoint of a request, adding the parameters of its path to the scope.
+
+    Returns:
+        tuple: Name and handler of the endpoint, or None if the request is served by the Flask application.
+    """
+    route = ROUTES.get((scope["method"], scope["path"]))
+    if route is not None:
+        return route
+    for method, pattern, route in PATTERN_ROUTES:
+        match = pattern.fullmatch(scope["path"])
+        if method == scope["method"] and match is not None:
+            scope["path_params"] = match.groupdict()
+            return route
+    return None
+
+async def lifespan(receive, send):
+    """
+    Handle the startup and shutdown of the server, closing the OpenAI clients on shutdown.
+    """
+    global bridge_executor
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if pipeline.services is not None:
+                await pipeline.services.aclose()
+            if app_module.batch_poller is not None:
+                app_module.batch_poller.stop()
+            if bridge_executor is not None:
+                bridge_executor.shutdown(wait=False, cancel_futures=True)
+                bridge_executor = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """
+    ASGI application serving the classification endpoints asynchronously and the
+    other endpoints with the Flask application.
+
+    Args:
+        scope (dict): ASGI connection scope.
+        receive (callable): ASGI receive callable.
+        send (callable): ASGI send callable.
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    route = match_route(scope)
+    if route is None:
+        # Request metrics are recorded by the hooks of the Flask application
+        await call_wsgi(app_module.app, scope, receive, send)
+        return
+
+    endpoint, handler = route
+    start = time.perf_counter()
+    status = 500
+    try:
+        status = await handler(scope, receive, send)
+    finally:
+        metrics.inc("requests_total", endpoint=endpoint, status=str(status))
+        metrics.observe("request_duration_seconds", time.perf_counter() - start, endpoint=endpoint)
@@ -0,0 +1,186 @@
+import time
+import random
+import asyncio
+import logging
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+
+from src.image_classifier import ImageClassifier
+from src.utils.rate_limiter import AsyncRateLimiter
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class AsyncImageClassifier(ImageClassifier):
+    def __init__(self, api_key, categories, fine_tuned_models=None, text_model="gpt-4o-mini", max_concurrency=20,
+                 requests_per_minute=500, tokens_per_minute=300000, tokens_per_request=1500,
+                 max_retries=5, initial_backoff=1.0, max_backoff=60.0, client=None, router=None):
+        """
+        Initialize the AsyncImageClassifier for concurrent single-document classification.
+
+        Only the realtime classification methods are asynchronous; use ImageClassifier
+        for Batch API jobs.
+
+        Args:
+            api_key (str): The API key for OpenAI.
+            categories (list): List of categories for classification.
+            fine_tuned_models (dict, optional): Dictionary of fine-tuned models.
+            text_model (str): Model used to classify documents from their extracted text.
+            max_concurrency (int): Maximum number of requests in flight at once.
+            requests_per_minute (int, optional): Client-side requests per minute limit.
+            tokens_per_minute (int, optional): Client-side tokens per minute limit.
+            tokens_per_request (int): Tokens reserved per request against the tokens per minute limit.
+                The default covers a high detail image prepared by ImageEncoder plus the prompt.
+            max_retries (int): Number of retries on rate limit, server and connection errors.
+            initial_backoff (float): Upper bound in seconds of the first retry delay.
+            max_backoff (float): Upper bound in seconds of any retry delay.
+            client (AsyncOpenAI, optional): Client to share with other components. It should not
+                retry requests itself. A new client is created by default.
+            router (ModelRouter, optional): Router picking the model of each document, e.g. shared
+                with an ImageClassifier. By default a router over `fine_tuned_models` is created.
+        """
+        super().__init__(api_key, categories, fine_tuned_models, text_model=text_model, client=client, router=router)
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        self.tokens_per_request = tokens_per_request
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    def _create_client(self, api_key):
+        # Retries are handled by this class so that they respect the rate limiter
+        return AsyncOpenAI(api_key=api_key, max_retries=0)
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, APIConnectionError)
+
+    def _backoff(self, attempt, error):
+        # Full jitter: a random delay up to the exponential bound
+        delay = random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                delay = max(delay, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    async def _parse(self, route, model, messages, response_format=None):
+        attempt = 0
+        start = time.monotonic()
+        while True:
+            try:
+                async with self.semaphore:
+                    await self.rate_limiter.acquire(self.tokens_per_request)
+                    response = await self.client.beta.chat.completions.parse(
+                        model=model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        response_format=response_format or self.resp_format
+                    )
+                self._record_request(route, model, messages, time.monotonic() - start, response)
+                return response.choices[0].message.content
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    self._record_request(route, model, messages, time.monotonic() - start)
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"Retrying classification in {delay:.2f} seconds (attempt {attempt}): {e}")
+                await asyncio.sleep(delay)
+
+    async def classify_image(self, base64_image, mime_type="image/jpeg", filename=None, domain=None):
+        """
+        Classify a single image, retrying rate limit and server errors.
+
+        Args:
+            base64_image (str): Base64 encoded string of the image.
+            mime_type (str): MIME type of the encoded image.
+            filename (str, optional): Name of the document, used to pick the model.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+        Returns:
+            dict: Classification result.
+        """
+        try:
+            route, model = self.route_image(filename, domain)
+            return await self._parse(route, model, self.build_messages(base64_image, mime_type))
+        except Exception as e:
+            logger.error(f"Error classifying image: {e}")
+            raise
+
+    async def classify_text(self, text, filename=None, domain=None):
+        """
+        Classify a document from its extracted text, retrying rate limit and server errors.
+
+        Args:
+            text (str): Text extracted from the document.
+            filename (str, optional): Name of the document, used to pick the model.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+        Returns:
+            dict: Classification result.
+        """
+        try:
+            route, model = self.route_text(text, filename, domain)
+            return await self._parse(route, model, self.build_text_messages(text))
+        except Exception as e:
+            logger.error(f"Error classifying text: {e}")
+            raise
+
+    async def classify_pages(self, pages, mime_type="image/jpeg", filename=None, domain=None):
+        """
+        Classify a sample of the pages of a document in a single request, retrying rate limit and server errors.
+
+        Args:
+            pages (list): Dicts with the 1-based "page" number and either its "text" or
+                its base64 encoded "image".
+            mime_type (str): MIME type of the encoded images.
+            filename (str, optional): Name of the document, used to pick the model.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+        Returns:
+            dict: Classification result with the category of the document and of each page.
+        """
+        try:
+            route, model = self.route_pages(pages, filename, domain)
+            return await self._parse(route, model, self.build_pages_messages(pages, mime_type), self.pages_resp_format)
+        except Exception as e:
+            logger.error(f"Error classifying pages: {e}")
+            raise
+
+    async def classify_images(self, images_dict, mime_type="image/jpeg", return_exceptions=False):
+        """
+        Classify many images concurrently, yielding results as they complete.
+
+        Args:
+            images_dict (dict): Dict of image identifiers and base64 encoded images.
+            mime_type (str): MIME type of the encoded images.
+            return_exceptions (bool): Yield the exception of a failed image as its result
+                instead of raising it.
+
+        Yields:
+            tuple: Image identifier and classification result.
+        """
+        async def classify(key, base64_image):
+            try:
+                return key, await self.classify_image(base64_image, mime_type, filename=key), None
+            except Exception as e:
+                return key, None, e
+
+        tasks = [asyncio.ensure_future(classify(key, base64_image)) for key, base64_image in images_dict.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                key, result, error = await next_done
+                if error is not None:
+                    if not return_exceptions:
+                        raise error
+                    result = error
+                yield key, result
+        finally:
+            for task in tasks:
+                task.cancel()
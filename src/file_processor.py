@@ -1,11 +1,20 @@
+import io
 import os
+import time
 import logging
+import zipfile
+import textwrap
 import mimetypes
-from pdf2image import convert_from_path  # Needs poppler (installation via Homebrew in macOS environments)
+import xml.etree.ElementTree as ET
+from pdf2image import convert_from_bytes, convert_from_path  # Needs poppler (installation via Homebrew in macOS environments)
+from pdf2image.exceptions import PDFPopplerTimeoutError
 from dotenv import load_dotenv
-import docx2pdf  # Convert Word to PDF
+from PIL import Image, ImageDraw, ImageFont
+from pypdf import PdfReader
 import pandas as pd
 
+from src.utils.metrics import metrics
+
 
 # Load environment variables
 load_dotenv()
@@ -14,11 +23,33 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+WORD_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+EXCEL_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
 class FileProcessor:
-    def __init__(self, output_folder="data/images"):
+    def __init__(self, output_folder="data/images", dpi=200, max_dimension=2048, grayscale=False, timeout=None,
+                 min_text_chars=50):
+        """
+        Initialize the FileProcessor with rasterization settings.
+
+        Args:
+            output_folder (str): Folder where rendered page images are saved.
+            dpi (int): Resolution used to render PDF pages when no max_dimension is set.
+            max_dimension (int, optional): Longest side in pixels of rendered pages. Takes precedence over dpi.
+                Defaults to 2048, the largest side the vision model uses before downscaling.
+            grayscale (bool): Whether to render PDF pages in grayscale.
+            timeout (int, optional): Seconds the PDF renderer processes of a document may run in total
+                before they are killed.
+            min_text_chars (int): Minimum number of letters and digits on the first page of a PDF
+                for its text layer to be used instead of rendering it.
+        """
         self.output_folder = output_folder
-        # Ensure output folder exists
-        os.makedirs(self.output_folder, exist_ok=True)
+        self.dpi = dpi
+        self.max_dimension = max_dimension
+        self.grayscale = grayscale
+        self.timeout = timeout
+        self.min_text_chars = min_text_chars
 
     def process_file(self, file_path):
         """
@@ -37,21 +68,195 @@ class FileProcessor:
         
         if file_type == "application/pdf":
             return self.convert_pdf_to_images(file_path)
-        elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            pdf_path = self.convert_word_to_pdf(file_path)
-            return self.convert_pdf_to_images(pdf_path)
-        elif file_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            pdf_path = self.convert_excel_to_pdf(file_path)
-            return self.convert_pdf_to_images(pdf_path)
+        elif file_type in (WORD_MIME_TYPE, EXCEL_MIME_TYPE):
+            with open(file_path, 'rb') as f:
+                image = self.convert_office_document_to_image(f.read(), file_type)
+            return self._save_first_page(image, file_path)
         elif file_type == "image/jpeg" or file_type == "image/png":
             # Directly return the image path for jpg/png files
             return file_path
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
 
+    def process_bytes(self, content, filename):
+        """
+        Process the given file content in memory and return the image to classify.
+
+        Unlike `process_file`, nothing is written to disk.
+
+        Args:
+            content (bytes): Raw bytes of the file.
+            filename (str): Name of the file, used to determine its type.
+
+        Returns:
+            bytes: Encoded image (PNG for rendered documents, unchanged bytes for images).
+
+        Raises:
+            ValueError: If the file type is not supported.
+        """
+        file_type, _ = mimetypes.guess_type(filename)
+
+        if file_type == "application/pdf":
+            return self.convert_pdf_bytes_to_image(content)
+        elif file_type in (WORD_MIME_TYPE, EXCEL_MIME_TYPE):
+            return self._to_png_bytes(self.convert_office_document_to_image(content, file_type))
+        elif file_type == "image/jpeg" or file_type == "image/png":
+            # Images are classified as they are
+            return content
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+
+    def extract_pdf_text(self, content):
+        """
+        Extract the text layer of the first page of a PDF document.
+
+        Args:
+            content (bytes): Content of the PDF file.
+
+        Returns:
+            str: Text of the first page, or None if the PDF has no usable text layer,
+                e.g. because it is a scan.
+        """
+        try:
+            with metrics.span("extract_text"):
+                text = PdfReader(io.BytesIO(content)).pages[0].extract_text() or ""
+        except Exception as e:
+            logger.warning(f"Could not extract PDF text layer: {e}")
+            return None
+        return self._usable_text(text)
+
+    def _usable_text(self, text):
+        if sum(char.isalnum() for char in text) < self.min_text_chars:
+            return None
+        return text
+
+    @staticmethod
+    def sample_page_numbers(page_count, every=0, max_pages=4):
+        """
+        Choose the pages of a document to classify.
+
+        The first and last pages are always sampled, plus every k-th page when `every`
+        is set. If that exceeds `max_pages`, the pages in between are thinned out
+        evenly, so the cost of a document is bounded by `max_pages` whatever its length.
+
+        Args:
+            page_count (int): Number of pages of the document.
+            every (int): Sample every k-th page in addition to the first and last, 0 to disable.
+            max_pages (int): Maximum number of sampled pages.
+
+        Returns:
+            list: Sorted 1-based numbers of the sampled pages.
+        """
+        page_numbers = {1, page_count}
+        if every:
+            page_numbers.update(range(1, page_count + 1, every))
+        page_numbers = sorted(page_numbers)
+        if len(page_numbers) <= max_pages:
+            return page_numbers
+        if max_pages <= 1:
+            return page_numbers[:1]
+        middle = page_numbers[1:-1]
+        keep = max_pages - 2
+        return [page_numbers[0]] + [middle[i * len(middle) // keep] for i in range(keep)] + [page_numbers[-1]]
+
+    def process_pages(self, content, filename, every=0, max_pages=4, use_text_layer=True):
+        """
+        Convert a sample of the pages of a document held in memory.
+
+        Only the sampled pages of a PDF are read or rendered. Pages with a usable text
+        layer are returned as text, the others are rendered. Other documents have a
+        single page, converted as by `process_bytes`.
+
+        Args:
+            content (bytes): Raw bytes of the file.
+            filename (str): Name of the file, used to determine its type.
+            every (int): Sample every k-th page in addition to the first and last, 0 to disable.
+            max_pages (int): Maximum number of sampled pages.
+            use_text_layer (bool): Whether to use the text layer of pages when there is one.
+
+        Returns:
+            list: Dicts with the 1-based "page" number and either its "text" or its PNG encoded "image".
+
+        Raises:
+            ValueError: If the file type is not supported.
+        """
+        if mimetypes.guess_type(filename)[0] != "application/pdf":
+            return [{"page": 1, "image": self.process_bytes(content, filename)}]
+
+        reader = PdfReader(io.BytesIO(content))
+        page_numbers = self.sample_page_numbers(len(reader.pages), every, max_pages)
+        pages = {}
+        if use_text_layer:
+            with metrics.span("extract_text"):
+                for page_number in page_numbers:
+                    try:
+                        text = self._usable_text(reader.pages[page_number - 1].extract_text() or "")
+                    except Exception as e:
+                        logger.warning(f"Could not extract text layer of page {page_number}: {e}")
+                        text = None
+                    if text is not None:
+                        pages[page_number] = {"page": page_number, "text": text}
+
+        page_numbers_to_render = [page_number for page_number in page_numbers if page_number not in pages]
+        try:
+            images = self.render_pdf_pages(content, page_numbers_to_render) if page_numbers_to_render else []
+        except Exception as e:
+            logger.error(f"Error converting PDF to images: {e}")
+            raise
+        for page_number, image in zip(page_numbers_to_render, images):
+            pages[page_number] = {"page": page_number, "image": self._to_png_bytes(image)}
+        return [pages[page_number] for page_number in page_numbers]
+
+    def render_pdf_pages(self, pdf, page_numbers=(1,)):
+        """
+        Render only the requested pages of a PDF document.
+
+        Pages outside the request are never rendered, so time and memory depend
+        on the number of requested pages rather than on the length of the document.
+        All renderer calls of the document share the timeout of the processor.
+
+        Args:
+            pdf (str or bytes): The path to the PDF file, or its content.
+            page_numbers (iterable): 1-based numbers of the pages to render.
+
+        Returns:
+            list: PIL images of the requested pages, in the requested order.
+
+        Raises:
+            PDFPopplerTimeoutError: If rendering takes longer than the timeout.
+        """
+        # Render runs of consecutive pages with a single converter call
+        runs = []
+        for page_number in page_numbers:
+            if runs and page_number == runs[-1][1] + 1:
+                runs[-1][1] = page_number
+            else:
+                runs.append([page_number, page_number])
+
+        converter = convert_from_bytes if isinstance(pdf, bytes) else convert_from_path
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        images = []
+        with metrics.span("rasterize"):
+            for first_page, last_page in runs:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        raise PDFPopplerTimeoutError(f"Rendering timed out after {self.timeout} seconds")
+                images.extend(converter(
+                    pdf,
+                    dpi=self.dpi,
+                    size=self.max_dimension,
+                    first_page=first_page,
+                    last_page=last_page,
+                    grayscale=self.grayscale,
+                    timeout=timeout,
+                ))
+        return images
+
     def convert_pdf_to_images(self, pdf_path):
         """
-        Convert a PDF file to images. Only the first page is saved as an image.
+        Convert a PDF file to images. Only the first page is rendered and saved as an image.
 
         Args:
             pdf_path (str): The path to the PDF file to be converted.
@@ -60,53 +265,142 @@ class FileProcessor:
             str: Path to the saved image.
         """
         try:
-            images = convert_from_path(pdf_path)
-            output_filename = os.path.splitext(os.path.basename(pdf_path))[0] + "_page_1.png"
-            output_path = os.path.join(self.output_folder, output_filename)
-            images[0].save(output_path, "PNG")
-            logger.info(f"Saved image to {output_path}")
-            return output_path
+            images = self.render_pdf_pages(pdf_path, page_numbers=(1,))
+            return self._save_first_page(images[0], pdf_path)
         except Exception as e:
             logger.error(f"Error converting PDF to images: {e}")
             raise
 
-    def convert_word_to_pdf(self, word_path):
+    def convert_pdf_bytes_to_image(self, pdf_content):
         """
-        Convert a Word document to PDF.
+        Render the first page of a PDF document held in memory.
 
         Args:
-            word_path (str): The path to the Word file to be converted.
+            pdf_content (bytes): Content of the PDF file.
 
         Returns:
-            str: Path to the converted PDF.
+            bytes: PNG encoded image of the first page.
         """
         try:
-            pdf_path = word_path.replace(".docx", ".pdf")
-            docx2pdf.convert(word_path, pdf_path)
-            logger.info(f"Converted Word document to PDF: {pdf_path}")
-            return pdf_path
+            images = self.render_pdf_pages(pdf_content, page_numbers=(1,))
+            return self._to_png_bytes(images[0])
         except Exception as e:
-            logger.error(f"Error converting Word to PDF: {e}")
+            logger.error(f"Error converting PDF to images: {e}")
             raise
 
-    def convert_excel_to_pdf(self, excel_path):
+    def convert_office_document_to_image(self, content, file_type):
         """
-        Convert an Excel document to PDF.
+        Render the text of a Word or Excel document to an image of its first page.
+
+        The text is drawn directly instead of converting the document with an office
+        suite, which keeps conversion local, fast and free of external processes.
+        Layout is approximate, which is enough to classify the document.
 
         Args:
-            excel_path (str): The path to the Excel file to be converted.
+            content (bytes): Raw bytes of the .docx or .xlsx file.
+            file_type (str): MIME type of the document.
 
         Returns:
-            str: Path to the converted PDF.
+            PIL.Image.Image: Rendered first page.
         """
         try:
-            excel_data = pd.read_excel(excel_path, sheet_name=None)
-            pdf_path = excel_path.replace(".xlsx", ".pdf")
-            with pd.ExcelWriter(pdf_path, engine='xlsxwriter') as writer:
-                for sheet_name, df in excel_data.items():
-                    df.to_excel(writer, sheet_name=sheet_name)
-            logger.info(f"Converted Excel document to PDF: {pdf_path}")
-            return pdf_path
+            with metrics.span("render_office"):
+                if file_type == WORD_MIME_TYPE:
+                    lines = self.extract_word_text(content)
+                else:
+                    lines = self.extract_excel_text(content)
+                image = self.render_text_to_image(lines)
+            logger.info(f"Rendered {file_type} document to an image")
+            return image
         except Exception as e:
-            logger.error(f"Error converting Excel to PDF: {e}")
+            logger.error(f"Error converting office document to image: {e}")
             raise
+
+    @staticmethod
+    def extract_word_text(content):
+        """
+        Extract the paragraphs of a Word document.
+
+        Args:
+            content (bytes): Raw bytes of the .docx file.
+
+        Returns:
+            list: Text of each paragraph, including those in tables.
+        """
+        with zipfile.ZipFile(io.BytesIO(content)) as docx:
+            root = ET.fromstring(docx.read("word/document.xml"))
+        paragraphs = []
+        for paragraph in root.iter(f"{WORD_NAMESPACE}p"):
+            text = []
+            for element in paragraph.iter():
+                if element.tag == f"{WORD_NAMESPACE}t" and element.text:
+                    text.append(element.text)
+                elif element.tag == f"{WORD_NAMESPACE}tab":
+                    text.append("    ")
+            paragraphs.append("".join(text))
+        return paragraphs
+
+    @staticmethod
+    def extract_excel_text(content, max_rows=100):
+        """
+        Extract the cell values of an Excel workbook, one line per row.
+
+        Args:
+            content (bytes): Raw bytes of the .xlsx file.
+            max_rows (int): Maximum number of rows read per sheet.
+
+        Returns:
+            list: A heading line per sheet followed by its rows.
+        """
+        lines = []
+        sheets = pd.read_excel(io.BytesIO(content), sheet_name=None, header=None, nrows=max_rows)
+        for sheet_name, df in sheets.items():
+            lines.append(f"[{sheet_name}]")
+            for row in df.itertuples(index=False):
+                lines.append(" | ".join(str(value) for value in row if not pd.isna(value)))
+        return lines
+
+    def render_text_to_image(self, lines):
+        """
+        Draw lines of text on a portrait page, wrapping long lines.
+
+        Args:
+            lines (list): Lines of text; text that does not fit on the page is dropped.
+
+        Returns:
+            PIL.Image.Image: Grayscale image of the page.
+        """
+        height = self.max_dimension or 2048
+        width = round(height / 1.414)  # A4 proportions
+        margin = height // 30
+        font_size = height // 70
+        line_height = round(font_size * 1.4)
+        font = ImageFont.load_default(size=font_size)
+        chars_per_line = max(1, int((width - 2 * margin) / (font_size * 0.55)))
+
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        y = margin
+        for line in lines:
+            for wrapped_line in textwrap.wrap(line, chars_per_line) or [""]:
+                if y + line_height > height - margin:
+                    return image
+                draw.text((margin, y), wrapped_line, fill=0, font=font)
+                y += line_height
+        return image
+
+    def _save_first_page(self, image, source_path):
+        output_filename = os.path.splitext(os.path.basename(source_path))[0] + "_page_1.png"
+        output_path = os.path.join(self.output_folder, output_filename)
+        os.makedirs(self.output_folder, exist_ok=True)
+        with metrics.span("save_image"):
+            image.save(output_path, "PNG")
+        logger.info(f"Saved image to {output_path}")
+        return output_path
+
+    @staticmethod
+    def _to_png_bytes(image):
+        buffer = io.BytesIO()
+        with metrics.span("png_encode"):
+            image.save(buffer, "PNG")
+        return buffer.getvalue()
@@ -0,0 +1,252 @@
+import math
+import time
+import json
+import asyncio
+import logging
+
+from src.utils.batch_monitor import FAILED_STATUSES
+from src.utils.metrics import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class HybridDispatcher:
+    def __init__(self, image_classifier, async_image_classifier, batch_monitor, image_encoder, min_realtime=0,
+                 expected_latency=10.0, safety_factor=2.0, min_batch_window=900):
+        """
+        Initialize a dispatcher classifying a set of documents within a deadline, across
+        realtime requests and Batch API jobs.
+
+        Urgent documents and the first `min_realtime` ones are classified in realtime right
+        away. As many of the others as can still be classified in realtime after a fallback
+        time go to a batch job, at the cheaper batch price; the rest is classified in
+        realtime too. Documents whose batch is not done by the fallback time are classified
+        in realtime, and their unfinished batches cancelled, so that the deadline is met.
+
+        The time realtime classification takes is estimated from the average latency the
+        router observed, the concurrency of the asynchronous classifier and a safety factor.
+
+        Args:
+            image_classifier (ImageClassifier): Classifier creating the batch jobs.
+            async_image_classifier (AsyncImageClassifier): Classifier of the realtime requests.
+            batch_monitor (BatchMonitor): Monitor used to check and cancel batches and download their results.
+            image_encoder (ImageEncoder): Encoder used to encode the images of the documents.
+            min_realtime (int): Number of documents classified in realtime first, so that the
+                first results arrive quickly.
+            expected_latency (float): Seconds a realtime classification is expected to take until
+                the router observed some.
+            safety_factor (float): Factor applied to the estimated time of realtime classification.
+            min_batch_window (float): Minimum seconds between the submission of a batch and the
+                fallback time. Batches rarely complete faster, so with less time left every
+                document is classified in realtime.
+        """
+        self.image_classifier = image_classifier
+        self.async_image_classifier = async_image_classifier
+        self.batch_monitor = batch_monitor
+        self.image_encoder = image_encoder
+        self.min_realtime = min_realtime
+        self.expected_latency = expected_latency
+        self.safety_factor = safety_factor
+        self.min_batch_window = min_batch_window
+
+    def estimated_latency(self):
+        """
+        Returns:
+            float: Average latency in seconds of the realtime requests observed by the router,
+                or `expected_latency` before any was observed.
+        """
+        stats = self.async_image_classifier.router.stats().values()
+        requests = sum(route_stats["requests"] for route_stats in stats)
+        if not requests:
+            return self.expected_latency
+        return sum(route_stats["latency_seconds"] for route_stats in stats) / requests
+
+    def realtime_seconds(self, count, latency=None):
+        """
+        Estimate the time needed to classify documents in realtime.
+
+        Args:
+            count (int): Number of documents.
+            latency (float, optional): Latency of a request, estimated by default.
+
+        Returns:
+            float: Estimated seconds, including the safety factor.
+        """
+        latency = self.estimated_latency() if latency is None else latency
+        rounds = math.ceil(count / self.async_image_classifier.max_concurrency)
+        return rounds * latency * self.safety_factor
+
+    def plan(self, task_ids, deadline, urgent=()):
+        """
+        Split documents between realtime requests and a batch job.
+
+        Args:
+            task_ids (list): IDs of the documents, in order of priority.
+            deadline (float): Seconds within which every document must be classified.
+            urgent (iterable): IDs of documents classified in realtime regardless of the deadline.
+
+        Returns:
+            tuple: IDs of the documents classified in realtime, IDs of those submitted as a
+                batch job, and seconds after which documents of unfinished batches are classified
+                in realtime instead, or None without batch.
+        """
+        urgent = set(urgent)
+        realtime_ids = [task_id for task_id in task_ids if task_id in urgent]
+        rest = [task_id for task_id in task_ids if task_id not in urgent]
+        realtime_ids += rest[:self.min_realtime]
+        rest = rest[self.min_realtime:]
+
+        # Keep the largest tail of the documents on the batch such that both the documents
+        # classified in realtime right away and a fallback of the whole batch fit in the deadline
+        latency = self.estimated_latency()
+        concurrency = self.async_image_classifier.max_concurrency
+        batch_size = len(rest)
+        while batch_size > 0:
+            fallback_after = deadline - self.realtime_seconds(batch_size, latency)
+            realtime_size = len(realtime_ids) + len(rest) - batch_size
+            if fallback_after >= max(self.min_batch_window, self.realtime_seconds(realtime_size, latency)):
+                split = len(rest) - batch_size
+                logger.info(f"Dispatching {len(realtime_ids) + split} documents in realtime and {batch_size} as a batch, "
+                            f"falling back to realtime after {fallback_after:.0f} seconds")
+                return realtime_ids + rest[:split], rest[split:], fallback_after
+            # Move a round of the concurrency to realtime, the fallback then takes a round less
+            batch_size = (math.ceil(batch_size / concurrency) - 1) * concurrency
+        if self.realtime_seconds(len(task_ids), latency) > deadline:
+            logger.warning(f"{len(task_ids)} documents may not be classified within {deadline} seconds")
+        return realtime_ids + rest, [], None
+
+    def _encode(self, document):
+        if "pages" in document:
+            return {"pages": [{**page, "image": self.image_encoder.encode_bytes(page["image"])} if "image" in page else page
+                              for page in document["pages"]]}
+        if "text" in document:
+            return document
+        return {"image": self.image_encoder.encode_bytes(document["image"])}
+
+    def _batch_task(self, task_id, document):
+        encoded = self._encode(document)
+        return self.image_classifier.create_batch_task(
+            task_id, base64_image=encoded.get("image"), mime_type=self.image_encoder.mime_type,
+            text=encoded.get("text"), pages=encoded.get("pages"),
+        )
+
+    async def _classify_realtime(self, task_id, document, path):
+        try:
+            encoded = await asyncio.to_thread(self._encode, document)
+            mime_type = self.image_encoder.mime_type
+            if "pages" in encoded:
+                result = await self.async_image_classifier.classify_pages(encoded["pages"], mime_type=mime_type, filename=task_id)
+            elif "text" in encoded:
+                result = await self.async_image_classifier.classify_text(encoded["text"], filename=task_id)
+            else:
+                result = await self.async_image_classifier.classify_image(encoded["image"], mime_type=mime_type, filename=task_id)
+            result = json.loads(result) if isinstance(result, str) else dict(result)
+        except Exception as e:
+            logger.error(f"Error classifying {task_id} in realtime: {e}")
+            result = {"category": None, "error": str(e)}
+        metrics.inc("documents_total", endpoint="dispatch", outcome=path)
+        return task_id, {**result, "path": path}
+
+    async def _check_batch(self, batch_job_id):
+        # Returns whether the batch is done, with its results by custom_id if it completed
+        batch = await asyncio.to_thread(self.batch_monitor.check_batch_job, batch_job_id)
+        if batch.status == "completed":
+            results = {}
+            if batch.output_file_id is not None:
+                classifications = await asyncio.to_thread(list, self.batch_monitor.iter_results(batch.output_file_id))
+                results.update((classification["custom_id"], classification) for classification in classifications)
+            return True, results
+        if batch.status in FAILED_STATUSES:
+            logger.error(f"Batch {batch_job_id} {batch.status}, its documents are classified in realtime")
+            return True, {}
+        return False, {}
+
+    async def _wait_for_batches(self, batch_job_ids, until):
+        # Results of the batches that completed before the fallback time, by custom_id
+        results = {}
+        pending = list(batch_job_ids)
+        # Batches that could not be checked or downloaded, cancelled along with the unfinished ones
+        abandoned = []
+        poll_interval = self.batch_monitor.initial_poll_interval
+        try:
+            while pending:
+                for batch_job_id in list(pending):
+                    try:
+                        done, batch_results = await self._check_batch(batch_job_id)
+                    except Exception as e:
+                        logger.error(f"Error checking batch {batch_job_id}, its documents are classified in realtime: {e}")
+                        pending.remove(batch_job_id)
+                        abandoned.append(batch_job_id)
+                        continue
+                    if done:
+                        results.update(batch_results)
+                        pending.remove(batch_job_id)
+                remaining = until - time.monotonic()
+                if not pending or remaining <= 0:
+                    break
+                await asyncio.sleep(min(poll_interval, remaining))
+                poll_interval = self.batch_monitor.next_poll_interval(poll_interval)
+        finally:
+            for batch_job_id in abandoned + pending:
+                try:
+                    await asyncio.to_thread(self.batch_monitor.cancel_batch_job, batch_job_id)
+                except Exception as e:
+                    logger.error(f"Error cancelling batch {batch_job_id}: {e}")
+        return results
+
+    async def dispatch(self, documents, deadline, urgent=()):
+        """
+        Classify documents within a deadline.
+
+        Args:
+            documents (dict): Documents converted by `convert_document`, by task ID (e.g. file path),
+                in order of priority.
+            deadline (float): Seconds within which every document should be classified.
+            urgent (iterable): IDs of documents classified in realtime regardless of the deadline.
+
+        Returns:
+            dict: Classification of each document by task ID, with the "path" it was classified
+                by: "realtime", "batch" or "fallback" to realtime. Documents that failed have a
+                None category and an "error".
+        """
+        start = time.monotonic()
+        realtime_ids, batch_ids, fallback_after = self.plan(list(documents), deadline, urgent)
+        realtime_tasks = [
+            asyncio.ensure_future(self._classify_realtime(task_id, documents[task_id], "realtime"))
+            for task_id in realtime_ids
+        ]
+        results = {}
+        try:
+            if batch_ids:
+                try:
+                    batch_job_ids = await asyncio.to_thread(
+                        self.image_classifier.execute_batch_jobs,
+                        (self._batch_task(task_id, documents[task_id]) for task_id in batch_ids),
+                    )
+                except Exception as e:
+                    logger.error(f"Error submitting batch, its documents are classified in realtime: {e}")
+                    batch_job_ids = []
+                batch_results = await self._wait_for_batches(batch_job_ids, start + fallback_after)
+                fallback_ids = []
+                for task_id in batch_ids:
+                    classification = batch_results.get(f"task-{task_id}")
+                    # Documents without a classification from their batch are retried in realtime
+                    if classification is None or classification["category"] is None:
+                        fallback_ids.append(task_id)
+                        continue
+                    metrics.inc("documents_total", endpoint="dispatch", outcome="batch")
+                    results[task_id] = {field: classification[field] for field in ("category", "pages") if field in classification}
+                    results[task_id]["path"] = "batch"
+                if fallback_ids:
+                    logger.warning(f"Classifying {len(fallback_ids)} documents of unfinished or failed batches in realtime")
+                realtime_tasks += [
+                    asyncio.ensure_future(self._classify_realtime(task_id, documents[task_id], "fallback"))
+                    for task_id in fallback_ids
+                ]
+            results.update(await asyncio.gather(*realtime_tasks))
+        finally:
+            for task in realtime_tasks:
+                task.cancel()
+        logger.info(f"Dispatched {len(documents)} documents in {time.monotonic() - start:.1f} seconds")
+        return results
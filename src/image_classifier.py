@@ -1,8 +1,14 @@
+import time
 import logging
 from dotenv import load_dotenv
 import json
+import tempfile
 from openai import OpenAI
 
+from src.utils.classification_cache import ClassificationCache
+from src.utils.metrics import SIZE_BUCKETS, metrics
+from src.utils.model_router import ModelRouter
+
 # Load environment variables
 load_dotenv()
 
@@ -11,21 +17,41 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 class ImageClassifier:
-    def __init__(self, api_key, categories, fine_tuned_models=None):
+    # OpenAI Batch API limits per input file
+    MAX_BATCH_REQUESTS = 50000
+    MAX_BATCH_FILE_BYTES = 200 * 1024 * 1024
+
+    def __init__(self, api_key, categories, fine_tuned_models=None, text_model="gpt-4o-mini", max_text_chars=4000,
+                 client=None, router=None):
         """
         Initialize the ImageClassifier with API credentials and categories.
 
         Args:
             api_key (str): The API key for OpenAI.
             categories (list): List of categories for classification.
-            fine_tuned_models (dict, optional): Dictionary of fine-tuned models.
+            fine_tuned_models (dict, optional): Fine-tuned model of each domain. Documents detected
+                to belong to one of these domains are classified with its model.
+            text_model (str): Model used to classify documents from their extracted text.
+            max_text_chars (int): Number of characters of extracted text sent for classification.
+            client (OpenAI, optional): Client to share with other components, e.g. to reuse its
+                connection pool. A new client is created by default.
+            router (ModelRouter, optional): Router picking the model of each document. By default
+                a router over `fine_tuned_models` is created.
         """
-        self.client = OpenAI(api_key=api_key)
+        self.client = client if client is not None else self._create_client(api_key)
+        self.model = "gpt-4o-2024-08-06"
+        self.temperature = 0.2
         self.categories = categories
         self.fine_tuned_models = fine_tuned_models or {}
         self.classification_system_prompt = (
             f"Your goal is to classify the images into one of the following categories: {', '.join(self.categories)}."
         )
+        self.text_model = text_model
+        self.max_text_chars = max_text_chars
+        self.router = router if router is not None else ModelRouter(self.fine_tuned_models, self.model, self.text_model)
+        self.text_classification_system_prompt = (
+            f"Your goal is to classify the text of a document into one of the following categories: {', '.join(self.categories)}."
+        )
         self.resp_format = {
             "type": "json_schema",
             "json_schema": {
@@ -41,103 +67,413 @@ class ImageClassifier:
                 "strict": True,
             },
         }
+        self.pages_classification_system_prompt = (
+            "Your goal is to classify each page of a document, given as text or as an image, into one of the "
+            f"following categories: {', '.join(self.categories)}. Also classify the document as a whole into the "
+            "category of its main content."
+        )
+        self.pages_resp_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "PagesClassification",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "category": {"title": "Category", "type": "string"},
+                        "pages": {
+                            "title": "Pages",
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "page": {"title": "Page", "type": "integer"},
+                                    "category": {"title": "Category", "type": "string"},
+                                },
+                                "required": ["page", "category"],
+                                "additionalProperties": False,
+                            },
+                        },
+                    },
+                    "required": ["category", "pages"],
+                    "additionalProperties": False,
+                },
+                "strict": True,
+            },
+        }
+
+    def _create_client(self, api_key):
+        return OpenAI(api_key=api_key)
 
-    def classify_image(self, base64_image):
+    def build_messages(self, base64_image, mime_type="image/jpeg"):
         """
-        Classify a single image.
+        Build the chat messages for classifying a single image.
 
         Args:
             base64_image (str): Base64 encoded string of the image.
+            mime_type (str): MIME type of the encoded image.
 
         Returns:
-            dict: Classification result.
+            list: System and user messages for the chat completions API.
         """
-        try:
-            response = self.client.beta.chat.completions.parse(
-                model="gpt-4o-2024-08-06",
-                messages=[
-                    {"role": "system", "content": self.classification_system_prompt},
+        return [
+            {"role": "system", "content": self.classification_system_prompt},
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}
                     }
-                ],
-                temperature=0.2,
-                response_format=self.resp_format
+                ]
+            }
+        ]
+
+    def build_text_messages(self, text):
+        """
+        Build the chat messages for classifying a document from its text.
+
+        Args:
+            text (str): Text extracted from the document.
+
+        Returns:
+            list: System and user messages for the chat completions API.
+        """
+        return [
+            {"role": "system", "content": self.text_classification_system_prompt},
+            {"role": "user", "content": text[:self.max_text_chars]}
+        ]
+
+    def build_pages_messages(self, pages, mime_type="image/jpeg"):
+        """
+        Build the chat messages for classifying several pages of a document in one request.
+
+        Args:
+            pages (list): Dicts with the 1-based "page" number and either its "text" or
+                its base64 encoded "image".
+            mime_type (str): MIME type of the encoded images.
+
+        Returns:
+            list: System and user messages for the chat completions API.
+        """
+        content = []
+        for page in pages:
+            if "text" in page:
+                content.append({"type": "text", "text": f"Page {page['page']}:\n{page['text'][:self.max_text_chars]}"})
+            else:
+                content.append({"type": "text", "text": f"Page {page['page']}:"})
+                content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{page['image']}"}})
+        return [
+            {"role": "system", "content": self.pages_classification_system_prompt},
+            {"role": "user", "content": content}
+        ]
+
+    def route_image(self, filename=None, domain=None):
+        """
+        Pick the model of a document given as an image.
+
+        Args:
+            filename (str, optional): Name of the document, used to detect its domain.
+            domain (str, optional): Domain of the document, if known.
+
+        Returns:
+            tuple: Name of the route and model to use.
+        """
+        return self.router.route("vision", filename=filename, domain=domain)
+
+    def route_text(self, text, filename=None, domain=None):
+        """
+        Pick the model of a document given as text.
+
+        Args:
+            text (str): Text extracted from the document.
+            filename (str, optional): Name of the document, used to detect its domain.
+            domain (str, optional): Domain of the document, if known.
+
+        Returns:
+            tuple: Name of the route and model to use.
+        """
+        return self.router.route("text", text=text, filename=filename, domain=domain)
+
+    def route_pages(self, pages, filename=None, domain=None):
+        """
+        Pick the model of a document given as a sample of its pages.
+
+        Args:
+            pages (list): Pages of the document as taken by `classify_pages`.
+            filename (str, optional): Name of the document, used to detect its domain.
+            domain (str, optional): Domain of the document, if known.
+
+        Returns:
+            tuple: Name of the route and model to use, a text route only if every page is given as text.
+        """
+        kind = "text" if all("text" in page for page in pages) else "vision"
+        text = "\n".join(page["text"] for page in pages if "text" in page)
+        return self.router.route(kind, text=text, filename=filename, domain=domain)
+
+    @staticmethod
+    def payload_size(messages):
+        """
+        Returns:
+            int: Number of characters of the text and base64 images of chat messages.
+        """
+        size = 0
+        for message in messages:
+            contents = message["content"] if isinstance(message["content"], list) else [message["content"]]
+            for content in contents:
+                if isinstance(content, str):
+                    size += len(content)
+                elif content.get("type") == "image_url":
+                    size += len(content["image_url"]["url"])
+                else:
+                    size += len(content.get("text", ""))
+        return size
+
+    def _record_request(self, route, model, messages, latency, response=None):
+        # Records a finished chat completion request, failed if there is no response
+        usage = getattr(response, "usage", None)
+        self.router.record(route, model, latency, usage, error=response is None)
+        error = "true" if response is None else "false"
+        metrics.observe("stage_duration_seconds", latency, stage="classify", error=error, model=model)
+        metrics.observe("payload_bytes", self.payload_size(messages), buckets=SIZE_BUCKETS, model=model)
+        metrics.inc("openai_requests_total", model=model, status="error" if response is None else "ok")
+        if usage is not None:
+            metrics.inc("openai_tokens_total", usage.prompt_tokens, model=model, type="prompt")
+            metrics.inc("openai_tokens_total", usage.completion_tokens, model=model, type="completion")
+
+    def _parse(self, route, model, messages, response_format=None):
+        start = time.monotonic()
+        try:
+            response = self.client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                temperature=self.temperature,
+                response_format=response_format or self.resp_format
             )
-            return response.choices[0].message.content
+        except Exception:
+            self._record_request(route, model, messages, time.monotonic() - start)
+            raise
+        self._record_request(route, model, messages, time.monotonic() - start, response)
+        return response.choices[0].message.content
+
+    def classify_image(self, base64_image, mime_type="image/jpeg", filename=None, domain=None):
+        """
+        Classify a single image.
+
+        Args:
+            base64_image (str): Base64 encoded string of the image.
+            mime_type (str): MIME type of the encoded image.
+            filename (str, optional): Name of the document, used to pick the model.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+        Returns:
+            dict: Classification result.
+        """
+        try:
+            route, model = self.route_image(filename, domain)
+            return self._parse(route, model, self.build_messages(base64_image, mime_type))
         except Exception as e:
             logger.error(f"Error classifying image: {e}")
             raise
 
-    def create_batch_request(self, images_dict):
+    def classify_text(self, text, filename=None, domain=None):
+        """
+        Classify a document from its extracted text.
+
+        Args:
+            text (str): Text extracted from the document.
+            filename (str, optional): Name of the document, used to pick the model.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+        Returns:
+            dict: Classification result.
+        """
+        try:
+            route, model = self.route_text(text, filename, domain)
+            return self._parse(route, model, self.build_text_messages(text))
+        except Exception as e:
+            logger.error(f"Error classifying text: {e}")
+            raise
+
+    def classify_pages(self, pages, mime_type="image/jpeg", filename=None, domain=None):
+        """
+        Classify a sample of the pages of a document in a single request.
+
+        Args:
+            pages (list): Dicts with the 1-based "page" number and either its "text" or
+                its base64 encoded "image".
+            mime_type (str): MIME type of the encoded images.
+            filename (str, optional): Name of the document, used to pick the model.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+        Returns:
+            dict: Classification result with the category of the document and of each page.
+        """
+        try:
+            route, model = self.route_pages(pages, filename, domain)
+            return self._parse(route, model, self.build_pages_messages(pages, mime_type), self.pages_resp_format)
+        except Exception as e:
+            logger.error(f"Error classifying pages: {e}")
+            raise
+
+    def cache_key(self, content, page_sampling=None, domain=None, use_text_layer=True):
+        """
+        Build the classification cache key for a document.
+
+        Args:
+            content (bytes): Raw bytes of the document.
+            page_sampling (dict, optional): Page sampling settings when pages are classified separately.
+            domain (str, optional): Domain the document is routed to instead of detecting it.
+            use_text_layer (bool): Whether PDFs are classified from their text layer when they have one.
+
+        Returns:
+            str: Key combining the document hash with the model, categories and system prompt.
+        """
+        options = {}
+        system_prompt = self.classification_system_prompt
+        if page_sampling is not None:
+            options["page_sampling"] = page_sampling
+            system_prompt = self.pages_classification_system_prompt
+        if self.router.fine_tuned_models:
+            options["fine_tuned_models"] = self.router.fine_tuned_models
+        if domain in self.router.fine_tuned_models:
+            options["domain"] = domain
+        if use_text_layer:
+            # Documents with a text layer are classified by the text model, with its own prompt
+            options["text_layer"] = {"model": self.text_model, "system_prompt": self.text_classification_system_prompt}
+        return ClassificationCache.make_key(content, self.model, self.categories, system_prompt, options=options or None)
+
+    def create_batch_request(self, images_dict, mime_type="image/jpeg"):
         """
         Create a batch request for multiple images.
 
+        Tasks are generated lazily, so images can be encoded one at a time while
+        the tasks are written out.
+
         Args:
-            images_dict (dict): Dict of image paths and base64 encoded images.
+            images_dict (dict or iterable): Dict of image paths and base64 encoded images,
+                or an iterable of (image path, base64 encoded image) pairs.
+            mime_type (str): MIME type of the encoded images.
+
+        Yields:
+            dict: Task for batch processing.
+        """
+        items = images_dict.items() if isinstance(images_dict, dict) else images_dict
+        for img_path, base64_image in items:
+            yield self.create_batch_task(img_path, base64_image=base64_image, mime_type=mime_type)
+
+    def create_batch_task(self, task_id, base64_image=None, mime_type="image/jpeg", text=None, pages=None,
+                          domain=None):
+        """
+        Create a batch task classifying either an image, the text of a document or a sample of its pages.
+
+        The model is picked by the router, from the task ID (typically the file path) and
+        the text of the document; `execute_batch_jobs` puts tasks of each model in separate batches.
+
+        Args:
+            task_id (str): Identifier of the document, used in the task's custom_id.
+            base64_image (str, optional): Base64 encoded string of the image.
+            mime_type (str): MIME type of the encoded image.
+            text (str, optional): Text extracted from the document, classified with the text model.
+            pages (list, optional): Pages of the document as taken by `classify_pages`.
+            domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
 
         Returns:
-            list: List of tasks for batch processing.
-        """
-        tasks = []
-        for i, (img_path,base64_image) in enumerate(images_dict.items()):
-            task = {
-                "custom_id": f"task-{img_path}",
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": {
-                    "model": "gpt-4o-2024-08-06",
-                    "temperature": 0.2,
-                    "response_format": self.resp_format,
-                    "messages": [
-                        {"role": "system", "content": self.classification_system_prompt},
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                                }
-                            ]
-                        }
-                    ]
-                }
+            dict: Task for batch processing.
+        """
+        response_format = self.resp_format
+        if pages is not None:
+            route, model = self.route_pages(pages, task_id, domain)
+            messages = self.build_pages_messages(pages, mime_type)
+            response_format = self.pages_resp_format
+        elif text is not None:
+            route, model = self.route_text(text, task_id, domain)
+            messages = self.build_text_messages(text)
+        else:
+            route, model = self.route_image(task_id, domain)
+            messages = self.build_messages(base64_image, mime_type)
+        self.router.record_batch_task(route, model)
+        return {
+            "custom_id": f"task-{task_id}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "temperature": self.temperature,
+                "response_format": response_format,
+                "messages": messages
             }
-            tasks.append(task)
-
-        return tasks
+        }
 
-    def execute_batch_job(self, tasks):
+    def execute_batch_jobs(self, tasks, max_requests=None, max_bytes=None):
         """
-        Execute the batch job for the given tasks.
+        Stream tasks into batch input files and create a batch job for each file.
+
+        Tasks are written to temporary files one at a time, with a separate file per
+        model since a batch can only use one model. A new file, and a new batch job,
+        is started whenever the next task would exceed the request count or file
+        size limit of a batch. If reading the tasks or submitting a file fails, the
+        batch jobs already created are cancelled before the error is raised, so that
+        no batch is left running without a caller knowing its ID.
 
         Args:
-            tasks (list): List of tasks to be executed.
+            tasks (iterable): Tasks to be executed.
+            max_requests (int, optional): Maximum tasks per batch, defaults to the Batch API limit.
+            max_bytes (int, optional): Maximum size in bytes of a batch input file, defaults to the Batch API limit.
 
         Returns:
-            str: ID of the created batch job.
+            list: IDs of the created batch jobs.
         """
+        max_requests = max_requests or self.MAX_BATCH_REQUESTS
+        max_bytes = max_bytes or self.MAX_BATCH_FILE_BYTES
+        batch_job_ids = []
+        # Open batch file, request count and size for each model
+        batch_files = {}
         try:
-            batch_file_name = "data/batch_tasks.jsonl"
-            with open(batch_file_name, 'w') as file:
-                for task in tasks:
-                    file.write(json.dumps(task) + '\n')
+            for task in tasks:
+                model = task["body"]["model"]
+                line = (json.dumps(task) + '\n').encode('utf-8')
+                if model in batch_files:
+                    batch_file, request_count, file_size = batch_files[model]
+                    if request_count >= max_requests or file_size + len(line) > max_bytes:
+                        batch_job_ids.append(self._submit_batch_file(batch_file))
+                        batch_file.close()
+                        del batch_files[model]
+                if model not in batch_files:
+                    batch_files[model] = [tempfile.TemporaryFile(), 0, 0]
+                metrics.observe("payload_bytes", self.payload_size(task["body"]["messages"]), buckets=SIZE_BUCKETS,
+                                model=model)
+                batch_files[model][0].write(line)
+                batch_files[model][1] += 1
+                batch_files[model][2] += len(line)
+            for batch_file, _, _ in batch_files.values():
+                batch_job_ids.append(self._submit_batch_file(batch_file))
+            return batch_job_ids
+        except Exception as e:
+            logger.error(f"Error executing batch job: {e}")
+            self._cancel_batches(batch_job_ids)
+            raise
+        finally:
+            for batch_file, _, _ in batch_files.values():
+                batch_file.close()
 
-            batch_file = self.client.files.create(file=open(batch_file_name, "rb"), purpose="batch")
+    def _cancel_batches(self, batch_job_ids):
+        for batch_job_id in batch_job_ids:
+            try:
+                self.client.batches.cancel(batch_job_id)
+                logger.info(f"Batch Job Cancelled: {batch_job_id}")
+            except Exception as e:
+                logger.error(f"Error cancelling batch job {batch_job_id}: {e}")
+
+    def _submit_batch_file(self, batch_file):
+        metrics.observe("batch_file_bytes", batch_file.tell(), buckets=SIZE_BUCKETS)
+        batch_file.seek(0)
+        with metrics.span("batch_upload"):
+            uploaded_file = self.client.files.create(file=("batch_tasks.jsonl", batch_file), purpose="batch")
+        with metrics.span("batch_create"):
             batch_job = self.client.batches.create(
-                input_file_id=batch_file.id,
+                input_file_id=uploaded_file.id,
                 endpoint="/v1/chat/completions",
                 completion_window="24h"
             )
-
-            logger.info(f"Batch Job Created: {batch_job.id}")
-            return batch_job.id
-        except Exception as e:
-            logger.error(f"Error executing batch job: {e}")
-            raise
+        logger.info(f"Batch Job Created: {batch_job.id}")
+        return batch_job.id
@@ -1,11 +1,39 @@
+import io
 import base64
 import logging
+from PIL import Image, ImageOps
+
+from src.utils.metrics import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class ImageEncoder:
+    MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+    def __init__(self, max_long_side=2048, max_short_side=768, image_format="JPEG", quality=85):
+        """
+        Initialize the ImageEncoder with image preparation settings.
+
+        The defaults match how the vision model processes high detail images: it
+        fits them within 2048x2048 and then scales the shortest side to 768 pixels,
+        so larger images only add upload size without adding detail.
+
+        Args:
+            max_long_side (int): Maximum length in pixels of the longest side.
+            max_short_side (int): Maximum length in pixels of the shortest side.
+            image_format (str): Format images are re-encoded to ("JPEG" or "WEBP").
+            quality (int): Encoder quality setting, from 1 to 100.
+        """
+        if image_format not in self.MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.max_long_side = max_long_side
+        self.max_short_side = max_short_side
+        self.image_format = image_format
+        self.quality = quality
+        self.mime_type = self.MIME_TYPES[image_format]
+
     @staticmethod
     def encode_image(image_path):
         """
@@ -18,11 +46,64 @@ class ImageEncoder:
             str: Base64 encoded string of the image.
         """
         try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+            with metrics.span("read_image"), open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+            with metrics.span("encode"):
+                return base64.b64encode(image_bytes).decode('utf-8')
         except FileNotFoundError:
             logger.error(f"Image file not found: {image_path}")
             raise
         except Exception as e:
             logger.error(f"Error encoding image: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    @staticmethod
+    def encode_bytes(image_bytes):
+        """
+        Encode image content held in memory to base64 format.
+
+        Args:
+            image_bytes (bytes): The encoded image.
+
+        Returns:
+            str: Base64 encoded string of the image.
+        """
+        with metrics.span("encode"):
+            return base64.b64encode(image_bytes).decode('utf-8')
+
+    def prepare_image(self, image_bytes):
+        """
+        Downscale and recompress an image for the vision model.
+
+        Args:
+            image_bytes (bytes): The encoded image.
+
+        Returns:
+            tuple: Prepared image bytes and their MIME type.
+        """
+        try:
+            with metrics.span("prepare_image"), Image.open(io.BytesIO(image_bytes)) as image:
+                source_format = image.format
+                image = ImageOps.exif_transpose(image)
+                width, height = image.size
+                scale = min(1.0, self.max_long_side / max(width, height), self.max_short_side / min(width, height))
+                if scale < 1.0:
+                    image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                buffer = io.BytesIO()
+                image.save(buffer, self.image_format, quality=self.quality, optimize=True)
+        except Exception as e:
+            logger.error(f"Error preparing image: {e}")
+            raise
+
+        prepared_bytes = buffer.getvalue()
+        if scale == 1.0 and source_format == self.image_format and len(prepared_bytes) >= len(image_bytes):
+            # Re-encoding did not help, keep the original image
+            prepared_bytes = image_bytes
+
+        # Recorded in the metrics registry, which conversion worker processes send back to the server
+        metrics.inc("image_bytes_in", len(image_bytes))
+        metrics.inc("image_bytes_out", len(prepared_bytes))
+        logger.debug(f"Prepared image: {len(image_bytes)} -> {len(prepared_bytes)} bytes")
+        return prepared_bytes, self.mime_type
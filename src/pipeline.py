@@ -0,0 +1,257 @@
+import os
+import json
+import logging
+from dotenv import load_dotenv
+
+from src.pre_classifier import PreClassifier
+from src.services import Services
+from src.utils.batch_registry import BatchJobRegistry
+from src.utils.classification_cache import ClassificationCache
+from src.utils.file_manifest import FileManifest
+from src.utils.metrics import metrics
+from src.utils.work_queue import WorkQueue
+
+# Settings, stores and classification stages shared by the web application (src.app)
+# and the queue workers (src.queue_worker), which do not import Flask
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Classification categories and models
+CATEGORIES = ["invoice", "bank statement", "driver's license", "other"]
+FINE_TUNED_MODELS = json.loads(os.getenv("FINE_TUNED_MODELS", "null")) or {
+    "finance": "gpt-4o-finetuned-finance",
+    "healthcare": "gpt-4o-finetuned-healthcare",
+}
+
+# Documents of a domain with a fine-tuned model are routed to it, once the models are deployed
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "false").lower() == "true"
+# Price in dollars per million input and output tokens of each model, e.g. {"gpt-4o-mini": [0.15, 0.6]}
+MODEL_PRICES = json.loads(os.getenv("MODEL_PRICES", "{}"))
+
+# Born-digital PDFs are classified from their text layer with a cheaper model
+USE_TEXT_LAYER = os.getenv("TEXT_LAYER_FAST_PATH", "true").lower() == "true"
+TEXT_MODEL = os.getenv("TEXT_CLASSIFICATION_MODEL", "gpt-4o-mini")
+
+# Multi-page documents are classified from a sample of their pages, packed into one request
+PAGE_SAMPLING = None
+if os.getenv("MULTI_PAGE_CLASSIFICATION", "false").lower() == "true":
+    PAGE_SAMPLING = {
+        "every": int(os.getenv("PAGE_SAMPLE_EVERY", "5")),
+        "max_pages": int(os.getenv("PAGE_SAMPLE_MAX_PAGES", "4")),
+    }
+
+# Local nearest-neighbour classifier answering confident cases without calling the LLM
+PRE_CLASSIFIER_ENABLED = os.getenv("PRE_CLASSIFIER_ENABLED", "true").lower() == "true"
+PRE_CLASSIFIER_INDEX_PATH = os.getenv("PRE_CLASSIFIER_INDEX_PATH", "data/pre_classifier_index.npz")
+PRE_CLASSIFIER_K = int(os.getenv("PRE_CLASSIFIER_K", "5"))
+PRE_CLASSIFIER_MIN_SIMILARITY = float(os.getenv("PRE_CLASSIFIER_MIN_SIMILARITY", "0.92"))
+PRE_CLASSIFIER_MIN_NEIGHBORS = int(os.getenv("PRE_CLASSIFIER_MIN_NEIGHBORS", "2"))
+PRE_CLASSIFIER_MIN_AGREEMENT = float(os.getenv("PRE_CLASSIFIER_MIN_AGREEMENT", "0.8"))
+pre_classifier = None
+
+def get_pre_classifier():
+    """
+    Returns:
+        PreClassifier: The pre-classifier of this worker, created on first use, or None if it is disabled.
+    """
+    global pre_classifier
+    if pre_classifier is None and PRE_CLASSIFIER_ENABLED:
+        pre_classifier = PreClassifier(
+            index_path=PRE_CLASSIFIER_INDEX_PATH, k=PRE_CLASSIFIER_K, min_similarity=PRE_CLASSIFIER_MIN_SIMILARITY,
+            min_neighbors=PRE_CLASSIFIER_MIN_NEIGHBORS, min_agreement=PRE_CLASSIFIER_MIN_AGREEMENT,
+        )
+    return pre_classifier
+
+# Persistent cache of classification results keyed on document content. Like the other
+# stores below, it is created on first use, so that importing the application or a queue worker writes nothing to data/
+CLASSIFICATION_CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", "data/classification_cache.db")
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "10000"))
+CLASSIFICATION_CACHE_TTL = int(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+classification_cache = None
+
+def get_classification_cache():
+    """
+    Returns:
+        ClassificationCache: The classification cache, created on first use.
+    """
+    global classification_cache
+    if classification_cache is None:
+        classification_cache = ClassificationCache(
+            db_path=CLASSIFICATION_CACHE_PATH, max_entries=CLASSIFICATION_CACHE_MAX_ENTRIES,
+            ttl_seconds=CLASSIFICATION_CACHE_TTL,
+        )
+    return classification_cache
+
+# Seconds after which the conversion of a document to images is given up
+CONVERSION_TIMEOUT = float(os.getenv("CONVERSION_TIMEOUT_SECONDS", "120"))
+
+# Clients and classifier components are created once per worker and shared by all requests
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Requests in flight and client-side rate limits of the asynchronous classifier of the ASGI application
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "200"))
+ASYNC_REQUESTS_PER_MINUTE = int(os.getenv("ASYNC_REQUESTS_PER_MINUTE", "0")) or None
+ASYNC_TOKENS_PER_MINUTE = int(os.getenv("ASYNC_TOKENS_PER_MINUTE", "0")) or None
+# Preparation of the images sent to the vision model
+IMAGE_MAX_LONG_SIDE = int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+services = None
+
+def get_services():
+    """
+    Returns:
+        Services: The shared components of this worker, created on first use so that
+            connections are not inherited across forked workers.
+    """
+    global services
+    if services is None:
+        services = Services(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            categories=CATEGORIES,
+            fine_tuned_models=FINE_TUNED_MODELS if MODEL_ROUTING else None,
+            text_model=TEXT_MODEL,
+            timeout=OPENAI_TIMEOUT,
+            connect_timeout=OPENAI_CONNECT_TIMEOUT,
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            max_retries=OPENAI_MAX_RETRIES,
+            conversion_timeout=CONVERSION_TIMEOUT,
+            model_prices=MODEL_PRICES,
+            batch_poll_interval=BATCH_POLL_INITIAL_INTERVAL,
+            max_batch_poll_interval=BATCH_POLL_MAX_INTERVAL,
+            async_max_concurrency=ASYNC_MAX_CONCURRENCY,
+            async_requests_per_minute=ASYNC_REQUESTS_PER_MINUTE,
+            async_tokens_per_minute=ASYNC_TOKENS_PER_MINUTE,
+            image_max_long_side=IMAGE_MAX_LONG_SIDE,
+            image_max_short_side=IMAGE_MAX_SHORT_SIDE,
+            image_format=IMAGE_FORMAT,
+            image_quality=IMAGE_QUALITY,
+        )
+    return services
+
+# Directory of the files classified by the batch endpoint and enqueued for the queue workers
+FILES_DIRECTORY = os.getenv("FILES_DIRECTORY", "files")
+
+# Persistent registry of submitted batch jobs, polled in the background by the application
+BATCH_POLL_INITIAL_INTERVAL = float(os.getenv("BATCH_POLL_INITIAL_SECONDS", "5"))
+BATCH_POLL_MAX_INTERVAL = float(os.getenv("BATCH_POLL_MAX_SECONDS", "300"))
+BATCH_REGISTRY_PATH = os.getenv("BATCH_REGISTRY_PATH", "data/batch_jobs.db")
+batch_registry = None
+
+def get_batch_registry():
+    """
+    Returns:
+        BatchJobRegistry: The registry of batch jobs, created on first use.
+    """
+    global batch_registry
+    if batch_registry is None:
+        batch_registry = BatchJobRegistry(db_path=BATCH_REGISTRY_PATH)
+    return batch_registry
+
+# Manifest of the files of FILES_DIRECTORY, so incremental scans only classify new and changed files
+FILE_MANIFEST_PATH = os.getenv("FILE_MANIFEST_PATH", "data/file_manifest.db")
+file_manifest = None
+
+def get_file_manifest():
+    """
+    Returns:
+        FileManifest: The manifest of incremental classification, created on first use.
+    """
+    global file_manifest
+    if file_manifest is None:
+        file_manifest = FileManifest(db_path=FILE_MANIFEST_PATH)
+    return file_manifest
+
+# Durable queue of files classified one by one by worker processes (`python -m src.queue_worker`)
+WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", "data/work_queue.db")
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+WORK_QUEUE_LEASE_SECONDS = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "600"))
+WORK_QUEUE_RETRY_DELAY = float(os.getenv("WORK_QUEUE_RETRY_SECONDS", "30"))
+work_queue = None
+
+def get_work_queue():
+    """
+    Returns:
+        WorkQueue: The work queue, created on first use.
+    """
+    global work_queue
+    if work_queue is None:
+        work_queue = WorkQueue(
+            db_path=WORK_QUEUE_PATH, max_attempts=WORK_QUEUE_MAX_ATTEMPTS, lease_seconds=WORK_QUEUE_LEASE_SECONDS,
+            retry_delay=WORK_QUEUE_RETRY_DELAY,
+        )
+    return work_queue
+
+def pre_classify(converted):
+    """
+    Returns:
+        str: Category of a converted document if the pre-classifier is confident about it, otherwise None.
+    """
+    classifier = get_pre_classifier()
+    if classifier is None:
+        return None
+    with metrics.span("pre_classify"):
+        return classifier.classify_document(converted)
+
+def encode_pages(image_encoder, pages):
+    """
+    Base64 encode the images of converted pages for the classifier.
+
+    Args:
+        image_encoder (ImageEncoder): Encoder used to encode the images.
+        pages (list): Pages of a document converted by `convert_document`.
+
+    Returns:
+        list: The pages, with base64 encoded images.
+    """
+    return [{**page, "image": image_encoder.encode_bytes(page["image"])} if "image" in page else page for page in pages]
+
+def classify_converted(image_classifier, image_encoder, converted, filename=None, domain=None):
+    """
+    Classify a converted document with the LLM, from its text when there is one.
+
+    Args:
+        image_classifier (ImageClassifier): Classifier of the document.
+        image_encoder (ImageEncoder): Encoder used to encode the images.
+        converted (dict): Document converted by `convert_document`.
+        filename (str, optional): Name of the document, used to pick the model.
+        domain (str, optional): Domain of the document, used to pick the model instead of detecting it.
+
+    Returns:
+        dict: Classification result.
+    """
+    if "pages" in converted:
+        pages = encode_pages(image_encoder, converted["pages"])
+        return image_classifier.classify_pages(pages, mime_type=image_encoder.mime_type, filename=filename, domain=domain)
+    if "text" in converted:
+        return image_classifier.classify_text(converted["text"], filename=filename, domain=domain)
+    encoded_image = image_encoder.encode_bytes(converted["image"])
+    return image_classifier.classify_image(encoded_image, mime_type=image_encoder.mime_type, filename=filename, domain=domain)
+
+def enqueue_files():
+    """
+    Add the files of FILES_DIRECTORY to the work queue, unless they were enqueued with the same content before.
+
+    Returns:
+        dict: Number of files added and of files already enqueued.
+    """
+    image_classifier = get_services().image_classifier
+    work_queue = get_work_queue()
+    counts = {"enqueued": 0, "already_enqueued": 0}
+    for name in sorted(os.listdir(FILES_DIRECTORY)):
+        file_path = os.path.join(FILES_DIRECTORY, name)
+        if not os.path.isfile(file_path):
+            continue
+        with open(file_path, 'rb') as f:
+            cache_key = image_classifier.cache_key(f.read(), PAGE_SAMPLING, use_text_layer=USE_TEXT_LAYER)
+        counts["enqueued" if work_queue.enqueue(file_path, cache_key) else "already_enqueued"] += 1
+    logger.info(f"Enqueued {counts['enqueued']} files, {counts['already_enqueued']} were already enqueued")
+    return counts
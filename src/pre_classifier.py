@@ -0,0 +1,295 @@
+import io
+import os
+import re
+import json
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import Counter
+from contextlib import closing
+import numpy as np
+from PIL import Image
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class PreClassifier:
+    # Number of dimensions of the feature vectors of both images and texts
+    DIMENSIONS = 1024
+
+    def __init__(self, index_path="data/pre_classifier_index.npz", k=5, min_similarity=0.92, min_neighbors=2,
+                 min_agreement=0.8):
+        """
+        Initialize a local nearest-neighbour classifier over previously labelled documents.
+
+        Documents are compared with small feature vectors (a 32x32 grayscale thumbnail
+        for images, hashed word counts for text layers) by cosine similarity. Only
+        confident answers are returned; everything else is left to the LLM.
+
+        Args:
+            index_path (str): Path of the index file written by the build command.
+            k (int): Number of nearest neighbours considered.
+            min_similarity (float): Minimum cosine similarity of a neighbour to count.
+            min_neighbors (int): Minimum number of similar neighbours for a confident answer.
+            min_agreement (float): Minimum share of similar neighbours agreeing on the category.
+        """
+        self.index_path = index_path
+        self.k = k
+        self.min_similarity = min_similarity
+        self.min_neighbors = min_neighbors
+        self.min_agreement = min_agreement
+        # Feature vectors and categories of the labelled documents, by kind ("image" or "text")
+        self.vectors = {}
+        self.categories = {}
+        self.requests = 0
+        self.escalations = 0
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            self.load()
+
+    @classmethod
+    def image_vector(cls, image_bytes):
+        """
+        Compute the feature vector of an image.
+
+        Args:
+            image_bytes (bytes): The encoded image.
+
+        Returns:
+            numpy.ndarray: Zero-mean, unit-length thumbnail pixels.
+        """
+        size = int(cls.DIMENSIONS ** 0.5)
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft("L", (size * 4, size * 4))  # Lets JPEG decoding skip most of the pixels
+            thumbnail = image.convert("L").resize((size, size), Image.BILINEAR)
+        vector = np.asarray(thumbnail, dtype=np.float32).ravel()
+        return cls._normalize(vector - vector.mean())
+
+    @classmethod
+    def text_vector(cls, text):
+        """
+        Compute the feature vector of a document's text.
+
+        Args:
+            text (str): Text extracted from the document.
+
+        Returns:
+            numpy.ndarray: Unit-length, log-scaled counts of hashed words.
+        """
+        vector = np.zeros(cls.DIMENSIONS, dtype=np.float32)
+        # Digits are ignored so that e.g. invoices with different amounts look alike
+        for word, count in Counter(re.findall(r"[^\W\d_]{2,}", text.lower())).items():
+            vector[zlib.crc32(word.encode('utf-8')) % cls.DIMENSIONS] += 1 + np.log(count)
+        return cls._normalize(vector)
+
+    @staticmethod
+    def _normalize(vector):
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @classmethod
+    def features(cls, converted):
+        """
+        Compute the features of a converted document.
+
+        Args:
+            converted (dict): Converted document, either {"text": str} or {"image": bytes}.
+
+        Returns:
+            tuple: Kind of the document ("text" or "image") and its feature vector.
+        """
+        if "text" in converted:
+            return "text", cls.text_vector(converted["text"])
+        return "image", cls.image_vector(converted["image"])
+
+    def add(self, kind, vector, category):
+        """
+        Add a labelled document to the index.
+
+        Args:
+            kind (str): Kind of the document, "text" or "image".
+            vector (numpy.ndarray): Feature vector of the document.
+            category (str): Category assigned to the document.
+        """
+        with self._lock:
+            if kind in self.vectors:
+                self.vectors[kind] = np.vstack([self.vectors[kind], vector])
+                self.categories[kind] = np.append(self.categories[kind], category)
+            else:
+                self.vectors[kind] = vector[np.newaxis, :]
+                self.categories[kind] = np.array([category])
+
+    def classify(self, kind, vector):
+        """
+        Classify a document from its nearest labelled neighbours.
+
+        Args:
+            kind (str): Kind of the document, "text" or "image".
+            vector (numpy.ndarray): Feature vector of the document.
+
+        Returns:
+            str: The category, or None if the answer is not confident and the document
+                should be escalated to the LLM.
+        """
+        category = self._nearest_category(kind, vector)
+        with self._lock:
+            self.requests += 1
+            if category is None:
+                self.escalations += 1
+        return category
+
+    def classify_document(self, converted):
+        """
+        Classify a converted document from its nearest labelled neighbours.
+
+        Features are only computed when the index holds documents of the same kind.
+        Documents converted page by page are always escalated, since the index holds
+        a single category per document.
+
+        Args:
+            converted (dict): Converted document, either {"text": str}, {"image": bytes} or {"pages": list}.
+
+        Returns:
+            str: The category, or None if the document should be escalated to the LLM.
+        """
+        kind = "pages" if "pages" in converted else "text" if "text" in converted else "image"
+        if kind not in self.vectors:
+            return self.classify(kind, None)
+        return self.classify(*self.features(converted))
+
+    def _nearest_category(self, kind, vector):
+        if kind not in self.vectors:
+            return None
+        similarities = self.vectors[kind] @ vector
+        nearest = np.argsort(similarities)[::-1][:self.k]
+        neighbours = [self.categories[kind][i] for i in nearest if similarities[i] >= self.min_similarity]
+        if len(neighbours) < self.min_neighbors:
+            return None
+        category, votes = Counter(neighbours).most_common(1)[0]
+        if votes / len(neighbours) < self.min_agreement:
+            return None
+        return str(category)
+
+    def stats(self):
+        """
+        Report how many documents were answered locally.
+
+        Returns:
+            dict: Index size, request and escalation counts and the escalation rate.
+        """
+        return {
+            "indexed": {kind: len(categories) for kind, categories in self.categories.items()},
+            "requests": self.requests,
+            "escalations": self.escalations,
+            "escalation_rate": self.escalations / self.requests if self.requests else 0.0,
+        }
+
+    def load(self):
+        """
+        Load the index from `index_path`.
+        """
+        with np.load(self.index_path) as index:
+            for kind in ("image", "text"):
+                if f"{kind}_vectors" in index:
+                    self.vectors[kind] = index[f"{kind}_vectors"]
+                    self.categories[kind] = index[f"{kind}_categories"]
+        logger.info(f"Loaded pre-classifier index from {self.index_path}: {self.stats()['indexed']}")
+
+    def save(self):
+        """
+        Save the index to `index_path`.
+        """
+        arrays = {}
+        for kind in self.vectors:
+            arrays[f"{kind}_vectors"] = self.vectors[kind]
+            arrays[f"{kind}_categories"] = self.categories[kind]
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        with open(self.index_path, 'wb') as index_file:
+            np.savez(index_file, **arrays)
+        logger.info(f"Saved pre-classifier index to {self.index_path}: {self.stats()['indexed']}")
+
+def read_labels(labels_path):
+    """
+    Read labelled documents from a JSONL file.
+
+    Each line holds a "category" and either a "path" or a "custom_id" of the form
+    "task-<path>", as returned by the 'batches/<job_id>' endpoint.
+
+    Args:
+        labels_path (str): Path of the labels file.
+
+    Yields:
+        tuple: Document path and category.
+    """
+    with open(labels_path, 'r') as labels_file:
+        for line in labels_file:
+            if not line.strip():
+                continue
+            label = json.loads(line)
+            path = label.get("path") or label["custom_id"][len("task-"):]
+            if label.get("category") is not None:
+                yield path, label["category"]
+
+def read_registry_labels(registry_path):
+    """
+    Read the documents labelled by completed batch jobs.
+
+    Args:
+        registry_path (str): Path of the batch job registry database.
+
+    Yields:
+        tuple: Document path and category.
+    """
+    from src.utils.batch_registry import BatchJobRegistry
+
+    registry = BatchJobRegistry(db_path=registry_path)
+    with closing(sqlite3.connect(registry_path)) as conn:
+        job_ids = [row[0] for row in conn.execute("SELECT job_id FROM jobs WHERE status = 'completed'")]
+    for job_id in job_ids:
+        # The registry merges results stored per row with those of jobs registered before results were streamed
+        for classification in registry.get(job_id)["classifications"]:
+            if classification.get("category") is not None:
+                yield classification["custom_id"][len("task-"):], classification["category"]
+
+def main(argv=None):
+    """
+    Build or update the pre-classifier index from previously labelled documents.
+    """
+    from src.file_processor import FileProcessor
+    from src.image_encoder import ImageEncoder
+    from src.utils.conversion_executor import convert_file
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("command", choices=["build", "update"], help="'build' replaces the index, 'update' adds to it")
+    parser.add_argument("--index", default=os.getenv("PRE_CLASSIFIER_INDEX_PATH", "data/pre_classifier_index.npz"))
+    parser.add_argument("--labels", action="append", default=[], help="JSONL file of labelled documents")
+    parser.add_argument("--batch-registry", help="Batch job registry whose completed jobs are used as labels")
+    args = parser.parse_args(argv)
+
+    labels = []
+    for labels_path in args.labels:
+        labels.extend(read_labels(labels_path))
+    if args.batch_registry:
+        labels.extend(read_registry_labels(args.batch_registry))
+
+    if args.command == "build" and os.path.exists(args.index):
+        os.remove(args.index)
+    pre_classifier = PreClassifier(index_path=args.index)
+    file_processor = FileProcessor()
+    image_encoder = ImageEncoder()
+    for path, category in labels:
+        try:
+            kind, vector = pre_classifier.features(convert_file(file_processor, image_encoder, path))
+        except Exception as e:
+            logger.error(f"Skipping {path}: {e}")
+            continue
+        pre_classifier.add(kind, vector, category)
+    pre_classifier.save()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import multiprocessing
+
+import src.pipeline as pipeline
+from src.utils.conversion_executor import convert_document
+from src.utils.metrics import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class QueueWorker:
+    def __init__(self, work_queue, services, classification_cache=None, pre_classifier=None, use_text_layer=True,
+                 page_sampling=None, poll_interval=1.0, worker_id=None):
+        """
+        Initialize a worker classifying the files of a WorkQueue one at a time.
+
+        Each item goes through the FileProcessor, ImageEncoder and ImageClassifier
+        stages in this process. Results are stored in the classification cache before
+        the item is completed, so an item retried after a crash is answered from the
+        cache instead of being classified again.
+
+        Args:
+            work_queue (WorkQueue): Queue of the files to classify.
+            services (Services): Components of this process.
+            classification_cache (ClassificationCache, optional): Cache of classification results.
+            pre_classifier (PreClassifier, optional): Local classifier answering confident cases without the LLM.
+            use_text_layer (bool): Whether PDFs are classified from their text layer when they have one.
+            page_sampling (dict, optional): Sampling of the pages of multi-page documents, see `convert_document`.
+            poll_interval (float): Seconds between checks of an empty queue.
+            worker_id (str, optional): Identifier of the worker in the queue, by default from the host and process.
+        """
+        self.work_queue = work_queue
+        self.services = services
+        self.classification_cache = classification_cache
+        self.pre_classifier = pre_classifier
+        self.use_text_layer = use_text_layer
+        self.page_sampling = page_sampling
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    def classify(self, item):
+        """
+        Classify the file of a queue item.
+
+        Args:
+            item (dict): Item claimed from the queue.
+
+        Returns:
+            dict: Classification of the file, with "cached" or "pre_classified" set when
+                it was known without the LLM.
+        """
+        if self.classification_cache is not None:
+            cached_result = self.classification_cache.get(item["cache_key"])
+            if cached_result is not None:
+                metrics.inc("documents_total", endpoint="queue", outcome="cached")
+                return {**(json.loads(cached_result) if isinstance(cached_result, str) else cached_result), "cached": True}
+
+        with metrics.span("read_file"), open(item["path"], 'rb') as f:
+            content = f.read()
+        file_processor, image_encoder = self.services.file_processor, self.services.image_encoder
+        with metrics.span("convert"):
+            converted = convert_document(file_processor, image_encoder, content, item["path"], self.use_text_layer,
+                                         self.page_sampling)
+
+        category = None
+        if self.pre_classifier is not None:
+            with metrics.span("pre_classify"):
+                category = self.pre_classifier.classify_document(converted)
+        if category is not None:
+            metrics.inc("documents_total", endpoint="queue", outcome="pre_classified")
+            result = {"category": category}
+            self._cache(item, result)
+            return {**result, "pre_classified": True}
+
+        classification = pipeline.classify_converted(self.services.image_classifier, image_encoder, converted, item["path"])
+        result = json.loads(classification) if isinstance(classification, str) else classification
+        metrics.inc("documents_total", endpoint="queue", outcome="classified")
+        self._cache(item, result)
+        return result
+
+    def _cache(self, item, result):
+        if self.classification_cache is not None:
+            with metrics.span("cache_store"):
+                self.classification_cache.set(item["cache_key"], json.dumps(result))
+
+    def process_one(self):
+        """
+        Claim the next due item of the queue and classify it.
+
+        Items whose file no longer exists are dead-lettered right away; other failures are retried.
+
+        Returns:
+            bool: True if an item was processed, False if no item was due.
+        """
+        item = self.work_queue.claim(self.worker_id)
+        if item is None:
+            return False
+        try:
+            result = self.classify(item)
+        except FileNotFoundError as e:
+            logger.error(f"Error processing queue item {item['item_id']}: {e}")
+            self.work_queue.fail(item["item_id"], self.worker_id, str(e), retry=False)
+            return True
+        except Exception as e:
+            logger.error(f"Error processing queue item {item['item_id']}: {e}")
+            self.work_queue.fail(item["item_id"], self.worker_id, str(e))
+            return True
+        if not self.work_queue.complete(item["item_id"], self.worker_id, result):
+            logger.warning(f"Lease of queue item {item['item_id']} expired before it was completed")
+        return True
+
+    def run(self, stop_event=None, exit_when_empty=False):
+        """
+        Process items until stopped.
+
+        Args:
+            stop_event (multiprocessing.Event, optional): Event stopping the worker once set.
+            exit_when_empty (bool): Whether to return once no item is due instead of waiting for more.
+        """
+        logger.info(f"Queue worker {self.worker_id} started")
+        while stop_event is None or not stop_event.is_set():
+            try:
+                processed = self.process_one()
+            except Exception as e:
+                # Errors of the queue itself, e.g. a locked database, are retried after a pause
+                logger.error(f"Error claiming queue item: {e}")
+                processed = False
+            if processed:
+                continue
+            if exit_when_empty:
+                break
+            if stop_event is not None:
+                stop_event.wait(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+        logger.info(f"Queue worker {self.worker_id} stopped")
+
+def work(stop_event=None, exit_when_empty=False):
+    """
+    Run a queue worker with the settings and components of the application.
+
+    Args:
+        stop_event (multiprocessing.Event, optional): Event stopping the worker once set.
+        exit_when_empty (bool): Whether to return once no item is due.
+    """
+    worker = QueueWorker(
+        pipeline.get_work_queue(), pipeline.get_services(), pipeline.get_classification_cache(),
+        pipeline.get_pre_classifier(),
+        use_text_layer=pipeline.USE_TEXT_LAYER, page_sampling=pipeline.PAGE_SAMPLING,
+    )
+    try:
+        worker.run(stop_event, exit_when_empty)
+    finally:
+        pipeline.get_services().close()
+
+def main(argv=None):
+    """
+    Classify the files of the work queue with worker processes.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--enqueue", action="store_true", help="Enqueue the files of FILES_DIRECTORY first")
+    parser.add_argument("--exit-when-empty", action="store_true", help="Stop once no item is due instead of waiting for more")
+    args = parser.parse_args(argv)
+
+    if args.enqueue:
+        pipeline.enqueue_files()
+
+    # Workers start from a clean process and create their own clients
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    processes = [
+        context.Process(target=work, args=(stop_event, args.exit_when_empty), name=f"queue-worker-{i}")
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Items being processed are finished; those of killed workers are claimed again once their lease expires
+        logger.info("Stopping queue workers")
+        stop_event.set()
+        for process in processes:
+            process.join()
+    return 0 if all(process.exitcode == 0 for process in processes) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import logging
+import httpx
+from openai import AsyncOpenAI, OpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+from src.async_image_classifier import AsyncImageClassifier
+
+from src.file_processor import FileProcessor
+from src.image_classifier import ImageClassifier
+from src.image_encoder import ImageEncoder
+from src.utils.batch_monitor import BatchMonitor
+from src.utils.model_router import ModelRouter
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class Services:
+    def __init__(self, api_key, categories, fine_tuned_models=None, text_model="gpt-4o-mini", timeout=60,
+                 connect_timeout=5, max_connections=100, max_keepalive_connections=20, max_retries=2,
+                 conversion_timeout=None, model_prices=None, batch_poll_interval=5, max_batch_poll_interval=300,
+                 async_max_concurrency=200, async_requests_per_minute=None, async_tokens_per_minute=None,
+                 image_max_long_side=2048, image_max_short_side=768, image_format="JPEG", image_quality=85):
+        """
+        Create the long-lived components shared by all requests of a worker.
+
+        A single OpenAI client, with a pool of keep-alive connections, is shared by
+        the classifier and the batch monitor, so requests reuse open TLS connections
+        instead of setting up a client and a connection each.
+
+        Args:
+            api_key (str): The API key for OpenAI.
+            categories (list): List of categories for classification.
+            fine_tuned_models (dict, optional): Fine-tuned model of each domain, documents of
+                these domains are routed to them.
+            text_model (str): Model used to classify documents from their extracted text.
+            timeout (float): Seconds after which an OpenAI request is given up.
+            connect_timeout (float): Seconds after which connecting to OpenAI is given up.
+            max_connections (int): Maximum number of open connections to OpenAI.
+            max_keepalive_connections (int): Maximum number of idle connections kept open.
+            max_retries (int): Number of retries of failed OpenAI requests by the client.
+            conversion_timeout (float, optional): Seconds after which a PDF renderer process is killed.
+            model_prices (dict, optional): Price in dollars per million input and output tokens of
+                each model, used to estimate the cost of each route.
+            batch_poll_interval (float): Seconds between the first status checks of a batch.
+            max_batch_poll_interval (float): Upper bound in seconds of the wait between status checks of a batch.
+            async_max_concurrency (int): Maximum number of requests in flight at once of the asynchronous
+                classifier, also the size of its connection pool.
+            async_requests_per_minute (int, optional): Client-side requests per minute limit of the
+                asynchronous classifier. Unlimited by default.
+            async_tokens_per_minute (int, optional): Client-side tokens per minute limit of the
+                asynchronous classifier. Unlimited by default.
+            image_max_long_side (int): Maximum length in pixels of the longest side of prepared images.
+            image_max_short_side (int): Maximum length in pixels of the shortest side of prepared images.
+            image_format (str): Format images are re-encoded to ("JPEG" or "WEBP").
+            image_quality (int): Encoder quality setting of prepared images, from 1 to 100.
+        """
+        self.api_key = api_key
+        self.categories = categories
+        self.fine_tuned_models = fine_tuned_models or {}
+        self.text_model = text_model
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_keepalive_connections = max_keepalive_connections
+        self.http_client = DefaultHttpxClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections),
+        )
+        self.openai_client = OpenAI(api_key=api_key, http_client=self.http_client, max_retries=max_retries)
+        self.image_classifier = ImageClassifier(
+            api_key, categories, fine_tuned_models=self.fine_tuned_models, text_model=text_model,
+            client=self.openai_client,
+        )
+        self.router = ModelRouter(
+            self.fine_tuned_models, self.image_classifier.model, text_model, model_prices=model_prices,
+        )
+        self.image_classifier.router = self.router
+        self.batch_monitor = BatchMonitor(
+            api_key, initial_poll_interval=batch_poll_interval, max_poll_interval=max_batch_poll_interval,
+            client=self.openai_client,
+        )
+        self.file_processor = FileProcessor(timeout=conversion_timeout)
+        self.image_encoder = ImageEncoder(
+            max_long_side=image_max_long_side, max_short_side=image_max_short_side, image_format=image_format,
+            quality=image_quality,
+        )
+        self.async_max_concurrency = async_max_concurrency
+        self.async_requests_per_minute = async_requests_per_minute
+        self.async_tokens_per_minute = async_tokens_per_minute
+        self._async_image_classifier = None
+        logger.info(f"Created services with up to {max_connections} OpenAI connections")
+
+    def close(self):
+        """
+        Close the connections to OpenAI.
+        """
+        self.openai_client.close()
+
+    @property
+    def async_image_classifier(self):
+        """
+        Returns:
+            AsyncImageClassifier: Classifier of the ASGI application, created on first use so that
+                its client is bound to the event loop of the server. It shares the router of
+                `image_classifier`.
+        """
+        if self._async_image_classifier is None:
+            http_client = DefaultAsyncHttpxClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.async_max_concurrency,
+                                    max_keepalive_connections=self.max_keepalive_connections),
+            )
+            self._async_image_classifier = AsyncImageClassifier(
+                self.api_key, self.categories, fine_tuned_models=self.fine_tuned_models, text_model=self.text_model,
+                max_concurrency=self.async_max_concurrency, requests_per_minute=self.async_requests_per_minute,
+                tokens_per_minute=self.async_tokens_per_minute,
+                client=AsyncOpenAI(api_key=self.api_key, http_client=http_client, max_retries=0),
+                router=self.router,
+            )
+        return self._async_image_classifier
+
+    async def aclose(self):
+        """
+        Close the connections to OpenAI, including those of the asynchronous classifier.
+        """
+        self.close()
+        if self._async_image_classifier is not None:
+            await self._async_image_classifier.client.close()
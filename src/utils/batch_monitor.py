@@ -1,73 +1,172 @@
-import time
 import logging
 import json
 from openai import OpenAI
 
+from src.utils.metrics import metrics
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Batch statuses after which a batch will never produce results
+FAILED_STATUSES = ("failed", "expired", "cancelled")
+
 class BatchMonitor:
-    def __init__(self, api_key):
+    def __init__(self, api_key, initial_poll_interval=5, max_poll_interval=300, backoff_factor=2, client=None):
         """
         Initialize the BatchMonitor with API credentials.
 
         Args:
             api_key (str): The API key for OpenAI.
+            initial_poll_interval (float): Seconds to wait before the first status check is repeated.
+            max_poll_interval (float): Upper bound in seconds of the wait between status checks.
+            backoff_factor (float): Factor the wait grows by after each status check.
+            client (OpenAI, optional): Client to share with other components. A new client is created by default.
         """
-        self.client = OpenAI(api_key=api_key)
+        self.client = client if client is not None else OpenAI(api_key=api_key)
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff_factor = backoff_factor
 
-    def monitor_batch_job(self, batch_job_id):
+    def next_poll_interval(self, poll_interval):
         """
-        Monitor the status of a batch job until completion.
+        Compute the wait before the next status check.
 
         Args:
-            batch_job_id (str): The ID of the batch job to be monitored.
+            poll_interval (float): The previous wait in seconds.
 
         Returns:
-            list: List of classifications from the batch job.
+            float: The next wait in seconds.
+        """
+        return min(poll_interval * self.backoff_factor, self.max_poll_interval)
+
+    def check_batch_job(self, batch_job_id):
         """
+        Retrieve the current state of a batch job.
+
+        Args:
+            batch_job_id (str): The ID of the batch job.
+
+        Returns:
+            Batch: The batch object, including its status and output file ID.
+        """
+        with metrics.span("batch_check"):
+            return self.client.batches.retrieve(batch_job_id)
+
+    def cancel_batch_job(self, batch_job_id):
+        """
+        Cancel a batch job, e.g. after its tasks were classified otherwise.
+
+        Args:
+            batch_job_id (str): The ID of the batch job.
+
+        Returns:
+            Batch: The batch object, with the "cancelling" status.
+        """
+        batch = self.client.batches.cancel(batch_job_id)
+        logger.info(f"Batch Job Cancelled: {batch_job_id}")
+        return batch
+
+    def iter_result_lines(self, result_file_id):
+        """
+        Download a batch result file line by line, without holding it in memory.
+
+        The download is timed as the "batch_download" stage, including the time the
+        caller spends on each line.
+
+        Args:
+            result_file_id (str): The ID of the batch output file.
+
+        Yields:
+            str: JSONL lines of the batch result file.
+        """
+        line_count = 0
         try:
-            # Poll until the batch job is processed
-            while True:
-                batch_status = self.client.batches.retrieve(batch_job_id)
-                if batch_status.status == 'completed':
-                    result_file_id = batch_status.output_file_id
-                    break
-                elif batch_status.status == 'failed':
-                    raise ValueError("Batch processing failed.")
-                else:
-                    logger.info("Batch is still processing. Waiting 5 seconds before checking again...")
-                    time.sleep(5)
-
-            # Retrieve the content of the result file
-            result = self.client.files.content(result_file_id).content
-            result_file_name = "data/batch_job_results.jsonl"
-            with open(result_file_name, 'wb') as file:
-                file.write(result)
-            logger.info(f"Batch Job Results saved to: {result_file_name}")
-
-            # Parse the results file and extract classifications
-            classifications = []
-            with open(result_file_name, 'r') as file:
-                for line in file:
-                    result_data = json.loads(line)
-                    
-                    # Extract custom_id
-                    custom_id = result_data.get("custom_id")
-
-                    # Extract category from the content JSON string
-                    content = result_data["response"]["body"]["choices"][0]["message"]["content"]
-                    category = json.loads(content).get("category")  # Parse the JSON string in "content"
-
-                    # Create the new dictionary
-                    result = {
-                        "custom_id": custom_id,
-                        "category": category
-                    }
-                    classifications.append(result)
-
-            return classifications
-        except Exception as e:
-            logger.error(f"Error monitoring batch job: {e}")
-            raise
+            with metrics.span("batch_download"), self.client.files.with_streaming_response.content(result_file_id) as response:
+                for line in response.iter_lines():
+                    line_count += 1
+                    yield line
+        finally:
+            metrics.inc("batch_result_lines_total", line_count)
+
+    def iter_results(self, result_file_id):
+        """
+        Download a batch result file and extract the classifications as they arrive.
+
+        Works for both the output file and the error file of a batch. Lines that
+        cannot be attributed to a task are logged and skipped.
+
+        Args:
+            result_file_id (str): The ID of the batch output or error file.
+
+        Yields:
+            dict: Classification of a task, see `parse_result`.
+        """
+        for line in self.iter_result_lines(result_file_id):
+            if line.strip():
+                result = self.parse_result(line)
+                if result is not None:
+                    yield result
+
+    @staticmethod
+    def parse_result(line):
+        """
+        Extract the classification from a line of a batch result file.
+
+        A task whose request failed, or whose model output is not a classification,
+        gets a None category and an "error" instead of failing the whole file.
+
+        Args:
+            line (str): JSONL line of the batch output or error file.
+
+        Returns:
+            dict: The custom_id and category of the task, and the category of each
+                page for tasks classifying several pages. None if the line cannot be
+                attributed to a task.
+        """
+        try:
+            result_data = json.loads(line)
+            custom_id = result_data["custom_id"]
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Skipping unreadable batch result line: {e}")
+            metrics.inc("batch_result_errors_total")
+            return None
+
+        try:
+            response = result_data.get("response") or {}
+            if result_data.get("error") or response.get("status_code", 200) != 200:
+                # Lines of the error file carry the failure instead of a model output
+                error = result_data.get("error") or (response.get("body") or {}).get("error") or {}
+                raise ValueError(error.get("message") or f"Request failed with status {response.get('status_code')}")
+            # Extract category from the content JSON string
+            content = response["body"]["choices"][0]["message"]["content"]
+            parsed_content = json.loads(content)  # Parse the JSON string in "content"
+            category = parsed_content.get("category")
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            logger.error(f"No classification for {custom_id}: {e}")
+            metrics.inc("batch_result_errors_total")
+            return {"custom_id": custom_id, "category": None, "error": str(e) or type(e).__name__}
+
+        # Create the new dictionary
+        result = {
+            "custom_id": custom_id,
+            "category": category
+        }
+        if "pages" in parsed_content:
+            result["pages"] = parsed_content["pages"]
+        return result
+
+    @classmethod
+    def parse_results(cls, lines):
+        """
+        Extract classifications from the lines of a batch result file.
+
+        Args:
+            lines (iterable): JSONL lines of the batch result file.
+
+        Returns:
+            list: List of dicts with the custom_id and category of each task, and the
+                category of each page for tasks classifying several pages.
+        """
+        results = (cls.parse_result(line) for line in lines if line.strip())
+        return [result for result in results if result is not None]
@@ -0,0 +1,139 @@
+import json
+import time
+import logging
+import threading
+
+from src.utils.batch_monitor import FAILED_STATUSES
+from src.utils.near_duplicates import fan_out_duplicates
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class BatchPoller:
+    def __init__(self, batch_registry, batch_monitor, classification_cache=None, results_chunk_size=500, max_errors=10):
+        """
+        Initialize a background poller for the jobs in a BatchJobRegistry.
+
+        Args:
+            batch_registry (BatchJobRegistry): Registry of submitted jobs.
+            batch_monitor (BatchMonitor): Monitor used to check batches and download their results.
+            classification_cache (ClassificationCache, optional): Cache that receives the results of completed jobs.
+            results_chunk_size (int): Number of downloaded classifications stored in the registry at once.
+            max_errors (int): Number of consecutive errors after which a job is failed instead of retried.
+        """
+        self.batch_registry = batch_registry
+        self.batch_monitor = batch_monitor
+        self.classification_cache = classification_cache
+        self.results_chunk_size = results_chunk_size
+        self.max_errors = max_errors
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start polling in a daemon thread, if it is not running yet.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="batch-poller", daemon=True)
+        self._thread.start()
+        logger.info("Batch poller started")
+
+    def stop(self):
+        """
+        Stop the polling thread.
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wake(self):
+        """
+        Make the polling thread re-read the registry, e.g. after a job was submitted.
+        """
+        self._wake_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                next_poll_at = self.poll_once()
+            except Exception as e:
+                logger.error(f"Error polling batch jobs: {e}")
+                next_poll_at = None
+            if next_poll_at is None:
+                wait = self.batch_monitor.max_poll_interval
+            else:
+                wait = min(max(0, next_poll_at - time.time()), self.batch_monitor.max_poll_interval)
+            self._wake_event.wait(wait)
+            self._wake_event.clear()
+
+    def poll_once(self, now=None):
+        """
+        Check every job that is due and collect the results of finished ones.
+
+        Args:
+            now (float, optional): Current time, defaults to time.time().
+
+        Returns:
+            float: Time of the next scheduled status check, or None if no job is in progress.
+        """
+        for job in self.batch_registry.due_jobs(now):
+            self._poll_job(job)
+        return self.batch_registry.next_poll_at()
+
+    def _poll_job(self, job):
+        job_id = job["job_id"]
+        try:
+            batches = [self.batch_monitor.check_batch_job(batch_id) for batch_id in job["batch_ids"]]
+            for batch in batches:
+                if batch.status in FAILED_STATUSES:
+                    self.batch_registry.fail(job_id, f"Batch {batch.id} {batch.status}")
+                    return
+            if any(batch.status != "completed" for batch in batches):
+                poll_interval = self.batch_monitor.next_poll_interval(job["poll_interval"])
+                logger.info(f"Job {job_id} is still processing. Checking again in {poll_interval} seconds")
+                self.batch_registry.schedule_next_poll(job_id, poll_interval)
+                return
+
+            if not self.batch_registry.claim(job_id):
+                return
+            # Results are stored in chunks while they are downloaded, so they can be
+            # streamed to clients early and memory does not grow with the batch size.
+            # Requests that failed within a completed batch are listed in its error file.
+            for batch in batches:
+                for file_id in (batch.output_file_id, batch.error_file_id):
+                    if file_id is None:
+                        continue
+                    chunk = []
+                    for classification in self.batch_monitor.iter_results(file_id):
+                        chunk.append(classification)
+                        if len(chunk) >= self.results_chunk_size:
+                            self._store_results(job, chunk)
+                            chunk = []
+                    self._store_results(job, chunk)
+            self.batch_registry.complete(job_id)
+        except Exception as e:
+            # Treat errors as transient, the job is checked again later, unless they keep recurring
+            error_count = self.batch_registry.record_error(job_id, self.batch_monitor.next_poll_interval(job["poll_interval"]))
+            logger.error(f"Error polling job {job_id} ({error_count}/{self.max_errors}): {e}")
+            if error_count >= self.max_errors:
+                self.batch_registry.fail(job_id, f"Giving up after {error_count} errors: {e}")
+
+    def _store_results(self, job, classifications):
+        # A representative and its near-duplicates are stored together
+        classifications = classifications + fan_out_duplicates(classifications, job["duplicates"])
+        self._cache_results(job, classifications)
+        self.batch_registry.add_results(job["job_id"], classifications)
+
+    def _cache_results(self, job, classifications):
+        if self.classification_cache is None:
+            return
+        for classification in classifications:
+            cache_key = job["cache_keys"].get(classification["custom_id"])
+            if cache_key is not None and classification["category"] is not None:
+                result = {field: classification[field] for field in ("category", "pages") if field in classification}
+                self.classification_cache.set(cache_key, json.dumps(result))
@@ -0,0 +1,270 @@
+import os
+import time
+import json
+import uuid
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class BatchJobRegistry:
+    # Seconds after which a download claimed by a worker that died is handed to another poller
+    CLAIM_TIMEOUT = 600
+
+    def __init__(self, db_path="data/batch_jobs.db"):
+        """
+        Initialize a persistent registry of submitted batch classification jobs.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, "
+                "batch_ids TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "cache_keys TEXT NOT NULL, "
+                "classifications TEXT NOT NULL, "
+                "duplicates TEXT NOT NULL DEFAULT '{}', "
+                "error TEXT, "
+                "error_count INTEGER NOT NULL DEFAULT 0, "
+                "poll_interval REAL NOT NULL, "
+                "next_poll_at REAL NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            # Classifications are stored one per row as they arrive, so they can be streamed.
+            # A task has a single result, which makes storing a result again harmless.
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "job_id TEXT NOT NULL, "
+                "custom_id TEXT NOT NULL, "
+                "classification TEXT NOT NULL, "
+                "UNIQUE (job_id, custom_id))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        for field in ("batch_ids", "cache_keys", "classifications", "duplicates"):
+            job[field] = json.loads(job[field])
+        return job
+
+    def create(self, batch_ids, cache_keys=None, classifications=None, duplicates=None, poll_interval=5):
+        """
+        Register a newly submitted job.
+
+        Args:
+            batch_ids (list): IDs of the OpenAI batches making up the job.
+            cache_keys (dict, optional): Classification cache key of each task, by custom_id.
+            classifications (list, optional): Classifications already known at submission, e.g. cache hits.
+            duplicates (dict, optional): Custom ID of the submitted representative of each near-duplicate, by custom_id.
+            poll_interval (float): Seconds before the first status check.
+
+        Returns:
+            str: ID of the registered job.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, batch_ids, status, cache_keys, classifications, duplicates, poll_interval, "
+                "next_poll_at, created_at, updated_at) VALUES (?, ?, 'in_progress', ?, '[]', ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(batch_ids), json.dumps(cache_keys or {}), json.dumps(duplicates or {}),
+                 poll_interval, now + poll_interval, now, now),
+            )
+            self._insert_results(conn, job_id, classifications or [])
+        logger.info(f"Registered job {job_id} for batches {batch_ids}")
+        return job_id
+
+    def get(self, job_id, include_results=True):
+        """
+        Look up a job.
+
+        Args:
+            job_id (str): ID of the job.
+            include_results (bool): Whether to include the classifications stored with `add_results`.
+
+        Returns:
+            dict: The job with its classifications so far, or None if it does not exist.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        if include_results:
+            job["classifications"].extend(classification for _, classification in self.results(job_id))
+        return job
+
+    @staticmethod
+    def _insert_results(conn, job_id, classifications):
+        conn.executemany(
+            "INSERT OR IGNORE INTO results (job_id, custom_id, classification) VALUES (?, ?, ?)",
+            ((job_id, classification["custom_id"], json.dumps(classification)) for classification in classifications),
+        )
+
+    def add_results(self, job_id, classifications):
+        """
+        Store classifications of a job as they become available.
+
+        Classifications of tasks that already have one are ignored, so a download
+        that is retried does not duplicate results.
+
+        Args:
+            job_id (str): ID of the job.
+            classifications (list): Classifications with a custom_id.
+        """
+        with self._connect() as conn:
+            self._insert_results(conn, job_id, classifications)
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def results(self, job_id, after=0, limit=None):
+        """
+        List the stored classifications of a job in the order they arrived.
+
+        Args:
+            job_id (str): ID of the job.
+            after (int): Only list classifications stored after this sequence number.
+            limit (int, optional): Maximum number of classifications listed.
+
+        Returns:
+            list: Sequence number and classification of each result.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, classification FROM results WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after, -1 if limit is None else limit),
+            ).fetchall()
+        return [(row["seq"], json.loads(row["classification"])) for row in rows]
+
+    def due_jobs(self, now=None):
+        """
+        List the jobs whose next status check is due.
+
+        Args:
+            now (float, optional): Current time, defaults to time.time().
+
+        Returns:
+            list: Jobs that are still in progress and due for a status check.
+        """
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'in_progress' AND next_poll_at <= ?) "
+                "OR (status = 'downloading' AND updated_at <= ?) ORDER BY next_poll_at",
+                (now, now - self.CLAIM_TIMEOUT),
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def next_poll_at(self):
+        """
+        Returns:
+            float: Time of the earliest scheduled status check, or None if no job is in progress.
+        """
+        with self._connect() as conn:
+            return conn.execute("SELECT MIN(next_poll_at) FROM jobs WHERE status = 'in_progress'").fetchone()[0]
+
+    def schedule_next_poll(self, job_id, poll_interval):
+        """
+        Schedule the next status check of a job after a successful one.
+
+        Args:
+            job_id (str): ID of the job.
+            poll_interval (float): Seconds until the next status check.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET poll_interval = ?, next_poll_at = ?, error_count = 0, updated_at = ? WHERE job_id = ?",
+                (poll_interval, now + poll_interval, now, job_id),
+            )
+
+    def record_error(self, job_id, poll_interval):
+        """
+        Record a failed status check or download and schedule a retry.
+
+        A claimed download is released, so the job is polled again.
+
+        Args:
+            job_id (str): ID of the job.
+            poll_interval (float): Seconds until the retry.
+
+        Returns:
+            int: Number of consecutive errors of the job, including this one.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'in_progress', poll_interval = ?, next_poll_at = ?, "
+                "error_count = error_count + 1, updated_at = ? WHERE job_id = ? AND status IN ('in_progress', 'downloading')",
+                (poll_interval, now + poll_interval, now, job_id),
+            )
+            row = conn.execute("SELECT error_count FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row["error_count"] if row is not None else 0
+
+    def claim(self, job_id):
+        """
+        Claim a finished job for downloading its results, so they are downloaded only once.
+
+        Args:
+            job_id (str): ID of the job.
+
+        Returns:
+            bool: True if the caller now owns the download.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'downloading', updated_at = ? WHERE job_id = ? "
+                "AND (status = 'in_progress' OR (status = 'downloading' AND updated_at <= ?))",
+                (now, job_id, now - self.CLAIM_TIMEOUT),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, classifications=()):
+        """
+        Mark a job completed.
+
+        Args:
+            job_id (str): ID of the job.
+            classifications (list): Remaining classifications returned by the batches, added to those already stored.
+        """
+        with self._connect() as conn:
+            self._insert_results(conn, job_id, classifications)
+            conn.execute("UPDATE jobs SET status = 'completed', updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+        logger.info(f"Job {job_id} completed")
+
+    def fail(self, job_id, error):
+        """
+        Mark a job as failed.
+
+        Args:
+            job_id (str): ID of the job.
+            error (str): Description of the failure.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE job_id = ?",
+                (error, time.time(), job_id),
+            )
+        logger.error(f"Job {job_id} failed: {error}")
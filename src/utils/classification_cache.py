@@ -0,0 +1,137 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class ClassificationCache:
+    def __init__(self, db_path="data/classification_cache.db", max_entries=10000, ttl_seconds=30 * 24 * 3600):
+        """
+        Initialize a persistent, content-addressed cache of classification results.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+            max_entries (int): Maximum number of entries kept; least recently used entries are evicted first.
+            ttl_seconds (int, optional): Age after which an entry expires. None disables expiry.
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS classifications ("
+                "key TEXT PRIMARY KEY, "
+                "result TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON classifications (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(content, model, categories, system_prompt, options=None):
+        """
+        Build the cache key for a document.
+
+        Args:
+            content (bytes): Raw bytes of the uploaded file.
+            model (str): Name of the model used for classification.
+            categories (list): List of categories for classification.
+            system_prompt (str): System prompt sent with the document.
+            options (dict, optional): Other settings affecting the result, e.g. page sampling.
+
+        Returns:
+            str: Hex digest identifying the document and classification settings.
+        """
+        settings = [model, list(categories), system_prompt]
+        if options is not None:
+            settings.append(options)
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(content).digest())
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached classification result.
+
+        Args:
+            key (str): Cache key built with `make_key`.
+
+        Returns:
+            The cached result, or None if there is no live entry for the key.
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT result, created_at FROM classifications WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM classifications WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE classifications SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, result):
+        """
+        Store a classification result and evict expired or excess entries.
+
+        Args:
+            key (str): Cache key built with `make_key`.
+            result: JSON-serializable classification result.
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO classifications (key, result, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now, now),
+            )
+            if self.ttl_seconds is not None:
+                conn.execute("DELETE FROM classifications WHERE created_at < ?", (now - self.ttl_seconds,))
+            if self.max_entries is not None:
+                conn.execute(
+                    "DELETE FROM classifications WHERE key IN ("
+                    "SELECT key FROM classifications ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def stats(self):
+        """
+        Report cache counters.
+
+        Returns:
+            dict: Hit and miss counts, hit rate and number of stored entries.
+        """
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
@@ -0,0 +1,161 @@
+import os
+import time
+import logging
+import mimetypes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from src.utils.metrics import call_measured, metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def create_conversion_executor(kind="process", max_workers=None):
+    """
+    Create the executor used to convert documents to images.
+
+    Rendering and image encoding are CPU-bound, so a process pool is used by default
+    to run them in parallel outside the GIL.
+
+    Args:
+        kind (str): "process" for a process pool or "thread" for a thread pool.
+        max_workers (int, optional): Number of workers, defaults to the number of CPUs.
+
+    Returns:
+        Executor: The conversion executor.
+
+    Raises:
+        ValueError: If the executor kind is not supported.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if kind == "process":
+        # Forking a multi-threaded web worker is unsafe, start workers from a clean process instead
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+    elif kind == "thread":
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError(f"Unsupported executor kind: {kind}")
+    logger.info(f"Created {kind} conversion executor with {max_workers} workers")
+    return executor
+
+def convert_document(file_processor, image_encoder, content, filename, use_text_layer=True, page_sampling=None):
+    """
+    Convert a document to the input of the classifier.
+
+    Born-digital PDFs are classified from the text of their first page, which is
+    much cheaper than an image; other documents are converted to an image
+    prepared for the vision model. With page sampling, a sample of the pages is
+    converted the same way, page by page.
+
+    Args:
+        file_processor (FileProcessor): Processor used for the conversion.
+        image_encoder (ImageEncoder): Encoder used to prepare the image.
+        content (bytes): Raw bytes of the document.
+        filename (str): Name of the document, used to determine its type.
+        use_text_layer (bool): Whether to use the text layer of PDFs when there is one.
+        page_sampling (dict, optional): Keyword arguments of `FileProcessor.process_pages`
+            ("every" and "max_pages") to classify a sample of the pages instead of the first page.
+
+    Returns:
+        dict: Either {"text": str}, {"image": bytes} with the prepared image, or {"pages": list}
+            with the "page" number and either the "text" or the prepared "image" of each sampled page.
+    """
+    if page_sampling is not None:
+        pages = file_processor.process_pages(content, filename, use_text_layer=use_text_layer, **page_sampling)
+        for page in pages:
+            if "image" in page:
+                page["image"], _ = image_encoder.prepare_image(page["image"])
+        return {"pages": pages}
+    if use_text_layer and mimetypes.guess_type(filename)[0] == "application/pdf":
+        text = file_processor.extract_pdf_text(content)
+        if text is not None:
+            return {"text": text}
+    prepared_bytes, _ = image_encoder.prepare_image(file_processor.process_bytes(content, filename))
+    return {"image": prepared_bytes}
+
+def convert_file(file_processor, image_encoder, file_path, use_text_layer=True, page_sampling=None):
+    """
+    Read a file and convert it to the input of the classifier.
+
+    Args:
+        file_processor (FileProcessor): Processor used for the conversion.
+        image_encoder (ImageEncoder): Encoder used to prepare the image.
+        file_path (str): The path to the file to be converted.
+        use_text_layer (bool): Whether to use the text layer of PDFs when there is one.
+        page_sampling (dict, optional): Page sampling settings, see `convert_document`.
+
+    Returns:
+        dict: The converted document as returned by `convert_document`.
+    """
+    with open(file_path, 'rb') as f:
+        return convert_document(file_processor, image_encoder, f.read(), file_path, use_text_layer, page_sampling)
+
+def iter_converted_files(executor, file_paths, file_processor, image_encoder, max_pending, timeout=None,
+                         use_text_layer=True, page_sampling=None):
+    """
+    Convert files on an executor, yielding each one as soon as it is ready.
+
+    At most `max_pending` files are submitted at once, so memory use does not grow
+    with the number of files and a file's timeout starts close to when its
+    conversion starts. A file that times out is skipped, but a conversion that
+    already started cannot be cancelled: its worker stays busy until it ends.
+    Only PDF rendering is bounded, by the timeout of the FileProcessor, which
+    kills the renderer processes. Text extraction, office documents and image
+    preparation run to completion, so a worker stuck in them is unavailable to
+    the pool until it returns.
+
+    Args:
+        executor (Executor): Executor running the conversions.
+        file_paths (iterable): Paths of the files to be converted.
+        file_processor (FileProcessor): Processor used for the conversion.
+        image_encoder (ImageEncoder): Encoder used to prepare the images.
+        max_pending (int): Maximum number of files submitted at once.
+        timeout (float, optional): Seconds after which a file is given up.
+        use_text_layer (bool): Whether to use the text layer of PDFs when there is one.
+        page_sampling (dict, optional): Page sampling settings, see `convert_document`.
+
+    Yields:
+        tuple: File path and converted document as returned by `convert_document`.
+            Files that fail or time out are logged and skipped.
+    """
+    file_paths = iter(file_paths)
+    futures = {}
+    deadlines = {}
+
+    def submit_next():
+        for file_path in file_paths:
+            future = executor.submit(call_measured, convert_file, file_processor, image_encoder, file_path, use_text_layer,
+                                     page_sampling)
+            futures[future] = file_path
+            deadlines[future] = time.monotonic() + timeout if timeout is not None else None
+            return
+
+    for _ in range(max_pending):
+        submit_next()
+    while futures:
+        pending_deadlines = [deadline for deadline in deadlines.values() if deadline is not None]
+        wait_time = max(0, min(pending_deadlines) - time.monotonic()) if pending_deadlines else None
+        done, _ = wait(futures, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            file_path = futures.pop(future)
+            del deadlines[future]
+            submit_next()
+            try:
+                converted, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                logger.info(f"Successfully processed file: {file_path}")
+            except Exception as e:
+                logger.error(f"Error processing file {file_path}: {e}")
+                continue
+            yield file_path, converted
+
+        now = time.monotonic()
+        for future, deadline in list(deadlines.items()):
+            if deadline is not None and deadline <= now:
+                future.cancel()
+                logger.error(f"Error processing file {futures.pop(future)}: timed out after {timeout} seconds")
+                del deadlines[future]
+                submit_next()
@@ -0,0 +1,165 @@
+import os
+import time
+import json
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class FileManifest:
+    def __init__(self, db_path="data/file_manifest.db"):
+        """
+        Initialize a persistent manifest of the files of a directory and their classifications.
+
+        Each file is recorded with its size, modification time and inode, the cache key
+        of its content, its classification once known and the batch job classifying it.
+        Comparing these with `os.stat` tells new, changed and deleted files apart
+        without reading unchanged files.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, "
+                "inode INTEGER NOT NULL, "
+                "cache_key TEXT NOT NULL, "
+                "result TEXT, "
+                "job_id TEXT, "
+                "updated_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        entry = dict(row)
+        if entry["result"] is not None:
+            entry["result"] = json.loads(entry["result"])
+        return entry
+
+    def diff(self, directory):
+        """
+        Compare the files of a directory with the manifest.
+
+        Only the metadata of the files is read. A file whose size, modification time
+        or inode changed is reported as changed, even if its content is the same.
+
+        Args:
+            directory (str): Directory of the files.
+
+        Returns:
+            dict: "new" and "changed" lists of (path, os.stat_result) tuples, "unchanged"
+                list of manifest entries and "deleted" list of paths.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM files WHERE path LIKE ? ESCAPE '\\'", (self._prefix(directory),)).fetchall()
+        # Files of subdirectories are recorded by scans of those directories
+        parent = os.path.dirname(os.path.join(directory, ""))
+        entries = {row["path"]: self._to_dict(row) for row in rows if os.path.dirname(row["path"]) == parent}
+        changes = {"new": [], "changed": [], "unchanged": [], "deleted": []}
+        with os.scandir(directory) as scanned:
+            for dir_entry in scanned:
+                if not dir_entry.is_file():
+                    continue
+                path = os.path.join(directory, dir_entry.name)
+                stat = dir_entry.stat()
+                entry = entries.pop(path, None)
+                if entry is None:
+                    changes["new"].append((path, stat))
+                elif (entry["size"], entry["mtime_ns"], entry["inode"]) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                    changes["changed"].append((path, stat))
+                else:
+                    changes["unchanged"].append(entry)
+        changes["deleted"] = sorted(entries)
+        return changes
+
+    @staticmethod
+    def _prefix(directory):
+        # LIKE pattern of the paths of the files in the directory and its subdirectories
+        escaped = os.path.join(directory, "").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return escaped + "%"
+
+    def record(self, path, stat, cache_key, result=None):
+        """
+        Record the current state of a new or changed file, forgetting its previous classification.
+
+        Args:
+            path (str): Path of the file.
+            stat (os.stat_result): Metadata of the file, taken before it was read.
+            cache_key (str): Classification cache key of the content of the file.
+            result (dict, optional): Classification of the file, if already known.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, cache_key, result, job_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, cache_key,
+                 None if result is None else json.dumps(result), time.time()),
+            )
+
+    def set_results(self, results):
+        """
+        Store the classifications of files.
+
+        Args:
+            results (dict): Classification of each file, by path.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE files SET result = ?, updated_at = ? WHERE path = ?",
+                ((json.dumps(result), now, path) for path, result in results.items()),
+            )
+
+    def set_job(self, paths, job_id):
+        """
+        Record the batch job classifying files, so they are not submitted again while it runs.
+
+        Args:
+            paths (iterable): Paths of the files.
+            job_id (str): ID of the job in the BatchJobRegistry.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE files SET job_id = ?, updated_at = ? WHERE path = ?",
+                ((job_id, now, path) for path in paths),
+            )
+
+    def remove(self, paths):
+        """
+        Forget deleted files.
+
+        Args:
+            paths (iterable): Paths of the files.
+        """
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in paths))
+
+    def entries(self):
+        """
+        Returns:
+            list: The manifest entries, by path.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM files ORDER BY path").fetchall()
+        return [self._to_dict(row) for row in rows]
@@ -0,0 +1,214 @@
+import time
+import bisect
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets of durations in seconds and of sizes in bytes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB to 256 MiB
+
+class Metrics:
+    def __init__(self, namespace="classify_docs"):
+        """
+        Initialize a registry of counters and histograms exposed in the Prometheus text format.
+
+        Recording a value takes a lock and a bisection over the buckets, so it can be
+        used on the hot path.
+
+        Args:
+            namespace (str): Prefix of the metric names.
+        """
+        self.namespace = namespace
+        # Values by metric name, then by sorted tuple of label pairs
+        self.counters = {}
+        # [bucket bounds, bucket counts, sum, count] by metric name, then by labels
+        self.histograms = {}
+        self.descriptions = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, description):
+        """
+        Set the help text of a metric.
+
+        Args:
+            name (str): Name of the metric, without the namespace.
+            description (str): Help text.
+        """
+        self.descriptions[name] = description
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter.
+
+        Args:
+            name (str): Name of the counter, without the namespace.
+            value (float): Amount added to the counter.
+            **labels: Labels of the counter.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        """
+        Record a value in a histogram.
+
+        Args:
+            name (str): Name of the histogram, without the namespace.
+            value (float): The recorded value.
+            buckets (tuple): Upper bounds of the buckets, used when the histogram is created.
+            **labels: Labels of the histogram.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = [tuple(buckets), [0] * len(buckets), 0.0, 0]
+            index = bisect.bisect_left(histogram[0], value)
+            if index < len(histogram[1]):
+                histogram[1][index] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """
+        Time a stage of the pipeline, recording its duration in the stage duration histogram.
+
+        Failed stages are recorded with the "error" label set to "true".
+
+        Args:
+            stage (str): Name of the stage.
+            **labels: Additional labels of the duration.
+        """
+        start = time.perf_counter()
+        error = "false"
+        try:
+            yield
+        except BaseException:
+            error = "true"
+            raise
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage, error=error, **labels)
+
+    def drain(self):
+        """
+        Take the recorded values out of the registry, e.g. to send them from a worker process to its parent.
+
+        Returns:
+            dict: The counters and histograms, to be passed to `merge`.
+        """
+        with self._lock:
+            snapshot = {"counters": self.counters, "histograms": self.histograms}
+            self.counters, self.histograms = {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add values taken from another registry with `drain`.
+
+        Args:
+            snapshot (dict): The drained counters and histograms, or None.
+        """
+        if not snapshot:
+            return
+        with self._lock:
+            for name, series in snapshot["counters"].items():
+                own_series = self.counters.setdefault(name, {})
+                for key, value in series.items():
+                    own_series[key] = own_series.get(key, 0) + value
+            for name, series in snapshot["histograms"].items():
+                own_series = self.histograms.setdefault(name, {})
+                for key, (buckets, counts, total, count) in series.items():
+                    histogram = own_series.get(key)
+                    if histogram is None:
+                        own_series[key] = [buckets, list(counts), total, count]
+                        continue
+                    histogram[1] = [own + other for own, other in zip(histogram[1], counts)]
+                    histogram[2] += total
+                    histogram[3] += count
+
+    @staticmethod
+    def _format_labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                full_name = f"{self.namespace}_{name}"
+                if name in self.descriptions:
+                    lines.append(f"# HELP {full_name} {self.descriptions[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{self._format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                full_name = f"{self.namespace}_{name}"
+                if name in self.descriptions:
+                    lines.append(f"# HELP {full_name} {self.descriptions[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, (buckets, counts, total, count) in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        labels = self._format_labels(key, [("le", repr(float(bound)))])
+                        lines.append(f"{full_name}_bucket{labels} {cumulative}")
+                    lines.append(f"{full_name}_bucket{self._format_labels(key, [('le', '+Inf')])} {count}")
+                    lines.append(f"{full_name}_sum{self._format_labels(key)} {total}")
+                    lines.append(f"{full_name}_count{self._format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+# Registry shared by the components of a process
+metrics = Metrics()
+metrics.describe("stage_duration_seconds", "Duration of each stage of the classification pipeline.")
+metrics.describe("requests_total", "HTTP requests by endpoint and status code.")
+metrics.describe("request_duration_seconds", "Duration of HTTP requests by endpoint.")
+metrics.describe("documents_total", "Documents by endpoint and outcome.")
+metrics.describe("document_bytes", "Size of the classified documents.")
+metrics.describe("payload_bytes", "Size of the documents sent to OpenAI, as text or base64 images.")
+metrics.describe("openai_requests_total", "OpenAI chat completion requests by model and status.")
+metrics.describe("openai_tokens_total", "Tokens used by OpenAI chat completions by model and type.")
+metrics.describe("image_bytes_in", "Size of the images given to the image encoder.")
+metrics.describe("image_bytes_out", "Size of the images prepared by the image encoder for the vision model.")
+metrics.describe("batch_file_bytes", "Size of the batch input files uploaded to OpenAI.")
+metrics.describe("batch_result_lines_total", "Lines of batch result files downloaded from OpenAI.")
+metrics.describe("batch_result_errors_total", "Lines of batch result files without a usable classification.")
+
+def call_measured(function, *args, **kwargs):
+    """
+    Call a function on an executor, returning the metrics it recorded in a worker process.
+
+    Values recorded in a process pool worker would otherwise stay in the worker;
+    pass the returned snapshot to `metrics.merge` in the parent process.
+
+    Args:
+        function (callable): The function to call.
+        *args: Positional arguments of the function.
+        **kwargs: Keyword arguments of the function.
+
+    Returns:
+        tuple: Result of the function and the drained metrics of the worker process,
+            or None when called in the process that exposes the metrics.
+    """
+    result = function(*args, **kwargs)
+    if multiprocessing.parent_process() is None:
+        return result, None
+    return result, metrics.drain()
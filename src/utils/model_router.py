@@ -0,0 +1,152 @@
+import re
+import logging
+import threading
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Words that indicate the domain of a document, matched in its text and file name
+DOMAIN_KEYWORDS = {
+    "finance": (
+        "invoice", "statement", "balance", "account", "payment", "amount", "tax", "vat", "bank", "iban",
+        "deposit", "withdrawal", "credit", "debit", "transaction", "receipt", "total due",
+    ),
+    "healthcare": (
+        "patient", "diagnosis", "prescription", "medical", "hospital", "clinic", "physician", "doctor",
+        "treatment", "dosage", "insurance claim", "lab results", "medication",
+    ),
+}
+
+class ModelRouter:
+    def __init__(self, fine_tuned_models, vision_model, text_model, domain_keywords=None, min_keyword_hits=2,
+                 model_prices=None):
+        """
+        Initialize a router picking the model of each document, with per-route metrics.
+
+        The domain of a document is detected from keywords in its text and file name,
+        which costs nothing compared to a model call. Documents of a domain with a
+        fine-tuned model are sent to it; the others to the text model when they are
+        given as text and to the vision model otherwise.
+
+        Args:
+            fine_tuned_models (dict): Fine-tuned model of each domain.
+            vision_model (str): Model for documents given as images.
+            text_model (str): Model for documents given as text.
+            domain_keywords (dict, optional): Keywords of each domain, defaults to DOMAIN_KEYWORDS.
+            min_keyword_hits (int): Number of distinct keywords of a domain needed in a document's text.
+            model_prices (dict, optional): Price in dollars per million input and output tokens of
+                each model, as a pair, used to estimate the cost of each route.
+        """
+        self.fine_tuned_models = fine_tuned_models or {}
+        self.vision_model = vision_model
+        self.text_model = text_model
+        self.min_keyword_hits = min_keyword_hits
+        self.model_prices = model_prices or {}
+        self.domain_patterns = {
+            domain: [re.compile(r"\b" + re.escape(keyword) + r"\b") for keyword in keywords]
+            for domain, keywords in (domain_keywords or DOMAIN_KEYWORDS).items()
+            if domain in self.fine_tuned_models
+        }
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def detect_domain(self, text=None, filename=None):
+        """
+        Detect the domain of a document among those with a fine-tuned model.
+
+        Args:
+            text (str, optional): Text of the document.
+            filename (str, optional): Name of the document; a single keyword in it is enough.
+
+        Returns:
+            str: The domain, or None if no domain is recognised.
+        """
+        best_domain, best_hits = None, 0
+        text = text.lower() if text else ""
+        filename = re.sub(r"[_\-.]+", " ", filename.lower()) if filename else ""
+        for domain, patterns in self.domain_patterns.items():
+            hits = sum(1 for pattern in patterns if pattern.search(text))
+            if any(pattern.search(filename) for pattern in patterns):
+                hits = max(hits, self.min_keyword_hits)
+            if hits >= self.min_keyword_hits and hits > best_hits:
+                best_domain, best_hits = domain, hits
+        return best_domain
+
+    def route(self, kind, text=None, filename=None, domain=None):
+        """
+        Pick the model of a document.
+
+        Args:
+            kind (str): "text" if the document is given as text, "vision" if it includes images.
+            text (str, optional): Text of the document, used to detect its domain.
+            filename (str, optional): Name of the document, used to detect its domain.
+            domain (str, optional): Domain given by the caller, which skips detection.
+
+        Returns:
+            tuple: Name of the route and model to use.
+        """
+        domain = domain or self.detect_domain(text, filename)
+        if domain in self.fine_tuned_models:
+            return f"fine_tuned:{domain}", self.fine_tuned_models[domain]
+        return kind, self.text_model if kind == "text" else self.vision_model
+
+    def _route_metrics(self, route, model):
+        return self.metrics.setdefault(route, {
+            "model": model, "requests": 0, "errors": 0, "batch_tasks": 0, "latency_seconds": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+        })
+
+    def record(self, route, model, latency, usage=None, error=False):
+        """
+        Record a realtime request of a route.
+
+        Args:
+            route (str): Name of the route.
+            model (str): Model the request was sent to.
+            latency (float): Duration of the request in seconds.
+            usage (CompletionUsage, optional): Token usage returned by the API.
+            error (bool): Whether the request failed.
+        """
+        with self._lock:
+            metrics = self._route_metrics(route, model)
+            metrics["requests"] += 1
+            metrics["errors"] += int(error)
+            metrics["latency_seconds"] += latency
+            if usage is not None:
+                metrics["prompt_tokens"] += usage.prompt_tokens
+                metrics["completion_tokens"] += usage.completion_tokens
+
+    def record_batch_task(self, route, model):
+        """
+        Record a task of a route submitted to the Batch API.
+
+        Args:
+            route (str): Name of the route.
+            model (str): Model the task is sent to.
+        """
+        with self._lock:
+            self._route_metrics(route, model)["batch_tasks"] += 1
+
+    def stats(self):
+        """
+        Report the traffic, latency and cost of each route.
+
+        Returns:
+            dict: Metrics of each route, with the average latency of realtime requests and
+                their estimated cost in dollars when the price of the model is known.
+        """
+        with self._lock:
+            stats = {}
+            for route, metrics in self.metrics.items():
+                route_stats = dict(metrics)
+                route_stats["average_latency_seconds"] = (
+                    metrics["latency_seconds"] / metrics["requests"] if metrics["requests"] else 0.0
+                )
+                if metrics["model"] in self.model_prices:
+                    input_price, output_price = self.model_prices[metrics["model"]]
+                    route_stats["estimated_cost"] = (
+                        metrics["prompt_tokens"] * input_price + metrics["completion_tokens"] * output_price
+                    ) / 1_000_000
+                stats[route] = route_stats
+            return stats
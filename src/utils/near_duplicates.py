@@ -0,0 +1,200 @@
+import io
+import hashlib
+import logging
+import numpy as np
+from PIL import Image
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def dhash(image_bytes, hash_size=8):
+    """
+    Compute the difference hash of an image.
+
+    Each bit tells whether a pixel of a small grayscale thumbnail is brighter than
+    its right neighbour, so rescans and re-exports of the same page differ in only
+    a few bits.
+
+    Args:
+        image_bytes (bytes): The encoded image.
+        hash_size (int): Width and height of the hashed thumbnail, giving hash_size ** 2 bits.
+
+    Returns:
+        int: The perceptual hash.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("L", (hash_size * 8, hash_size * 8))  # Lets JPEG decoding skip most of the pixels
+        thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+def text_hash(text):
+    """
+    Hash the text of a document, ignoring differences in whitespace and case.
+
+    Args:
+        text (str): Text extracted from the document.
+
+    Returns:
+        str: The hash.
+    """
+    return hashlib.sha256(" ".join(text.lower().split()).encode('utf-8')).hexdigest()
+
+def hamming_distance(first, second):
+    return bin(first ^ second).count("1")
+
+class BKTree:
+    def __init__(self):
+        """
+        Initialize a BK-tree of integer hashes searchable by Hamming distance.
+        """
+        # Nodes are [hash, item, {distance: child}]
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value, item):
+        """
+        Add a hash to the tree.
+
+        Args:
+            hash_value (int): The hash.
+            item: Value returned by searches matching the hash.
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, item, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, item, {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """
+        Find the hashes within a Hamming distance.
+
+        Only subtrees that can hold a match by the triangle inequality are visited.
+
+        Args:
+            hash_value (int): The hash to look up.
+            max_distance (int): Maximum Hamming distance of a match.
+
+        Returns:
+            list: Distance and item of each match, closest first.
+        """
+        matches = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+class NearDuplicateIndex:
+    def __init__(self, max_distance=6):
+        """
+        Initialize an index grouping near-duplicate documents into clusters.
+
+        Images are compared by the Hamming distance of their perceptual hashes and
+        texts by the hash of their normalized text. The first document of each
+        cluster is its representative.
+
+        Args:
+            max_distance (int): Maximum Hamming distance between the perceptual hashes of near-duplicate images.
+        """
+        self.max_distance = max_distance
+        self.image_hashes = BKTree()
+        self.text_hashes = {}
+        # Sampled pages are looked up by their first page, then compared page by page
+        self.first_page_image_hashes = BKTree()
+        self.first_page_text_hashes = {}
+        # Representative of each document found to be a near-duplicate
+        self.duplicates = {}
+
+    def add(self, key, converted):
+        """
+        Add a converted document to the index.
+
+        Args:
+            key (str): Identifier of the document.
+            converted (dict): Converted document as returned by `convert_document`.
+
+        Returns:
+            str: Identifier of the representative the document duplicates, or None if
+                the document is the representative of a new cluster.
+        """
+        if "pages" in converted:
+            representative = self._add_pages(key, converted["pages"])
+        elif "text" in converted:
+            representative = self.text_hashes.setdefault(text_hash(converted["text"]), key)
+            representative = representative if representative != key else None
+        else:
+            hash_value = dhash(converted["image"])
+            matches = self.image_hashes.search(hash_value, self.max_distance)
+            representative = matches[0][1] if matches else None
+            if representative is None:
+                self.image_hashes.add(hash_value, key)
+        if representative is not None:
+            self.duplicates[key] = representative
+            logger.info(f"{key} is a near-duplicate of {representative}")
+        return representative
+
+    def _add_pages(self, key, pages):
+        signature = [("text", text_hash(page["text"])) if "text" in page else ("image", dhash(page["image"]))
+                     for page in pages]
+        kind, first_hash = signature[0]
+        if kind == "text":
+            candidates = self.first_page_text_hashes.get(first_hash, [])
+        else:
+            candidates = [item for _, item in self.first_page_image_hashes.search(first_hash, self.max_distance)]
+        for candidate_key, candidate_signature in candidates:
+            if self._signatures_match(signature, candidate_signature):
+                return candidate_key
+        if kind == "text":
+            self.first_page_text_hashes.setdefault(first_hash, []).append((key, signature))
+        else:
+            self.first_page_image_hashes.add(first_hash, (key, signature))
+        return None
+
+    def _signatures_match(self, first, second):
+        if len(first) != len(second):
+            return False
+        for (first_kind, first_hash), (second_kind, second_hash) in zip(first, second):
+            if first_kind != second_kind:
+                return False
+            if first_kind == "text" and first_hash != second_hash:
+                return False
+            if first_kind == "image" and hamming_distance(first_hash, second_hash) > self.max_distance:
+                return False
+        return True
+
+def fan_out_duplicates(classifications, duplicates):
+    """
+    Copy the classifications of cluster representatives to their near-duplicates.
+
+    Args:
+        classifications (list): Classifications with a custom_id and category.
+        duplicates (dict): Custom ID of the representative of each near-duplicate, by custom_id.
+
+    Returns:
+        list: Classifications of the near-duplicates whose representative is classified.
+    """
+    results = {
+        classification["custom_id"]: {field: classification[field] for field in ("category", "pages") if field in classification}
+        for classification in classifications
+    }
+    return [
+        {"custom_id": custom_id, **results[representative], "duplicate_of": representative}
+        for custom_id, representative in duplicates.items()
+        if representative in results
+    ]
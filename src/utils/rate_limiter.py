@@ -0,0 +1,69 @@
+import time
+import asyncio
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class AsyncRateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Initialize a client-side limiter for requests and tokens per minute.
+
+        Both limits are token buckets that refill continuously and hold at most
+        one minute of budget, so short bursts are allowed up to the per-minute limit.
+
+        Args:
+            requests_per_minute (int, optional): Maximum requests per minute. None disables the limit.
+            tokens_per_minute (int, optional): Maximum tokens per minute. None disables the limit.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = requests_per_minute
+        self._available_tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute is not None:
+            self._available_requests = min(
+                self.requests_per_minute, self._available_requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute is not None:
+            self._available_tokens = min(
+                self.tokens_per_minute, self._available_tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.requests_per_minute is not None and self._available_requests < 1:
+            wait = max(wait, (1 - self._available_requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute is not None and self._available_tokens < tokens:
+            wait = max(wait, (tokens - self._available_tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens=0):
+        """
+        Wait until one request using the given number of tokens fits in both limits.
+
+        Args:
+            tokens (int): Estimated number of tokens used by the request.
+        """
+        if self.tokens_per_minute is not None:
+            tokens = min(tokens, self.tokens_per_minute)
+        # Callers are served one at a time so that waiting requests keep their order
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute is not None:
+                self._available_requests -= 1
+            if self.tokens_per_minute is not None:
+                self._available_tokens -= tokens
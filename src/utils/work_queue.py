@@ -0,0 +1,241 @@
+import os
+import time
+import json
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Statuses of the items of a WorkQueue
+STATUSES = ("pending", "processing", "done", "dead")
+
+class WorkQueue:
+    def __init__(self, db_path="data/work_queue.db", max_attempts=3, lease_seconds=600, retry_delay=30,
+                 max_retry_delay=3600):
+        """
+        Initialize a durable queue of files to classify, shared by worker processes.
+
+        A file is enqueued once per content: enqueuing it again is ignored until its
+        content, and so its cache key, changes. Workers claim items with a lease; the
+        item of a worker that crashed is claimed again once its lease expires. Failed
+        items are retried with exponential backoff, and dead-lettered once they used
+        up their attempts, including attempts that crashed their worker.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+            max_attempts (int): Number of attempts of an item before it is dead-lettered.
+            lease_seconds (float): Seconds after which an item claimed by a worker that did not
+                finish it can be claimed again.
+            retry_delay (float): Seconds before the first retry of a failed item.
+            max_retry_delay (float): Upper bound in seconds of the wait before a retry.
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            # Readers do not block the writer, so workers can claim items while others report results
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "item_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "path TEXT NOT NULL, "
+                "cache_key TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "worker TEXT, "
+                "lease_until REAL, "
+                "next_attempt_at REAL NOT NULL, "
+                "result TEXT, "
+                "error TEXT, "
+                "created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL, "
+                "UNIQUE (path, cache_key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_status_next_attempt_at ON items (status, next_attempt_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        item = dict(row)
+        if item["result"] is not None:
+            item["result"] = json.loads(item["result"])
+        return item
+
+    def enqueue(self, path, cache_key):
+        """
+        Add a file to the queue, unless it was already enqueued with the same content.
+
+        Args:
+            path (str): Path of the file.
+            cache_key (str): Classification cache key of the content of the file.
+
+        Returns:
+            bool: True if the file was added, False if it was already enqueued.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO items (path, cache_key, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                (path, cache_key, now, now, now),
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, worker, now=None):
+        """
+        Claim the next item due for processing.
+
+        Args:
+            worker (str): Identifier of the claiming worker.
+            now (float, optional): Current time, defaults to time.time().
+
+        Returns:
+            dict: The claimed item, or None if no item is due.
+        """
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            # Take the write lock first, so that two workers never claim the same item
+            conn.execute("BEGIN IMMEDIATE")
+            # Items whose worker crashed on their last attempt are not claimed again
+            dead = conn.execute(
+                "UPDATE items SET status = 'dead', error = 'Worker lost while processing', worker = NULL, "
+                "lease_until = NULL, updated_at = ? WHERE status = 'processing' AND lease_until <= ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            ).rowcount
+            if dead:
+                logger.error(f"Dead-lettered {dead} items whose worker was lost on their last attempt")
+            row = conn.execute(
+                "UPDATE items SET status = 'processing', worker = ?, attempts = attempts + 1, lease_until = ?, "
+                "updated_at = ? WHERE item_id = (SELECT item_id FROM items WHERE (status = 'pending' AND "
+                "next_attempt_at <= ?) OR (status = 'processing' AND lease_until <= ?) ORDER BY next_attempt_at, "
+                "item_id LIMIT 1) RETURNING *",
+                (worker, now + self.lease_seconds, now, now, now),
+            ).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def complete(self, item_id, worker, result):
+        """
+        Store the result of a claimed item.
+
+        Args:
+            item_id (int): ID of the item.
+            worker (str): Identifier of the worker that claimed the item.
+            result (dict): Classification of the file.
+
+        Returns:
+            bool: False if the item is no longer claimed by the worker, e.g. because its lease expired.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE item_id = ? AND worker = ? AND status = 'processing'",
+                (json.dumps(result), time.time(), item_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, item_id, worker, error, retry=True):
+        """
+        Record a failed attempt of a claimed item, scheduling a retry or dead-lettering it.
+
+        Args:
+            item_id (int): ID of the item.
+            worker (str): Identifier of the worker that claimed the item.
+            error (str): Description of the failure.
+            retry (bool): Whether the failure may be transient. Items failing otherwise
+                are dead-lettered right away.
+
+        Returns:
+            str: New status of the item, "pending" or "dead", or None if it is no longer
+                claimed by the worker.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM items WHERE item_id = ? AND worker = ? AND status = 'processing'",
+                (item_id, worker),
+            ).fetchone()
+            if row is None:
+                return None
+            attempts = row["attempts"]
+            status = "pending" if retry and attempts < self.max_attempts else "dead"
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+            conn.execute(
+                "UPDATE items SET status = ?, error = ?, worker = NULL, lease_until = NULL, next_attempt_at = ?, "
+                "updated_at = ? WHERE item_id = ?",
+                (status, error, now + delay, now, item_id),
+            )
+        if status == "dead":
+            logger.error(f"Dead-lettered item {item_id} after {attempts} attempts: {error}")
+        else:
+            logger.warning(f"Retrying item {item_id} in {delay} seconds (attempt {attempts}): {error}")
+        return status
+
+    def retry_dead(self, item_ids=None):
+        """
+        Put dead-lettered items back in the queue with fresh attempts, e.g. after fixing their cause.
+
+        Args:
+            item_ids (list, optional): IDs of the items to retry, all dead-lettered items by default.
+
+        Returns:
+            int: Number of items put back in the queue.
+        """
+        now = time.time()
+        query = "UPDATE items SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = 'dead'"
+        parameters = [now, now]
+        if item_ids is not None:
+            query += f" AND item_id IN ({', '.join('?' * len(item_ids))})"
+            parameters.extend(item_ids)
+        with self._connect() as conn:
+            return conn.execute(query, parameters).rowcount
+
+    def items(self, status=None, after=0, limit=100):
+        """
+        List the items of the queue in the order they were enqueued.
+
+        Args:
+            status (str, optional): Only list items with this status.
+            after (int): Only list items enqueued after the item with this ID.
+            limit (int): Maximum number of items listed.
+
+        Returns:
+            list: The items.
+        """
+        query = "SELECT * FROM items WHERE item_id > ?"
+        parameters = [after]
+        if status is not None:
+            query += " AND status = ?"
+            parameters.append(status)
+        query += " ORDER BY item_id LIMIT ?"
+        parameters.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(query, parameters).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def stats(self):
+        """
+        Returns:
+            dict: Number of items of each status.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM items GROUP BY status").fetchall()
+        counts = {status: 0 for status in STATUSES}
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.pre_classifier import PreClassifier
+from src.utils.batch_registry import BatchJobRegistry
+from src.utils.classification_cache import ClassificationCache
+from src.utils.file_manifest import FileManifest
+from src.utils.work_queue import WorkQueue
+
+# Stores of src.pipeline and components of src.app are replaced with ones in the temporary
+# directory of each test, so that the tests of the Flask and ASGI applications do not touch data/
+
+@pytest.fixture
+def classification_cache(tmp_path, mocker):
+    cache = ClassificationCache(db_path=str(tmp_path / "classification_cache.db"))
+    mocker.patch('src.pipeline.classification_cache', cache)
+    return cache
+
+@pytest.fixture
+def batch_registry(tmp_path, mocker):
+    registry = BatchJobRegistry(db_path=str(tmp_path / "batch_jobs.db"))
+    mocker.patch('src.pipeline.batch_registry', registry)
+    mocker.patch('src.app.ensure_batch_poller')
+    return registry
+
+@pytest.fixture
+def file_manifest(tmp_path, mocker):
+    manifest = FileManifest(db_path=str(tmp_path / "file_manifest.db"))
+    mocker.patch('src.pipeline.file_manifest', manifest)
+    return manifest
+
+@pytest.fixture
+def work_queue(tmp_path, mocker):
+    queue = WorkQueue(db_path=str(tmp_path / "work_queue.db"))
+    mocker.patch('src.pipeline.work_queue', queue)
+    return queue
+
+@pytest.fixture
+def conversion_executor(mocker):
+    # Threads share the mocks of the test, unlike worker processes
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        mocker.patch('src.app.conversion_executor', executor)
+        yield executor
+
+@pytest.fixture
+def pre_classifier(tmp_path, mocker):
+    pre_classifier = PreClassifier(index_path=str(tmp_path / "pre_classifier_index.npz"))
+    mocker.patch('src.pipeline.pre_classifier', pre_classifier)
+    return pre_classifier
+
+@pytest.fixture
+def isolated_app(classification_cache, batch_registry, file_manifest, work_queue, conversion_executor, pre_classifier):
+    """
+    Replace every stateful component of src.pipeline and src.app, for modules using it with `pytestmark`.
+    """
@@ -1,6 +1,16 @@
+import json
+import time
 from io import BytesIO
+from types import SimpleNamespace
 import pytest
 from src.app import app
+from src.image_classifier import ImageClassifier
+from src.pipeline import CATEGORIES, TEXT_MODEL
+from src.pre_classifier import PreClassifier
+from src.utils.batch_monitor import BatchMonitor
+from src.utils.batch_poller import BatchPoller
+
+pytestmark = pytest.mark.usefixtures("isolated_app")
 
 @pytest.fixture
 def client():
@@ -18,12 +28,12 @@ def test_no_selected_file(client):
     assert response.status_code == 400
 
 def test_success(client, mocker):
-    # Mock the FileProcessor's process_file to avoid actual file processing
-    mocker.patch('src.file_processor.FileProcessor.process_file', return_value="dummy_image_path")
-    # Mock the ImageEncoder's encode_image method to return a dummy base64 encoded string
-    mocker.patch('src.image_encoder.ImageEncoder.encode_image', return_value="dummy_base64_string")
+    # Mock the FileProcessor's process_bytes to avoid actual file processing
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', return_value=b"dummy_image_bytes")
+    # Mock the ImageEncoder's prepare_image method to skip image preparation
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', return_value=(b"dummy_image_bytes", "image/jpeg"))
     # Mock the ImageClassifier's classify_image method
-    mocker.patch('src.app.ImageClassifier.classify_image', return_value={"category": "test_class"})
+    mocker.patch('src.image_classifier.ImageClassifier.classify_image', return_value={"category": "test_class"})
 
     data = {'file': (BytesIO(b"dummy content"), 'file.pdf')}
     response = client.post('/classify_file', data=data, content_type='multipart/form-data')
@@ -31,26 +41,187 @@ def test_success(client, mocker):
     assert response.get_json() == {"classification": {"category": "test_class"}}
 
 
-def test_classify_files(client, mocker):
+def test_digital_pdf_is_classified_from_text(client, mocker):
+    classify_image = mocker.patch('src.image_classifier.ImageClassifier.classify_image')
+    classify_text = mocker.patch('src.image_classifier.ImageClassifier.classify_text', return_value={"category": "invoice"})
+
+    with open("files/invoice_1.pdf", "rb") as f:
+        data = {'file': (BytesIO(f.read()), 'invoice_1.pdf')}
+    response = client.post('/classify_file', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"classification": {"category": "invoice"}}
+    assert "Invoice Number" in classify_text.call_args.args[0]
+    classify_image.assert_not_called()
+
+
+def test_multi_page_classification(client, mocker):
+    mocker.patch('src.app.PAGE_SAMPLING', {"every": 5, "max_pages": 4})
+    result = '{"category": "bank statement", "pages": [{"page": 1, "category": "bank statement"}, {"page": 2, "category": "bank statement"}]}'
+    classify_pages = mocker.patch('src.image_classifier.ImageClassifier.classify_pages', return_value=result)
+
+    with open("files/bank_statement_1.pdf", "rb") as f:
+        data = {'file': (BytesIO(f.read()), 'bank_statement_1.pdf')}
+    response = client.post('/classify_file', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"classification": result}
+    assert [page["page"] for page in classify_pages.call_args.args[0]] == [1, 2]
+
+
+def test_cache_hit_skips_processing(client, mocker):
+    process = mocker.patch('src.file_processor.FileProcessor.process_bytes', return_value=b"dummy_image_bytes")
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', return_value=(b"dummy_image_bytes", "image/jpeg"))
+    classify = mocker.patch('src.image_classifier.ImageClassifier.classify_image', return_value={"category": "test_class"})
+
+    for _ in range(2):
+        data = {'file': (BytesIO(b"dummy content"), 'file.pdf')}
+        response = client.post('/classify_file', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.get_json() == {"classification": {"category": "test_class"}}
+
+    assert process.call_count == 1
+    assert classify.call_count == 1
+    stats = client.get('/cache/stats').get_json()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_classify_files(client, mocker, batch_registry, classification_cache):
     mock_response = {
         "classifications": [
             {"category": "driver's license", "custom_id": "task-files/drivers_license_1.jpg"},
             {"category": "driver's license", "custom_id": "task-files/drivers_license_3.jpg"},
-            {"category": "bank statement", "custom_id": "task-data/images/bank_statement_1_page_1.png"},
+            {"category": "bank statement", "custom_id": "task-files/bank_statement_1.pdf"},
             {"category": "driver's license", "custom_id": "task-files/drivers_licence_2.jpg"},
-            {"category": "bank statement", "custom_id": "task-data/images/bank_statement_3_page_1.png"},
-            {"category": "bank statement", "custom_id": "task-data/images/bank_statement_2_page_1.png"},
-            {"category": "invoice", "custom_id": "task-data/images/invoice_1_page_1.png"},
-            {"category": "invoice", "custom_id": "task-data/images/invoice_2_page_1.png"},
-            {"category": "invoice", "custom_id": "task-data/images/invoice_3_page_1.png"}
+            {"category": "bank statement", "custom_id": "task-files/bank_statement_3.pdf"},
+            {"category": "bank statement", "custom_id": "task-files/bank_statement_2.pdf"},
+            {"category": "invoice", "custom_id": "task-files/invoice_1.pdf"},
+            {"category": "invoice", "custom_id": "task-files/invoice_2.pdf"},
+            {"category": "invoice", "custom_id": "task-files/invoice_3.pdf"}
         ]
     }
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', side_effect=lambda content, filename: content)
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', side_effect=lambda image_bytes: (image_bytes, "image/jpeg"))
+    mocker.patch('src.image_classifier.ImageClassifier.execute_batch_jobs', side_effect=lambda tasks: ["batch_123"] if list(tasks) else [])
 
-    mocker.patch('src.app.BatchMonitor.monitor_batch_job', return_value=mock_response["classifications"])
+    # The endpoint returns a job ID without waiting for the batch
+    response = client.get('/classify_files')
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert response.get_json()["status_url"] == f"/batches/{job_id}"
+    assert client.get(f"/batches/{job_id}").get_json()["status"] == "in_progress"
+
+    # The background poller collects the results once the batch completes
+    batch_monitor = mocker.MagicMock(spec=BatchMonitor)
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_123", status="completed", output_file_id="file_123", error_file_id=None)
+    batch_monitor.iter_results.return_value = mock_response["classifications"]
+    BatchPoller(batch_registry, batch_monitor, classification_cache).poll_once(now=time.time() + 10)
+
+    response = client.get(f"/batches/{job_id}")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "completed"
+    assert response.get_json()["classifications"] == mock_response["classifications"]
+    batch_monitor.check_batch_job.assert_called_once_with("batch_123")
 
+    # Classified files are served from the cache afterwards
     response = client.get('/classify_files')
     assert response.status_code == 200
-    assert response.get_json() == mock_response
+    assert len(response.get_json()["classifications"]) == len(mock_response["classifications"])
+
+
+def test_confident_pre_classification_skips_llm(client, mocker, pre_classifier):
+    classify_text = mocker.patch('src.image_classifier.ImageClassifier.classify_text')
+    with open("files/invoice_1.pdf", "rb") as f:
+        content = f.read()
+    text = "Invoice Number Bill To Total Due"
+    mocker.patch('src.app.convert_document', return_value={"text": text})
+    for _ in range(2):
+        pre_classifier.add("text", PreClassifier.text_vector(text), "invoice")
+
+    data = {'file': (BytesIO(content), 'invoice_1.pdf')}
+    response = client.post('/classify_file', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"classification": '{"category": "invoice"}', "pre_classified": True}
+    classify_text.assert_not_called()
+    assert client.get('/pre_classifier/stats').get_json()["escalation_rate"] == 0.0
+
+
+def test_stream_batch_results(client, mocker, batch_registry):
+    job_id = batch_registry.create(["batch_123"], classifications=[{"custom_id": "task-a.pdf", "category": "invoice", "cached": True}])
+
+    def complete_job(seconds):
+        batch_registry.add_results(job_id, [{"custom_id": "task-b.pdf", "category": "other"}])
+        batch_registry.complete(job_id)
+
+    mocker.patch('src.app.time.sleep', side_effect=complete_job)
+
+    response = client.get(f'/batches/{job_id}/results')
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {"custom_id": "task-a.pdf", "category": "invoice", "cached": True},
+        {"custom_id": "task-b.pdf", "category": "other"},
+        {"job_id": job_id, "status": "completed", "error": None},
+    ]
+    assert client.get('/batches/unknown/results').status_code == 404
+
+
+def test_stream_batch_results_resumes_after_max_duration(client, mocker, batch_registry):
+    job_id = batch_registry.create(["batch_123"], classifications=[{"custom_id": "task-a.pdf", "category": "invoice", "cached": True}])
+    mocker.patch('src.app.RESULTS_STREAM_MAX_DURATION', 0)
+
+    response = client.get(f'/batches/{job_id}/results')
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0] == {"custom_id": "task-a.pdf", "category": "invoice", "cached": True}
+    next_url = lines[-1].pop("next_url")
+    assert lines[-1] == {"job_id": job_id, "status": "in_progress"}
+
+    batch_registry.add_results(job_id, [{"custom_id": "task-b.pdf", "category": "other"}])
+    batch_registry.complete(job_id)
+    response = client.get(next_url)
+
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {"custom_id": "task-b.pdf", "category": "other"},
+        {"job_id": job_id, "status": "completed", "error": None},
+    ]
+    assert client.get(f'/batches/{job_id}/results?after=abc').status_code == 400
+
+
+def test_classify_files_stream(client, mocker, batch_registry, classification_cache):
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', side_effect=lambda content, filename: content)
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', side_effect=lambda image_bytes: (image_bytes, "image/jpeg"))
+    submitted = []
+    mocker.patch('src.image_classifier.ImageClassifier.execute_batch_jobs', side_effect=lambda tasks: submitted.extend(tasks) or ["batch_123"])
+    image_classifier = ImageClassifier(api_key="sk-test", categories=CATEGORIES, text_model=TEXT_MODEL)
+    with open("files/invoice_1.pdf", "rb") as f:
+        classification_cache.set(image_classifier.cache_key(f.read()), '{"category": "invoice"}')
+
+    def complete_job(seconds):
+        job_id = batch_registry.due_jobs(now=time.time() + 10)[0]["job_id"]
+        batch_registry.add_results(job_id, [{"custom_id": task["custom_id"], "category": "other"} for task in submitted])
+        batch_registry.complete(job_id)
+
+    mocker.patch('src.app.time.sleep', side_effect=complete_job)
+
+    response = client.get('/classify_files?stream=true')
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0] == {"custom_id": "task-files/invoice_1.pdf", "category": "invoice", "cached": True}
+    assert lines[1]["status"] == "in_progress"
+    assert sorted(line["custom_id"] for line in lines[2:-1]) == sorted(task["custom_id"] for task in submitted)
+    assert len(submitted) == 8
+    assert lines[-1] == {"job_id": lines[1]["job_id"], "status": "completed", "error": None}
+
+
+def test_unknown_batch(client):
+    response = client.get('/batches/unknown')
+    assert response.status_code == 404
 
 # Renamed test for clarity and avoid pytest confusion
 @pytest.mark.parametrize("filename, expected", [
@@ -64,3 +235,84 @@ def test_allowed_file_extension(filename, expected):
     allowed_extensions = {"pdf", "png", "jpg", "jpeg"}
     result = filename.split('.')[-1].lower() in allowed_extensions if '.' in filename else False
     assert result == expected
+
+
+def test_metrics_endpoint(client, mocker):
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', return_value=b"dummy_image_bytes")
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', return_value=(b"dummy_image_bytes", "image/jpeg"))
+    mocker.patch('src.image_classifier.ImageClassifier.classify_image', return_value={"category": "test_class"})
+    client.post('/classify_file', data={"file": (BytesIO(b"dummy_image_data"), "metrics.jpg")},
+                content_type='multipart/form-data')
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.data.decode()
+    assert 'classify_docs_documents_total{endpoint="classify_file",outcome="classified"}' in body
+    assert 'classify_docs_stage_duration_seconds_count{error="false",stage="convert"}' in body
+    assert 'classify_docs_requests_total{endpoint="classify_file",status="200"}' in body
+
+
+def test_enqueue_files(client, work_queue):
+    first = client.post('/queue').get_json()
+    second = client.post('/queue').get_json()
+
+    assert first["enqueued"] == 9
+    assert second == {"enqueued": 0, "already_enqueued": 9, "queue": first["queue"]}
+    assert first["queue"]["pending"] == 9
+    items = client.get('/queue/items?status=pending&limit=5').get_json()["items"]
+    assert len(items) == 5
+    assert client.get('/queue/items?status=unknown').status_code == 400
+
+
+def test_classify_files_incremental(client, mocker, tmp_path, batch_registry, classification_cache):
+    files_directory = tmp_path / "files"
+    files_directory.mkdir()
+    for name in ("a.png", "b.png"):
+        (files_directory / name).write_bytes(name.encode())
+    mocker.patch('src.app.FILES_DIRECTORY', str(files_directory))
+    mocker.patch('src.app.NEAR_DUPLICATE_DETECTION', False)
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', side_effect=lambda content, filename: content)
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', side_effect=lambda image_bytes: (image_bytes, "image/jpeg"))
+    submitted = []
+    mocker.patch('src.image_classifier.ImageClassifier.execute_batch_jobs',
+                 side_effect=lambda tasks: submitted.append([task["custom_id"] for task in tasks]) or ["batch_123"])
+
+    first = client.get('/classify_files?incremental=true')
+    assert first.status_code == 202
+    assert (first.get_json()["new"], first.get_json()["unchanged"]) == (2, 0)
+    # Files of a job in progress are not submitted again
+    second = client.get('/classify_files?incremental=true').get_json()
+    assert (second["unchanged"], second["in_progress"], second["classifications"]) == (2, 2, [])
+
+    # The job completes and only the new file is submitted next
+    job_id = first.get_json()["job_id"]
+    batch_monitor = mocker.MagicMock(spec=BatchMonitor)
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_123", status="completed", output_file_id="file_123", error_file_id=None)
+    batch_monitor.iter_results.return_value = [
+        {"custom_id": f"task-{files_directory / name}", "category": "other"} for name in ("a.png", "b.png")
+    ]
+    BatchPoller(batch_registry, batch_monitor, classification_cache).poll_once(now=time.time() + 10)
+    (files_directory / "b.png").unlink()
+    (files_directory / "c.png").write_bytes(b"c")
+    third = client.get('/classify_files?incremental=true').get_json()
+
+    assert (third["new"], third["unchanged"], third["deleted"]) == (1, 1, 1)
+    assert [classification["category"] for classification in third["classifications"]] == ["other"]
+    assert [sorted(custom_ids) for custom_ids in submitted] == [
+        [f"task-{files_directory / 'a.png'}", f"task-{files_directory / 'b.png'}"], [f"task-{files_directory / 'c.png'}"],
+    ]
+    assert client.get('/classify_files?incremental=true&stream=true').status_code == 400
+
+def test_stores_are_created_on_first_use(mocker, tmp_path):
+    import src.pipeline as pipeline
+    db_path = tmp_path / "data" / "work_queue.db"
+    mocker.patch('src.pipeline.work_queue', None)
+    mocker.patch('src.pipeline.WORK_QUEUE_PATH', str(db_path))
+    assert not db_path.exists()
+
+    work_queue = pipeline.get_work_queue()
+
+    assert db_path.exists()
+    assert pipeline.get_work_queue() is work_queue
@@ -0,0 +1,143 @@
+import json
+import asyncio
+import httpx
+import pytest
+from src.asgi_app import app
+
+pytestmark = pytest.mark.usefixtures("isolated_app")
+
+def run(*requests):
+    """
+    Send requests to the ASGI application concurrently.
+
+    Args:
+        *requests: Method, URL and keyword arguments of each request.
+
+    Returns:
+        list: The responses.
+    """
+    async def send_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(client.request(method, url, **kwargs) for method, url, kwargs in requests))
+    return asyncio.run(send_all())
+
+def test_classify_file(mocker):
+    classify_text = mocker.patch('src.async_image_classifier.AsyncImageClassifier.classify_text',
+                                 return_value='{"category": "invoice"}')
+
+    with open("files/invoice_1.pdf", "rb") as f:
+        files = {"file": ("invoice_1.pdf", f.read())}
+    first, second = (run(("POST", "/classify_file", {"files": files}))[0] for _ in range(2))
+
+    assert first.status_code == 200
+    assert first.json() == {"classification": '{"category": "invoice"}'}
+    # The second request is answered from the cache
+    assert second.json() == first.json()
+    assert classify_text.call_count == 1
+    assert "Invoice Number" in classify_text.call_args.args[0]
+
+def test_classify_file_without_file():
+    response = run(("POST", "/classify_file", {"data": {"domain": "finance"}}))[0]
+    assert response.status_code == 400
+
+def test_classifications_are_concurrent(mocker):
+    requests = 20
+    in_flight = []
+    all_in_flight = asyncio.Event()
+
+    async def classify_text(self, text, filename=None, domain=None):
+        # Each classification waits until every request is classified at once, which
+        # requires more classifications in flight than there are conversion threads
+        in_flight.append(filename)
+        if len(in_flight) == requests:
+            all_in_flight.set()
+        await asyncio.wait_for(all_in_flight.wait(), timeout=10)
+        return json.dumps({"category": "invoice"})
+
+    mocker.patch('src.async_image_classifier.AsyncImageClassifier.classify_text', classify_text)
+    with open("files/invoice_1.pdf", "rb") as f:
+        content = f.read()
+
+    responses = run(*(("POST", "/classify_file", {"files": {"file": (f"invoice_{i}.pdf", content + b"%" * i)}})
+                      for i in range(requests)))
+
+    assert [response.status_code for response in responses] == [200] * requests
+    assert all_in_flight.is_set()
+
+def test_classify_files(mocker):
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', side_effect=lambda content, filename: content)
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', side_effect=lambda image_bytes: (image_bytes, "image/jpeg"))
+    mocker.patch('src.image_classifier.ImageClassifier.execute_batch_jobs', side_effect=lambda tasks: ["batch_123"] if list(tasks) else [])
+
+    response = run(("GET", "/classify_files", {}))[0]
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.json()["status_url"] == f"/batches/{job_id}"
+    # Other endpoints are served by the Flask application
+    status = run(("GET", f"/batches/{job_id}", {}))[0]
+    assert status.status_code == 200
+    assert status.json()["status"] == "in_progress"
+
+def test_open_result_streams_do_not_hold_threads(mocker, batch_registry):
+    # More streams than the default executor has threads
+    streams = 40
+    job_id = batch_registry.create(["batch_123"])
+    mocker.patch('src.app.RESULTS_STREAM_POLL_INTERVAL', 0.05)
+    mocker.patch('src.app.RESULTS_STREAM_MAX_DURATION', 5)
+
+    async def classify_text(self, text, filename=None, domain=None):
+        # The streams only end once the job completes, which this classification does
+        batch_registry.add_results(job_id, [{"custom_id": "task-b.pdf", "category": "other"}])
+        batch_registry.complete(job_id)
+        return json.dumps({"category": "invoice"})
+
+    mocker.patch('src.async_image_classifier.AsyncImageClassifier.classify_text', classify_text)
+    with open("files/invoice_1.pdf", "rb") as f:
+        files = {"file": ("invoice_1.pdf", f.read())}
+
+    *results, classification = run(*[("GET", f"/batches/{job_id}/results", {})] * streams,
+                                   ("POST", "/classify_file", {"files": files}))
+
+    assert classification.status_code == 200
+    for response in results:
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines == [{"custom_id": "task-b.pdf", "category": "other"}, {"job_id": job_id, "status": "completed", "error": None}]
+    assert run(("GET", "/batches/unknown/results", {}))[0].status_code == 404
+    assert run(("GET", f"/batches/{job_id}/results?after=x", {}))[0].status_code == 400
+
+def test_flask_endpoints_are_served(mocker):
+    stats, missing = run(("GET", "/cache/stats", {}), ("GET", "/batches/unknown", {}))
+
+    assert stats.status_code == 200
+    assert "hits" in stats.json()
+    assert missing.status_code == 404
+
+def test_classify_files_within_deadline(mocker, classification_cache):
+    mocker.patch('src.file_processor.FileProcessor.process_bytes', side_effect=lambda content, filename: content)
+    mocker.patch('src.image_encoder.ImageEncoder.prepare_image', side_effect=lambda image_bytes: (image_bytes, "image/jpeg"))
+    execute_batch_jobs = mocker.patch('src.image_classifier.ImageClassifier.execute_batch_jobs')
+    for method in ("classify_image", "classify_text", "classify_pages"):
+        mocker.patch(f'src.async_image_classifier.AsyncImageClassifier.{method}', return_value='{"category": "invoice"}')
+
+    # Too short a deadline for a batch, every file is classified in realtime
+    response = run(("GET", "/classify_files?deadline=30&urgent=invoice_1.pdf", {}))[0]
+
+    assert response.status_code == 200
+    classifications = response.json()["classifications"]
+    assert classifications
+    assert {classification["path"] for classification in classifications} == {"realtime"}
+    assert {classification["category"] for classification in classifications} == {"invoice"}
+    execute_batch_jobs.assert_not_called()
+    assert classification_cache.stats()["entries"] == len(classifications)
+
+def test_classify_files_within_deadline_without_streaming():
+    response = run(("GET", "/classify_files?deadline=30&stream=true", {}))[0]
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("deadline", ["abc", "0", "-5", "nan", "inf", ""])
+def test_classify_files_rejects_invalid_deadline(deadline):
+    response = run(("GET", f"/classify_files?deadline={deadline}", {}))[0]
+    assert response.status_code == 400
+    assert response.json() == {"error": "The deadline must be a positive number of seconds"}
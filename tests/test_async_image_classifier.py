@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import BadRequestError, RateLimitError
+
+from src.async_image_classifier import AsyncImageClassifier
+from src.utils.rate_limiter import AsyncRateLimiter
+
+
+def make_response(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def make_error(error_class, status_code):
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return error_class("error", response=response, body=None)
+
+
+@pytest.fixture
+def classifier(mocker):
+    classifier = AsyncImageClassifier(api_key="sk-test", categories=["invoice", "other"], initial_backoff=0.001)
+    classifier.client = mocker.MagicMock()
+    return classifier
+
+
+def test_classify_images_yields_all_results(classifier):
+    async def parse(messages, **kwargs):
+        image_url = messages[1]["content"][0]["image_url"]["url"]
+        await asyncio.sleep(0.01 if image_url.endswith("slow") else 0)
+        return make_response(image_url)
+
+    classifier.client.beta.chat.completions.parse = parse
+
+    async def collect():
+        return [item async for item in classifier.classify_images({"a": "slow", "b": "fast"}, mime_type="image/webp")]
+
+    assert asyncio.run(collect()) == [("b", "data:image/webp;base64,fast"), ("a", "data:image/webp;base64,slow")]
+
+
+def test_classify_image_retries_rate_limit_errors(classifier, mocker):
+    classifier.client.beta.chat.completions.parse = mocker.AsyncMock(side_effect=[
+        make_error(RateLimitError, 429),
+        make_response('{"category": "invoice"}'),
+    ])
+
+    assert asyncio.run(classifier.classify_image("image")) == '{"category": "invoice"}'
+    assert classifier.client.beta.chat.completions.parse.await_count == 2
+
+
+def test_classify_image_does_not_retry_client_errors(classifier, mocker):
+    classifier.client.beta.chat.completions.parse = mocker.AsyncMock(side_effect=make_error(BadRequestError, 400))
+
+    with pytest.raises(BadRequestError):
+        asyncio.run(classifier.classify_image("image"))
+    assert classifier.client.beta.chat.completions.parse.await_count == 1
+
+
+def test_classify_images_can_return_exceptions(classifier, mocker):
+    classifier.max_retries = 0
+    classifier.client.beta.chat.completions.parse = mocker.AsyncMock(side_effect=make_error(RateLimitError, 429))
+
+    async def collect():
+        return [item async for item in classifier.classify_images({"a": "image"}, return_exceptions=True)]
+
+    [(key, result)] = asyncio.run(collect())
+    assert key == "a"
+    assert isinstance(result, RateLimitError)
+
+
+def test_rate_limiter_waits_for_budget(mocker):
+    rate_limiter = AsyncRateLimiter(requests_per_minute=2, tokens_per_minute=1000)
+
+    async def fake_sleep(seconds):
+        # Simulate time passing by moving the last refill back
+        rate_limiter._last_refill -= seconds
+
+    sleep = mocker.patch('src.utils.rate_limiter.asyncio.sleep', side_effect=fake_sleep)
+
+    async def acquire_three():
+        for _ in range(3):
+            await rate_limiter.acquire(100)
+
+    asyncio.run(acquire_three())
+    assert sleep.call_count == 1
+    assert sleep.call_args.args[0] == pytest.approx(30, abs=0.1)
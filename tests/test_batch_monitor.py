@@ -0,0 +1,52 @@
+import json
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from src.utils.batch_monitor import BatchMonitor
+
+
+def result_line(custom_id, content):
+    return json.dumps({"custom_id": custom_id, "response": {"body": {"choices": [{"message": {"content": json.dumps(content)}}]}}})
+
+
+def test_iter_results_parses_streamed_lines(mocker):
+    lines = [
+        result_line("task-a.pdf", {"category": "invoice"}),
+        "",
+        result_line("task-b.pdf", {"category": "bank statement", "pages": [{"page": 1, "category": "bank statement"}]}),
+    ]
+    monitor = BatchMonitor(api_key="sk-test")
+    monitor.client = mocker.MagicMock()
+
+    @contextmanager
+    def content(file_id):
+        yield SimpleNamespace(iter_lines=lambda: iter(lines))
+
+    monitor.client.files.with_streaming_response.content.side_effect = content
+
+    results = monitor.iter_results("file_1")
+    assert next(results) == {"custom_id": "task-a.pdf", "category": "invoice"}
+    assert list(results) == [
+        {"custom_id": "task-b.pdf", "category": "bank statement", "pages": [{"page": 1, "category": "bank statement"}]},
+    ]
+    monitor.client.files.with_streaming_response.content.assert_called_once_with("file_1")
+    monitor.client.files.content.assert_not_called()
+
+
+def test_unusable_results_become_errors():
+    lines = [
+        json.dumps({"custom_id": "task-a.pdf", "response": {"status_code": 200, "body": {"choices": []}}}),
+        json.dumps({"custom_id": "task-b.pdf", "response": {"body": {"choices": [{"message": {"content": '{"categ'}}]}}}),
+        json.dumps({"custom_id": "task-c.pdf", "response": {"status_code": 429, "body": {"error": {"message": "Rate limit exceeded"}}}}),
+        json.dumps({"custom_id": "task-d.pdf", "response": None, "error": {"code": "expired", "message": "Request expired"}}),
+        '{"custom_id": "task-e.p',
+        result_line("task-f.pdf", {"category": "invoice"}),
+    ]
+
+    results = BatchMonitor.parse_results(lines)
+
+    assert [result["custom_id"] for result in results] == ["task-a.pdf", "task-b.pdf", "task-c.pdf", "task-d.pdf", "task-f.pdf"]
+    assert all(result["category"] is None and result["error"] for result in results[:4])
+    assert results[2]["error"] == "Rate limit exceeded"
+    assert results[3]["error"] == "Request expired"
+    assert results[4] == {"custom_id": "task-f.pdf", "category": "invoice"}
@@ -0,0 +1,166 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils.batch_monitor import BatchMonitor
+from src.utils.batch_poller import BatchPoller
+from src.utils.batch_registry import BatchJobRegistry
+from src.utils.classification_cache import ClassificationCache
+
+
+@pytest.fixture
+def batch_registry(tmp_path):
+    return BatchJobRegistry(db_path=str(tmp_path / "batch_jobs.db"))
+
+
+@pytest.fixture
+def batch_monitor(mocker):
+    batch_monitor = mocker.MagicMock(spec=BatchMonitor)
+    batch_monitor.next_poll_interval.side_effect = lambda poll_interval: min(poll_interval * 2, 300)
+    return batch_monitor
+
+
+def test_running_job_backs_off(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"], poll_interval=5)
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="in_progress")
+
+    BatchPoller(batch_registry, batch_monitor).poll_once(now=time.time() + 10)
+
+    job = batch_registry.get(job_id)
+    assert job["status"] == "in_progress"
+    assert job["poll_interval"] == 10
+    assert batch_registry.due_jobs(now=time.time() + 5) == []
+
+
+def test_failed_batch_fails_job(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"])
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="expired")
+
+    BatchPoller(batch_registry, batch_monitor).poll_once(now=time.time() + 10)
+
+    job = batch_registry.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "Batch batch_1 expired"
+
+
+def test_results_are_downloaded_once(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"], classifications=[{"custom_id": "task-a", "category": "invoice"}])
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="completed", output_file_id="file_1", error_file_id=None)
+    batch_monitor.iter_results.return_value = [{"custom_id": "task-b", "category": "other"}]
+    poller = BatchPoller(batch_registry, batch_monitor)
+
+    poller.poll_once(now=time.time() + 10)
+    poller.poll_once(now=time.time() + 10)
+
+    batch_monitor.iter_results.assert_called_once_with("file_1")
+    assert batch_registry.get(job_id)["classifications"] == [
+        {"custom_id": "task-a", "category": "invoice"},
+        {"custom_id": "task-b", "category": "other"},
+    ]
+
+
+def test_failed_download_is_retried(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"])
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="completed", output_file_id="file_1", error_file_id=None)
+    batch_monitor.iter_results.side_effect = ConnectionError("reset")
+
+    BatchPoller(batch_registry, batch_monitor).poll_once(now=time.time() + 10)
+
+    job = batch_registry.get(job_id)
+    assert job["status"] == "in_progress"
+    assert job["poll_interval"] == 10
+
+
+def test_recurring_errors_fail_job(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"])
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="completed", output_file_id="file_1", error_file_id=None)
+    batch_monitor.iter_results.side_effect = KeyError("choices")
+    poller = BatchPoller(batch_registry, batch_monitor, max_errors=3)
+
+    for _ in range(3):
+        poller.poll_once(now=time.time() + 1000)
+
+    job = batch_registry.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "Giving up after 3 errors: 'choices'"
+    assert batch_monitor.iter_results.call_count == 3
+
+
+def test_successful_check_resets_error_count(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"])
+    batch_monitor.check_batch_job.side_effect = [
+        ConnectionError("reset"),
+        SimpleNamespace(id="batch_1", status="in_progress"),
+        ConnectionError("reset"),
+    ]
+    poller = BatchPoller(batch_registry, batch_monitor, max_errors=2)
+
+    for _ in range(3):
+        poller.poll_once(now=time.time() + 1000)
+
+    assert batch_registry.get(job_id)["status"] == "in_progress"
+
+
+def test_error_file_results_are_stored(batch_registry, batch_monitor):
+    job_id = batch_registry.create(["batch_1"])
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="completed", output_file_id="file_1", error_file_id="file_2")
+    batch_monitor.iter_results.side_effect = lambda file_id: {
+        "file_1": [{"custom_id": "task-a", "category": "invoice"}],
+        "file_2": [{"custom_id": "task-b", "category": None, "error": "Rate limit exceeded"}],
+    }[file_id]
+
+    BatchPoller(batch_registry, batch_monitor).poll_once(now=time.time() + 10)
+
+    job = batch_registry.get(job_id)
+    assert job["status"] == "completed"
+    assert job["classifications"] == [
+        {"custom_id": "task-a", "category": "invoice"},
+        {"custom_id": "task-b", "category": None, "error": "Rate limit exceeded"},
+    ]
+
+
+def test_results_fan_out_to_near_duplicates(batch_registry, batch_monitor, tmp_path):
+    cache = ClassificationCache(db_path=str(tmp_path / "cache.db"))
+    job_id = batch_registry.create(
+        ["batch_1"],
+        cache_keys={"task-a": "key-a", "task-a-rescan": "key-a-rescan"},
+        duplicates={"task-a-rescan": "task-a"},
+    )
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="completed", output_file_id="file_1", error_file_id=None)
+    batch_monitor.iter_results.return_value = [{"custom_id": "task-a", "category": "invoice"}]
+
+    BatchPoller(batch_registry, batch_monitor, cache).poll_once(now=time.time() + 10)
+
+    assert batch_registry.get(job_id)["classifications"] == [
+        {"custom_id": "task-a", "category": "invoice"},
+        {"custom_id": "task-a-rescan", "category": "invoice", "duplicate_of": "task-a"},
+    ]
+    assert cache.get("key-a-rescan") == '{"category": "invoice"}'
+
+
+def test_results_are_stored_in_chunks(batch_registry, batch_monitor, mocker):
+    job_id = batch_registry.create(["batch_1"], duplicates={"task-c2": "task-c"})
+    batch_monitor.check_batch_job.return_value = SimpleNamespace(id="batch_1", status="completed", output_file_id="file_1", error_file_id=None)
+    batch_monitor.iter_results.return_value = iter([
+        {"custom_id": f"task-{name}", "category": "invoice"} for name in ("a", "b", "c")
+    ])
+    add_results = mocker.spy(batch_registry, "add_results")
+
+    BatchPoller(batch_registry, batch_monitor, results_chunk_size=2).poll_once(now=time.time() + 10)
+
+    assert [len(call.args[1]) for call in add_results.call_args_list] == [2, 2]
+    assert [classification["custom_id"] for _, classification in batch_registry.results(job_id)] == [
+        "task-a", "task-b", "task-c", "task-c2",
+    ]
+    assert batch_registry.get(job_id)["status"] == "completed"
+
+
+def test_stored_results_are_not_duplicated(batch_registry):
+    job_id = batch_registry.create(["batch_1"], classifications=[{"custom_id": "task-a", "category": "invoice"}])
+    batch_registry.add_results(job_id, [{"custom_id": "task-a", "category": "invoice"}, {"custom_id": "task-b", "category": "other"}])
+    batch_registry.add_results(job_id, [{"custom_id": "task-b", "category": "other"}])
+
+    results = batch_registry.results(job_id)
+    assert [classification["custom_id"] for _, classification in results] == ["task-a", "task-b"]
+    assert batch_registry.results(job_id, after=results[0][0]) == results[1:]
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from openai import OpenAI
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.mock_openai import MockOpenAI
+from benchmarks.run import find_regressions
+from src.file_processor import FileProcessor
+from src.image_classifier import ImageClassifier
+from src.utils.batch_monitor import BatchMonitor
+
+
+@pytest.fixture
+def mock_openai():
+    mock = MockOpenAI(["invoice", "other"], latency=0, latency_jitter=0, batch_latency=0)
+    mock.start()
+    yield mock
+    mock.stop()
+
+
+@pytest.fixture
+def client(mock_openai):
+    client = OpenAI(api_key="sk-test", base_url=mock_openai.base_url, max_retries=1)
+    yield client
+    client.close()
+
+
+def test_generate_corpus(tmp_path):
+    paths = generate_corpus(str(tmp_path), 4, ["pdf", "png"], seed=1)
+
+    assert [path.rsplit(".", 1)[1] for path in paths] == ["pdf", "png", "pdf", "png"]
+    with open(paths[0], 'rb') as pdf:
+        assert FileProcessor().extract_pdf_text(pdf.read()) is not None
+    again = generate_corpus(str(tmp_path / "again"), 1, ["pdf"], seed=1)
+    with open(paths[0], 'rb') as first, open(again[0], 'rb') as second:
+        assert first.read() == second.read()
+
+
+def test_mock_classifies_realtime_requests(client, mock_openai):
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"], client=client)
+
+    result = json.loads(classifier.classify_text("Invoice total due"))
+    pages = json.loads(classifier.classify_pages([{"page": 1, "text": "Invoice"}, {"page": 3, "image": "aaa"}]))
+
+    assert result["category"] in ("invoice", "other")
+    assert [page["page"] for page in pages["pages"]] == [1, 3]
+    assert mock_openai.counters["chat_completions"] == 2
+    assert classifier.router.stats()["text"]["prompt_tokens"] > 0
+
+
+def test_mock_rate_limit_is_retried(client, mock_openai):
+    mock_openai.requests_per_minute = 1
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"], client=client)
+    classifier.classify_text("first")
+    mock_openai._request_times = [t - 59.9 for t in mock_openai._request_times]
+
+    classifier.classify_text("second")
+
+    assert mock_openai.counters["rate_limited"] == 1
+    assert mock_openai.counters["chat_completions"] == 3
+
+
+def test_mock_runs_batches(client, mock_openai):
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"], client=client)
+    monitor = BatchMonitor(api_key="sk-test", client=client)
+
+    batch_ids = classifier.execute_batch_jobs(classifier.create_batch_request({"a.png": "aaa", "b.png": "bbb"}))
+    batch = monitor.check_batch_job(batch_ids[0])
+
+    assert batch.status == "completed"
+    assert sorted(result["custom_id"] for result in monitor.iter_results(batch.output_file_id)) == ["task-a.png", "task-b.png"]
+    assert mock_openai.counters["batch_tasks"] == 2
+
+
+def test_find_regressions():
+    baseline = {"realtime": {"docs_per_second": 10, "latency_seconds": {"p95": 1.0}}, "batch": {"docs_per_second": 5}}
+    report = {"realtime": {"docs_per_second": 7, "latency_seconds": {"p95": 1.1}}}
+
+    regressions = find_regressions(report, baseline, max_regression=0.2)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("realtime.docs_per_second")
@@ -0,0 +1,40 @@
+from src.utils.classification_cache import ClassificationCache
+
+
+def test_key_depends_on_content_and_settings():
+    key = ClassificationCache.make_key(b"content", "model", ["a", "b"], "prompt")
+    assert key == ClassificationCache.make_key(b"content", "model", ["a", "b"], "prompt")
+    assert key != ClassificationCache.make_key(b"other", "model", ["a", "b"], "prompt")
+    assert key != ClassificationCache.make_key(b"content", "other-model", ["a", "b"], "prompt")
+    assert key != ClassificationCache.make_key(b"content", "model", ["a"], "prompt")
+    assert key != ClassificationCache.make_key(b"content", "model", ["a", "b"], "other prompt")
+
+
+def test_get_set_and_counters(tmp_path):
+    cache = ClassificationCache(db_path=str(tmp_path / "cache.db"))
+    assert cache.get("key") is None
+    cache.set("key", '{"category": "invoice"}')
+    assert cache.get("key") == '{"category": "invoice"}'
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+
+def test_results_persist_across_instances(tmp_path):
+    ClassificationCache(db_path=str(tmp_path / "cache.db")).set("key", {"category": "invoice"})
+    assert ClassificationCache(db_path=str(tmp_path / "cache.db")).get("key") == {"category": "invoice"}
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ClassificationCache(db_path=str(tmp_path / "cache.db"), ttl_seconds=-1)
+    cache.set("key", "value")
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ClassificationCache(db_path=str(tmp_path / "cache.db"), max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
@@ -0,0 +1,32 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from src.utils.conversion_executor import create_conversion_executor, iter_converted_files
+
+
+def test_create_conversion_executor():
+    with create_conversion_executor("thread", 2) as executor:
+        assert isinstance(executor, ThreadPoolExecutor)
+    with create_conversion_executor("process", 1) as executor:
+        assert isinstance(executor, ProcessPoolExecutor)
+    with pytest.raises(ValueError):
+        create_conversion_executor("fiber")
+
+
+def test_iter_converted_files_skips_failures_and_timeouts(mocker):
+    def convert_file(file_processor, image_encoder, file_path, use_text_layer, page_sampling):
+        if file_path == "slow.pdf":
+            time.sleep(0.5)
+        if file_path == "broken.pdf":
+            raise ValueError("broken")
+        return file_path.encode()
+
+    mocker.patch('src.utils.conversion_executor.convert_file', side_effect=convert_file)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(iter_converted_files(
+            executor, ["a.pdf", "slow.pdf", "broken.pdf", "b.pdf"], None, None, max_pending=2, timeout=0.2,
+        ))
+
+    assert sorted(results) == [("a.pdf", b"a.pdf"), ("b.pdf", b"b.pdf")]
@@ -0,0 +1,48 @@
+import os
+import pytest
+from src.utils.file_manifest import FileManifest
+
+@pytest.fixture
+def manifest(tmp_path):
+    return FileManifest(db_path=str(tmp_path / "file_manifest.db"))
+
+def write(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def test_diff_detects_new_changed_and_deleted_files(manifest, tmp_path):
+    directory = tmp_path / "files"
+    directory.mkdir()
+    (directory / "sub").mkdir()
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        write(directory / name, name.encode())
+
+    changes = manifest.diff(str(directory))
+    assert sorted(os.path.basename(path) for path, _ in changes["new"]) == ["a.pdf", "b.pdf", "c.pdf"]
+    for path, stat in changes["new"]:
+        manifest.record(path, stat, f"key-{os.path.basename(path)}")
+    manifest.set_results({str(directory / "a.pdf"): {"category": "invoice"}})
+
+    write(directory / "b.pdf", b"changed content")
+    os.remove(directory / "c.pdf")
+    write(directory / "d.pdf", b"d")
+    changes = manifest.diff(str(directory))
+
+    assert [os.path.basename(path) for path, _ in changes["new"]] == ["d.pdf"]
+    assert [os.path.basename(path) for path, _ in changes["changed"]] == ["b.pdf"]
+    assert [entry["result"] for entry in changes["unchanged"]] == [{"category": "invoice"}]
+    assert changes["deleted"] == [str(directory / "c.pdf")]
+
+def test_record_forgets_previous_classification(manifest, tmp_path):
+    path = str(tmp_path / "a.pdf")
+    write(path, b"a")
+    manifest.record(path, os.stat(path), "key-1")
+    manifest.set_job([path], "job-1")
+    manifest.set_results({path: {"category": "invoice"}})
+
+    manifest.record(path, os.stat(path), "key-2")
+
+    entry, = manifest.entries()
+    assert (entry["cache_key"], entry["result"], entry["job_id"]) == ("key-2", None, None)
+    manifest.remove([path])
+    assert manifest.entries() == []
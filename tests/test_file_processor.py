@@ -0,0 +1,131 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+from pdf2image.exceptions import PDFPopplerTimeoutError
+from PIL import Image
+from pypdf import PdfWriter
+
+from src.file_processor import FileProcessor
+
+
+def test_convert_pdf_renders_only_first_page(tmp_path, mocker):
+    convert = mocker.patch('src.file_processor.convert_from_path', return_value=[Image.new("RGB", (10, 10))])
+    file_processor = FileProcessor(output_folder=str(tmp_path), max_dimension=1024, grayscale=True)
+
+    image_path = file_processor.convert_pdf_to_images("statement.pdf")
+
+    assert image_path == str(tmp_path / "statement_page_1.png")
+    convert.assert_called_once_with("statement.pdf", dpi=200, size=1024, first_page=1, last_page=1, grayscale=True, timeout=None)
+
+
+def test_render_pdf_pages_groups_consecutive_pages(tmp_path, mocker):
+    convert = mocker.patch('src.file_processor.convert_from_path', side_effect=lambda path, first_page, last_page, **kwargs: [
+        Image.new("RGB", (10, 10)) for _ in range(first_page, last_page + 1)
+    ])
+    file_processor = FileProcessor(output_folder=str(tmp_path))
+
+    images = file_processor.render_pdf_pages("statement.pdf", page_numbers=[1, 2, 3, 7])
+
+    assert len(images) == 4
+    assert [(c.kwargs["first_page"], c.kwargs["last_page"]) for c in convert.call_args_list] == [(1, 3), (7, 7)]
+
+
+def test_render_pdf_pages_share_the_timeout(tmp_path, mocker):
+    clock = mocker.patch('src.file_processor.time')
+    clock.monotonic.side_effect = [100.0, 100.0, 104.0, 111.0]
+    convert = mocker.patch('src.file_processor.convert_from_path', return_value=[Image.new("RGB", (10, 10))])
+    file_processor = FileProcessor(output_folder=str(tmp_path), timeout=10)
+
+    with pytest.raises(PDFPopplerTimeoutError):
+        file_processor.render_pdf_pages("statement.pdf", page_numbers=[1, 3, 5])
+
+    assert [c.kwargs["timeout"] for c in convert.call_args_list] == [10.0, 6.0]
+
+
+def test_process_bytes_renders_pdf_in_memory(tmp_path, mocker):
+    convert = mocker.patch('src.file_processor.convert_from_bytes', return_value=[Image.new("RGB", (10, 10))])
+    file_processor = FileProcessor(output_folder=str(tmp_path / "images"))
+
+    image_bytes = file_processor.process_bytes(b"%PDF-1.4", "upload.pdf")
+
+    assert image_bytes.startswith(b"\x89PNG")
+    assert convert.call_args.args == (b"%PDF-1.4",)
+    assert not (tmp_path / "images").exists()
+
+
+def test_process_bytes_returns_images_unchanged():
+    assert FileProcessor().process_bytes(b"jpeg bytes", "licence.jpg") == b"jpeg bytes"
+
+
+def make_docx(paragraphs):
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    document = (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as docx:
+        docx.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def test_process_bytes_renders_word_document():
+    file_processor = FileProcessor(max_dimension=1024)
+    assert file_processor.extract_word_text(make_docx(["INVOICE", "Total due: 100"])) == ["INVOICE", "Total due: 100"]
+
+    image_bytes = file_processor.process_bytes(make_docx(["INVOICE", "Total due: 100"]), "invoice.docx")
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        assert image.size == (724, 1024)
+        assert image.getextrema()[0] == 0  # some text was drawn
+
+
+def test_process_file_renders_excel_workbook(tmp_path):
+    excel_path = tmp_path / "statement.xlsx"
+    pd.DataFrame({"Date": ["2024-01-01"], "Balance": [1500]}).to_excel(excel_path, sheet_name="Statement", index=False)
+    file_processor = FileProcessor(output_folder=str(tmp_path / "images"))
+
+    assert file_processor.extract_excel_text(excel_path.read_bytes()) == ["[Statement]", "Date | Balance", "2024-01-01 | 1500"]
+    image_path = file_processor.process_file(str(excel_path))
+
+    assert image_path == str(tmp_path / "images" / "statement_page_1.png")
+
+
+def test_extract_pdf_text_uses_text_layer_of_digital_pdfs():
+    with open("files/invoice_1.pdf", "rb") as f:
+        text = FileProcessor().extract_pdf_text(f.read())
+    assert "Invoice Number" in text
+
+
+def test_extract_pdf_text_ignores_scans():
+    buffer = io.BytesIO()
+    Image.new("RGB", (100, 100), "white").save(buffer, "PDF")
+    assert FileProcessor().extract_pdf_text(buffer.getvalue()) is None
+    assert FileProcessor().extract_pdf_text(b"not a pdf") is None
+
+
+def test_sample_page_numbers_is_bounded():
+    assert FileProcessor.sample_page_numbers(1) == [1]
+    assert FileProcessor.sample_page_numbers(3) == [1, 3]
+    assert FileProcessor.sample_page_numbers(12, every=5, max_pages=4) == [1, 6, 11, 12]
+    assert FileProcessor.sample_page_numbers(100, every=5, max_pages=4) == [1, 6, 51, 100]
+    assert FileProcessor.sample_page_numbers(100, every=5, max_pages=1) == [1]
+
+
+def test_process_pages_renders_only_sampled_pages_without_text(mocker):
+    # A statement with a scan appended: page 3 has no text layer
+    writer = PdfWriter()
+    writer.append("files/bank_statement_1.pdf")
+    writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    convert = mocker.patch('src.file_processor.convert_from_bytes', return_value=[Image.new("RGB", (10, 10))])
+
+    pages = FileProcessor().process_pages(buffer.getvalue(), "statement.pdf", every=0, max_pages=4)
+
+    assert [page["page"] for page in pages] == [1, 3]
+    assert "text" in pages[0]
+    assert pages[1]["image"].startswith(b"\x89PNG")
+    assert (convert.call_args.kwargs["first_page"], convert.call_args.kwargs["last_page"]) == (3, 3)
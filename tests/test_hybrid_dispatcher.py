@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from openai import AsyncOpenAI, OpenAI
+
+from benchmarks.mock_openai import MockOpenAI
+from src.async_image_classifier import AsyncImageClassifier
+from src.hybrid_dispatcher import HybridDispatcher
+from src.image_classifier import ImageClassifier
+from src.image_encoder import ImageEncoder
+from src.utils.batch_monitor import BatchMonitor
+
+CATEGORIES = ["invoice", "other"]
+
+@pytest.fixture
+def mock_openai():
+    mock = MockOpenAI(CATEGORIES, latency=0.05, latency_jitter=0, batch_latency=0)
+    mock.start()
+    yield mock
+    mock.stop()
+
+def create_dispatcher(max_concurrency=10, router_latency=None, base_url=None, **kwargs):
+    client = OpenAI(api_key="sk-test", base_url=base_url)
+    image_classifier = ImageClassifier("sk-test", CATEGORIES, client=client)
+    async_image_classifier = AsyncImageClassifier(
+        "sk-test", CATEGORIES, max_concurrency=max_concurrency, requests_per_minute=None, tokens_per_minute=None,
+        client=AsyncOpenAI(api_key="sk-test", base_url=base_url, max_retries=0), router=image_classifier.router,
+    )
+    if router_latency is not None:
+        image_classifier.router.record("text", "gpt-4o-mini", router_latency)
+    batch_monitor = BatchMonitor("sk-test", initial_poll_interval=0.05, max_poll_interval=0.1, client=client)
+    return HybridDispatcher(image_classifier, async_image_classifier, batch_monitor, ImageEncoder(), **kwargs)
+
+def test_plan_keeps_bulk_on_batch_when_the_deadline_allows():
+    dispatcher = create_dispatcher(max_concurrency=10, router_latency=2, safety_factor=1, min_batch_window=60,
+                                   min_realtime=2)
+    task_ids = [f"doc-{i}" for i in range(100)]
+
+    realtime_ids, batch_ids, fallback_after = dispatcher.plan(task_ids, deadline=3600, urgent=["doc-50"])
+
+    assert realtime_ids == ["doc-50", "doc-0", "doc-1"]
+    assert len(batch_ids) == 97
+    # A fallback of the whole batch takes 10 rounds of 2 seconds
+    assert fallback_after == 3600 - 20
+
+def test_plan_moves_documents_to_realtime_when_the_deadline_is_short():
+    dispatcher = create_dispatcher(max_concurrency=10, router_latency=2, safety_factor=1, min_batch_window=60)
+    task_ids = [f"doc-{i}" for i in range(100)]
+
+    realtime_ids, batch_ids, fallback_after = dispatcher.plan(task_ids, deadline=70)
+
+    # 10 documents fit the 10 seconds left after the minimum batch window
+    assert (len(realtime_ids), len(batch_ids), fallback_after) == (50, 50, 60)
+    assert batch_ids == task_ids[50:]
+    assert dispatcher.plan(task_ids, deadline=30) == (task_ids, [], None)
+
+def test_dispatch_collects_batch_results(mock_openai):
+    documents = {f"doc-{i}": {"text": f"Invoice {i}"} for i in range(6)}
+
+    async def dispatch():
+        dispatcher = create_dispatcher(base_url=mock_openai.base_url, router_latency=0.05, min_batch_window=1,
+                                       min_realtime=2)
+        return await dispatcher.dispatch(documents, deadline=10)
+
+    results = asyncio.run(dispatch())
+
+    assert [results[task_id]["path"] for task_id in documents] == ["realtime"] * 2 + ["batch"] * 4
+    assert all(result["category"] in CATEGORIES for result in results.values())
+    assert mock_openai.counters["batch_tasks"] == 4
+
+def test_dispatch_falls_back_to_realtime_after_the_fallback_time(mock_openai):
+    mock_openai.batch_latency = 60
+    documents = {f"doc-{i}": {"text": f"Invoice {i}"} for i in range(4)}
+
+    async def dispatch():
+        dispatcher = create_dispatcher(base_url=mock_openai.base_url, router_latency=0.05, min_batch_window=0.2)
+        return await dispatcher.dispatch(documents, deadline=1)
+
+    results = asyncio.run(dispatch())
+
+    assert [result["path"] for result in results.values()] == ["fallback"] * 4
+    assert all(result["category"] in CATEGORIES for result in results.values())
+    batch, = mock_openai.batches.values()
+    assert batch["cancelled"]
+
+def test_dispatch_falls_back_to_realtime_when_a_batch_cannot_be_read(mock_openai, mocker):
+    documents = {f"doc-{i}": {"text": f"Invoice {i}"} for i in range(4)}
+    dispatcher = create_dispatcher(base_url=mock_openai.base_url, router_latency=0.05, min_batch_window=0.2,
+                                   min_realtime=1)
+    mocker.patch.object(dispatcher.batch_monitor, "iter_results", side_effect=KeyError("choices"))
+    cancel_batch_job = mocker.spy(dispatcher.batch_monitor, "cancel_batch_job")
+
+    results = asyncio.run(dispatcher.dispatch(documents, deadline=10))
+
+    assert [result["path"] for result in results.values()] == ["realtime"] + ["fallback"] * 3
+    assert all(result["category"] in CATEGORIES for result in results.values())
+    batch_id, = mock_openai.batches
+    cancel_batch_job.assert_called_once_with(batch_id)
+
+def test_dispatch_retries_failed_batch_tasks_in_realtime(mock_openai, mocker):
+    documents = {f"doc-{i}": {"text": f"Invoice {i}"} for i in range(3)}
+    dispatcher = create_dispatcher(base_url=mock_openai.base_url, router_latency=0.05, min_batch_window=0.2)
+    mocker.patch.object(dispatcher.batch_monitor, "iter_results", return_value=[
+        {"custom_id": "task-doc-0", "category": "invoice"},
+        {"custom_id": "task-doc-1", "category": None, "error": "Expecting value"},
+    ])
+
+    results = asyncio.run(dispatcher.dispatch(documents, deadline=10))
+
+    assert [result["path"] for result in results.values()] == ["batch", "fallback", "fallback"]
+    assert all(result["category"] in CATEGORIES for result in results.values())
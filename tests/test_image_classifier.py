@@ -0,0 +1,132 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.image_classifier import ImageClassifier
+
+
+@pytest.fixture
+def classifier(mocker):
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"])
+    classifier.client = mocker.MagicMock()
+    uploads = []
+
+    def create_file(file, purpose):
+        uploads.append([json.loads(line) for line in file[1].read().splitlines()])
+        return SimpleNamespace(id=f"file_{len(uploads)}")
+
+    classifier.client.files.create.side_effect = create_file
+    classifier.client.batches.create.side_effect = lambda input_file_id, **kwargs: SimpleNamespace(id=f"batch_for_{input_file_id}")
+    classifier.uploads = uploads
+    return classifier
+
+
+def test_create_batch_request_is_lazy(classifier):
+    def images():
+        yield "a.png", "aaa"
+        raise AssertionError("images should be consumed one at a time")
+
+    tasks = classifier.create_batch_request(images(), mime_type="image/webp")
+    task = next(tasks)
+    assert task["custom_id"] == "task-a.png"
+    assert task["body"]["messages"][1]["content"][0]["image_url"]["url"] == "data:image/webp;base64,aaa"
+
+
+def test_execute_batch_jobs_splits_on_request_count(classifier):
+    tasks = classifier.create_batch_request({f"{i}.png": "image" for i in range(5)})
+
+    batch_job_ids = classifier.execute_batch_jobs(tasks, max_requests=2)
+
+    assert batch_job_ids == ["batch_for_file_1", "batch_for_file_2", "batch_for_file_3"]
+    assert [[task["custom_id"] for task in upload] for upload in classifier.uploads] == [
+        ["task-0.png", "task-1.png"], ["task-2.png", "task-3.png"], ["task-4.png"],
+    ]
+
+
+def test_execute_batch_jobs_splits_on_file_size(classifier):
+    tasks = list(classifier.create_batch_request({"a.png": "x" * 1000, "b.png": "y" * 1000}))
+    task_size = len(json.dumps(tasks[0])) + 1
+
+    batch_job_ids = classifier.execute_batch_jobs(iter(tasks), max_bytes=task_size + 10)
+
+    assert len(batch_job_ids) == 2
+
+
+def test_execute_batch_jobs_cancels_created_batches_on_failure(classifier):
+    def tasks():
+        yield from classifier.create_batch_request({"a.png": "image", "b.png": "image"})
+        raise OSError("unreadable file")
+
+    with pytest.raises(OSError):
+        classifier.execute_batch_jobs(tasks(), max_requests=1)
+
+    classifier.client.batches.cancel.assert_called_once_with("batch_for_file_1")
+
+
+def test_execute_batch_jobs_without_tasks(classifier):
+    assert classifier.execute_batch_jobs(iter([])) == []
+    classifier.client.files.create.assert_not_called()
+
+
+def test_text_tasks_use_text_model_in_separate_batches(classifier):
+    tasks = [
+        classifier.create_batch_task("a.png", base64_image="image"),
+        classifier.create_batch_task("b.pdf", text="Invoice Number: 1234"),
+        classifier.create_batch_task("c.png", base64_image="image"),
+    ]
+
+    batch_job_ids = classifier.execute_batch_jobs(iter(tasks))
+
+    assert len(batch_job_ids) == 2
+    assert [[task["custom_id"] for task in upload] for upload in classifier.uploads] == [["task-a.png", "task-c.png"], ["task-b.pdf"]]
+    assert classifier.uploads[1][0]["body"]["model"] == "gpt-4o-mini"
+    assert classifier.uploads[1][0]["body"]["messages"][1] == {"role": "user", "content": "Invoice Number: 1234"}
+
+
+def test_pages_tasks_pack_pages_into_one_request(classifier):
+    pages = [{"page": 1, "text": "Statement of account"}, {"page": 3, "image": "image"}]
+    task = classifier.create_batch_task("mixed.pdf", mime_type="image/webp", pages=pages)
+
+    assert task["body"]["model"] == classifier.model
+    assert task["body"]["response_format"]["json_schema"]["name"] == "PagesClassification"
+    assert task["body"]["messages"][1]["content"] == [
+        {"type": "text", "text": "Page 1:\nStatement of account"},
+        {"type": "text", "text": "Page 3:"},
+        {"type": "image_url", "image_url": {"url": "data:image/webp;base64,image"}},
+    ]
+    text_task = classifier.create_batch_task("digital.pdf", pages=pages[:1])
+    assert text_task["body"]["model"] == classifier.text_model
+
+
+def test_batch_tasks_are_routed_to_fine_tuned_models(mocker):
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"],
+                                 fine_tuned_models={"finance": "ft-finance"}, client=mocker.MagicMock())
+
+    tasks = list(classifier.create_batch_request({"invoice_1.png": "aaa", "license.png": "bbb"}))
+
+    assert [task["body"]["model"] for task in tasks] == ["ft-finance", classifier.model]
+    assert classifier.router.stats()["fine_tuned:finance"]["batch_tasks"] == 1
+
+
+def test_classify_text_records_route_metrics(mocker):
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"], client=mocker.MagicMock())
+    classifier.client.beta.chat.completions.parse.return_value = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content='{"category": "other"}'))],
+        usage=SimpleNamespace(prompt_tokens=50, completion_tokens=5),
+    )
+
+    assert classifier.classify_text("hello") == '{"category": "other"}'
+    assert classifier.client.beta.chat.completions.parse.call_args.kwargs["model"] == classifier.text_model
+    assert classifier.router.stats()["text"]["prompt_tokens"] == 50
+
+
+def test_cache_key_covers_the_text_layer_settings():
+    classifier = ImageClassifier(api_key="sk-test", categories=["invoice", "other"])
+    other_text_model = ImageClassifier(api_key="sk-test", categories=["invoice", "other"], text_model="gpt-4o")
+
+    key = classifier.cache_key(b"content")
+    assert key == classifier.cache_key(b"content", use_text_layer=True)
+    assert key != classifier.cache_key(b"content", use_text_layer=False)
+    assert key != other_text_model.cache_key(b"content")
+    assert classifier.cache_key(b"content", use_text_layer=False) == other_text_model.cache_key(b"content", use_text_layer=False)
@@ -0,0 +1,57 @@
+import io
+
+import pytest
+from PIL import Image
+
+from src.image_encoder import ImageEncoder
+from src.utils.metrics import metrics
+
+
+def make_image(size, image_format="PNG"):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def image_bytes():
+    return tuple(metrics.counters.get(name, {}).get((), 0) for name in ("image_bytes_in", "image_bytes_out"))
+
+
+def test_prepare_image_fits_model_tile_budget():
+    image_encoder = ImageEncoder()
+    png_bytes = make_image((1600, 2000))
+    bytes_in, bytes_out = image_bytes()
+
+    prepared_bytes, mime_type = image_encoder.prepare_image(png_bytes)
+
+    assert mime_type == "image/jpeg"
+    with Image.open(io.BytesIO(prepared_bytes)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (768, 960)
+    assert len(prepared_bytes) < len(png_bytes)
+    assert image_bytes() == (bytes_in + len(png_bytes), bytes_out + len(prepared_bytes))
+
+
+def test_prepare_image_webp():
+    prepared_bytes, mime_type = ImageEncoder(image_format="WEBP", quality=60).prepare_image(make_image((100, 100)))
+
+    assert mime_type == "image/webp"
+    with Image.open(io.BytesIO(prepared_bytes)) as image:
+        assert image.format == "WEBP"
+
+
+def test_prepare_image_keeps_small_original_in_target_format():
+    jpeg_bytes = make_image((100, 100), "JPEG")
+    image_encoder = ImageEncoder(quality=100)
+    bytes_in, bytes_out = image_bytes()
+
+    prepared_bytes, _ = image_encoder.prepare_image(jpeg_bytes)
+
+    assert prepared_bytes == jpeg_bytes
+    assert image_bytes() == (bytes_in + len(jpeg_bytes), bytes_out + len(jpeg_bytes))
+
+
+@pytest.mark.parametrize("image_format", ["BMP", "PNG"])
+def test_unsupported_format(image_format):
+    with pytest.raises(ValueError):
+        ImageEncoder(image_format=image_format)
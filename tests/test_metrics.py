@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.metrics import Metrics, call_measured, metrics
+
+
+def test_render_counters_and_histograms():
+    registry = Metrics(namespace="test")
+    registry.describe("documents_total", "Documents.")
+    registry.inc("documents_total", endpoint="classify_file", outcome="cached")
+    registry.inc("documents_total", 2, endpoint="classify_file", outcome="cached")
+    registry.observe("payload_bytes", 3000, buckets=(1024, 4096))
+    registry.observe("payload_bytes", 10000, buckets=(1024, 4096))
+
+    lines = registry.render().splitlines()
+
+    assert "# HELP test_documents_total Documents." in lines
+    assert 'test_documents_total{endpoint="classify_file",outcome="cached"} 3' in lines
+    assert 'test_payload_bytes_bucket{le="1024.0"} 0' in lines
+    assert 'test_payload_bytes_bucket{le="4096.0"} 1' in lines
+    assert 'test_payload_bytes_bucket{le="+Inf"} 2' in lines
+    assert "test_payload_bytes_sum 13000.0" in lines
+    assert "test_payload_bytes_count 2" in lines
+
+
+def test_span_records_failures():
+    registry = Metrics()
+    with registry.span("classify", model="gpt"):
+        pass
+    with pytest.raises(ValueError):
+        with registry.span("classify", model="gpt"):
+            raise ValueError("failed")
+
+    series = registry.histograms["stage_duration_seconds"]
+    assert series[(("error", "false"), ("model", "gpt"), ("stage", "classify"))][3] == 1
+    assert series[(("error", "true"), ("model", "gpt"), ("stage", "classify"))][3] == 1
+
+
+def test_drain_and_merge():
+    worker, parent = Metrics(), Metrics()
+    worker.inc("batch_result_lines_total", 5)
+    worker.observe("stage_duration_seconds", 0.2, stage="rasterize")
+    parent.observe("stage_duration_seconds", 0.3, stage="rasterize")
+
+    parent.merge(worker.drain())
+
+    assert worker.counters == {} and worker.histograms == {}
+    assert parent.counters["batch_result_lines_total"][()] == 5
+    histogram = parent.histograms["stage_duration_seconds"][(("stage", "rasterize"),)]
+    assert histogram[2] == pytest.approx(0.5)
+    assert histogram[3] == 2
+
+
+def test_call_measured_keeps_metrics_of_threads_in_place():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        result, worker_metrics = executor.submit(call_measured, lambda value: metrics.inc("test_total") or value, 42).result()
+
+    assert result == 42
+    assert worker_metrics is None
+    assert metrics.counters["test_total"][()] >= 1
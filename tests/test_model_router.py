@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils.model_router import ModelRouter
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(
+        {"finance": "ft-finance", "healthcare": "ft-healthcare"}, "gpt-4o", "gpt-4o-mini",
+        model_prices={"ft-finance": (10, 20)},
+    )
+
+
+def test_detect_domain_needs_several_keywords_in_text(router):
+    assert router.detect_domain("Invoice total due: 120 EUR, payment by bank transfer") == "finance"
+    assert router.detect_domain("Please find the invoice attached") is None
+    assert router.detect_domain("Patient diagnosis and prescribed medication") == "healthcare"
+
+
+def test_detect_domain_from_file_name(router):
+    assert router.detect_domain(filename="files/bank_statement-2024.pdf") == "finance"
+    assert router.detect_domain(filename="files/photo.jpg") is None
+
+
+def test_route_falls_back_to_base_models(router):
+    assert router.route("vision", filename="invoice_1.png") == ("fine_tuned:finance", "ft-finance")
+    assert router.route("vision", filename="license.png") == ("vision", "gpt-4o")
+    assert router.route("text", text="hello world") == ("text", "gpt-4o-mini")
+    assert router.route("text", text="hello world", domain="healthcare") == ("fine_tuned:healthcare", "ft-healthcare")
+
+
+def test_domains_without_fine_tuned_model_are_not_detected():
+    router = ModelRouter({}, "gpt-4o", "gpt-4o-mini")
+
+    assert router.route("vision", filename="invoice_1.png") == ("vision", "gpt-4o")
+
+
+def test_stats_report_latency_and_cost(router):
+    router.record("fine_tuned:finance", "ft-finance", 0.5, SimpleNamespace(prompt_tokens=1000, completion_tokens=100))
+    router.record("fine_tuned:finance", "ft-finance", 1.5, error=True)
+    router.record_batch_task("vision", "gpt-4o")
+
+    stats = router.stats()
+    assert stats["fine_tuned:finance"]["requests"] == 2
+    assert stats["fine_tuned:finance"]["errors"] == 1
+    assert stats["fine_tuned:finance"]["average_latency_seconds"] == 1.0
+    assert stats["fine_tuned:finance"]["estimated_cost"] == pytest.approx(0.012)
+    assert stats["vision"]["batch_tasks"] == 1
+    assert "estimated_cost" not in stats["vision"]
@@ -0,0 +1,53 @@
+import io
+import random
+from PIL import Image, ImageDraw
+from src.utils.near_duplicates import BKTree, NearDuplicateIndex, dhash, fan_out_duplicates, hamming_distance
+
+
+def make_image(lines, size=(800, 1100), quality=90):
+    image = Image.new("RGB", (400, 560), "white")
+    draw = ImageDraw.Draw(image)
+    for y in lines:
+        draw.rectangle([40, y, 360, y + 12], fill="black")
+    buffer = io.BytesIO()
+    image.resize(size).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def test_dhash_survives_rescaling_and_recompression():
+    original = dhash(make_image([40, 100, 160]))
+    rescan = dhash(make_image([40, 100, 160], size=(600, 820), quality=40))
+    other = dhash(make_image([300, 420]))
+    assert hamming_distance(original, rescan) <= 6
+    assert hamming_distance(original, other) > 6
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for i, hash_value in enumerate(hashes):
+        tree.add(hash_value, i)
+    query = hashes[42] ^ 0b1011
+    expected = sorted((hamming_distance(query, h), i) for i, h in enumerate(hashes) if hamming_distance(query, h) <= 12)
+    assert sorted(tree.search(query, 12)) == expected
+    assert tree.search(query, 12)[0] == (3, 42)
+
+
+def test_index_clusters_near_duplicates():
+    index = NearDuplicateIndex(max_distance=6)
+    assert index.add("task-a.jpg", {"image": make_image([40, 100, 160])}) is None
+    assert index.add("task-a-rescan.jpg", {"image": make_image([40, 100, 160], size=(600, 820), quality=40)}) == "task-a.jpg"
+    assert index.add("task-b.jpg", {"image": make_image([300, 420])}) is None
+    assert index.add("task-c.pdf", {"text": "Invoice  Number 1"}) is None
+    assert index.add("task-c-export.pdf", {"text": "invoice number 1\n"}) == "task-c.pdf"
+    assert index.add("task-d.pdf", {"text": "Invoice Number 2"}) is None
+    assert index.duplicates == {"task-a-rescan.jpg": "task-a.jpg", "task-c-export.pdf": "task-c.pdf"}
+
+
+def test_fan_out_duplicates():
+    classifications = [{"custom_id": "task-a", "category": "invoice"}]
+    duplicates = {"task-a2": "task-a", "task-b2": "task-b"}
+    assert fan_out_duplicates(classifications, duplicates) == [
+        {"custom_id": "task-a2", "category": "invoice", "duplicate_of": "task-a"},
+    ]
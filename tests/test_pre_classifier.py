@@ -0,0 +1,75 @@
+import io
+import json
+import numpy as np
+from PIL import Image, ImageDraw
+from src.pre_classifier import PreClassifier, main, read_labels, read_registry_labels
+from src.utils.batch_registry import BatchJobRegistry
+
+
+def make_image(lines):
+    image = Image.new("RGB", (400, 560), "white")
+    draw = ImageDraw.Draw(image)
+    for y in lines:
+        draw.rectangle([40, y, 360, y + 12], fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_text_vectors_ignore_numbers():
+    first = PreClassifier.text_vector("Invoice number 1001 total due 250.00")
+    second = PreClassifier.text_vector("Invoice number 2002 total due 99.95")
+    other = PreClassifier.text_vector("Account statement opening balance closing balance")
+    assert np.isclose(first @ second, 1.0)
+    assert first @ other < 0.5
+
+
+def test_similar_images_are_classified_locally(tmp_path):
+    pre_classifier = PreClassifier(index_path=str(tmp_path / "index.npz"))
+    for offset in (0, 4):
+        pre_classifier.add("image", PreClassifier.image_vector(make_image([40 + offset, 100, 160])), "invoice")
+    pre_classifier.add("image", PreClassifier.image_vector(make_image([300, 400, 500])), "other")
+
+    assert pre_classifier.classify_document({"image": make_image([42, 100, 160])}) == "invoice"
+    assert pre_classifier.classify_document({"image": make_image([200, 260])}) is None
+    assert pre_classifier.classify_document({"text": "no text documents are indexed"}) is None
+    stats = pre_classifier.stats()
+    assert stats["indexed"] == {"image": 3}
+    assert (stats["requests"], stats["escalations"]) == (3, 2)
+
+
+def test_disagreeing_neighbours_escalate(tmp_path):
+    pre_classifier = PreClassifier(index_path=str(tmp_path / "index.npz"))
+    vector = PreClassifier.text_vector("Invoice total due")
+    pre_classifier.add("text", vector, "invoice")
+    pre_classifier.add("text", vector, "bank statement")
+    assert pre_classifier.classify("text", vector) is None
+
+
+def test_build_and_update_index(tmp_path):
+    labels_path = tmp_path / "labels.jsonl"
+    with open(labels_path, "w") as f:
+        f.write(json.dumps({"path": "files/invoice_1.pdf", "category": "invoice"}) + "\n")
+        f.write(json.dumps({"custom_id": "task-files/invoice_2.pdf", "category": "invoice"}) + "\n")
+        f.write(json.dumps({"custom_id": "task-files/missing.pdf", "category": "other"}) + "\n")
+    assert list(read_labels(str(labels_path)))[1] == ("files/invoice_2.pdf", "invoice")
+
+    index_path = str(tmp_path / "index.npz")
+    main(["build", "--index", index_path, "--labels", str(labels_path)])
+    assert PreClassifier(index_path=index_path).stats()["indexed"] == {"text": 2}
+    main(["update", "--index", index_path, "--labels", str(labels_path)])
+    assert PreClassifier(index_path=index_path).stats()["indexed"] == {"text": 4}
+    main(["build", "--index", index_path, "--labels", str(labels_path)])
+    assert PreClassifier(index_path=index_path).stats()["indexed"] == {"text": 2}
+
+
+def test_read_registry_labels(tmp_path):
+    registry_path = str(tmp_path / "batch_jobs.db")
+    registry = BatchJobRegistry(db_path=registry_path)
+    completed = registry.create(["batch_1"], classifications=[{"custom_id": "task-a.pdf", "category": "invoice", "cached": True}])
+    registry.add_results(completed, [{"custom_id": "task-b.pdf", "category": "other"}])
+    registry.complete(completed, [{"custom_id": "task-c.pdf", "category": None, "error": "No classification"}])
+    running = registry.create(["batch_2"])
+    registry.add_results(running, [{"custom_id": "task-d.pdf", "category": "invoice"}])
+
+    assert list(read_registry_labels(registry_path)) == [("a.pdf", "invoice"), ("b.pdf", "other")]
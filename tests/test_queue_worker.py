@@ -0,0 +1,54 @@
+import os
+import shutil
+import pytest
+from src.queue_worker import QueueWorker
+from src.services import Services
+from src.utils.classification_cache import ClassificationCache
+from src.utils.work_queue import WorkQueue
+
+@pytest.fixture
+def work_queue(tmp_path):
+    return WorkQueue(db_path=str(tmp_path / "work_queue.db"), max_attempts=2, retry_delay=0)
+
+@pytest.fixture
+def worker(tmp_path, work_queue):
+    services = Services(api_key="sk-test", categories=["invoice", "other"])
+    cache = ClassificationCache(db_path=str(tmp_path / "classification_cache.db"))
+    yield QueueWorker(work_queue, services, cache, poll_interval=0, worker_id="worker-1")
+    services.close()
+
+def enqueue(worker, path):
+    with open(path, 'rb') as f:
+        worker.work_queue.enqueue(path, worker.services.image_classifier.cache_key(f.read()))
+
+def test_worker_classifies_queued_files(worker, tmp_path, mocker):
+    classify_text = mocker.patch('src.image_classifier.ImageClassifier.classify_text', return_value='{"category": "invoice"}')
+    copy = str(tmp_path / "invoice_copy.pdf")
+    shutil.copy("files/invoice_1.pdf", copy)
+    enqueue(worker, "files/invoice_1.pdf")
+
+    worker.run(exit_when_empty=True)
+    enqueue(worker, "files/invoice_1.pdf")
+    enqueue(worker, copy)
+    worker.run(exit_when_empty=True)
+
+    items = worker.work_queue.items(status="done")
+    assert [item["result"] for item in items] == [{"category": "invoice"}, {"category": "invoice", "cached": True}]
+    # Completed files are not classified again, and copies are answered from the cache
+    assert classify_text.call_count == 1
+
+def test_failures_are_retried_and_dead_lettered(worker, tmp_path, mocker):
+    mocker.patch('src.image_classifier.ImageClassifier.classify_text', side_effect=Exception("Server error"))
+    missing = str(tmp_path / "missing.pdf")
+    shutil.copy("files/invoice_1.pdf", missing)
+    enqueue(worker, missing)
+    enqueue(worker, "files/invoice_1.pdf")
+    os.remove(missing)
+
+    assert worker.process_one()
+    assert worker.work_queue.items(status="dead")[0]["path"] == missing
+    assert worker.process_one()
+    assert worker.work_queue.items(status="pending")[0]["error"] == "Server error"
+    worker.run(exit_when_empty=True)
+
+    assert worker.work_queue.stats() == {"pending": 0, "processing": 0, "done": 0, "dead": 2}
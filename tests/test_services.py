@@ -0,0 +1,58 @@
+import asyncio
+
+from src.services import Services
+
+
+def test_components_share_one_pooled_client():
+    services = Services(api_key="sk-test", categories=["invoice", "other"], timeout=30, connect_timeout=2,
+                        max_connections=10, max_keepalive_connections=5, max_retries=1, conversion_timeout=90,
+                        image_format="WEBP", image_quality=60, image_max_short_side=512)
+    try:
+        assert services.image_classifier.client is services.openai_client
+        assert services.batch_monitor.client is services.openai_client
+        assert services.openai_client._client is services.http_client
+        assert services.openai_client.max_retries == 1
+        assert services.http_client.timeout.read == 30
+        assert services.http_client.timeout.connect == 2
+        assert services.file_processor.timeout == 90
+        assert services.image_classifier.categories == ["invoice", "other"]
+        assert services.image_encoder.mime_type == "image/webp"
+        assert (services.image_encoder.quality, services.image_encoder.max_short_side) == (60, 512)
+    finally:
+        services.close()
+    assert services.http_client.is_closed
+
+
+def test_async_classifier_shares_router():
+    services = Services(api_key="sk-test", categories=["invoice", "other"], timeout=30, async_max_concurrency=50,
+                        async_requests_per_minute=100)
+    try:
+        classifier = services.async_image_classifier
+        assert services.async_image_classifier is classifier
+        assert classifier.router is services.router
+        assert classifier.client.max_retries == 0
+        assert classifier.client._client.timeout.read == 30
+        assert classifier.semaphore._value == 50
+        assert classifier.rate_limiter.requests_per_minute == 100
+    finally:
+        asyncio.run(services.aclose())
+    assert classifier.client._client.is_closed
+
+
+def test_app_creates_services_once(mocker):
+    import src.pipeline
+    mocker.patch('src.pipeline.services', None)
+    first = src.pipeline.get_services()
+    assert src.pipeline.get_services() is first
+    assert first.image_classifier.router is first.router
+
+
+def test_app_routes_to_fine_tuned_models_only_when_enabled(mocker):
+    import src.pipeline
+    mocker.patch('src.pipeline.services', None)
+    mocker.patch('src.pipeline.MODEL_ROUTING', False)
+    assert src.pipeline.get_services().router.fine_tuned_models == {}
+
+    mocker.patch('src.pipeline.services', None)
+    mocker.patch('src.pipeline.MODEL_ROUTING', True)
+    assert src.pipeline.get_services().router.fine_tuned_models == src.pipeline.FINE_TUNED_MODELS
@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.utils.work_queue import WorkQueue
+
+@pytest.fixture
+def work_queue(tmp_path):
+    return WorkQueue(db_path=str(tmp_path / "work_queue.db"), max_attempts=2, lease_seconds=60, retry_delay=10)
+
+def test_files_are_enqueued_once_per_content(work_queue):
+    assert work_queue.enqueue("files/a.pdf", "key-1")
+    assert not work_queue.enqueue("files/a.pdf", "key-1")
+    # A changed file is enqueued again
+    assert work_queue.enqueue("files/a.pdf", "key-2")
+    assert work_queue.stats() == {"pending": 2, "processing": 0, "done": 0, "dead": 0}
+
+def test_claim_and_complete(work_queue):
+    work_queue.enqueue("files/a.pdf", "key-1")
+
+    item = work_queue.claim("worker-1")
+
+    assert item["path"] == "files/a.pdf"
+    assert item["attempts"] == 1
+    assert work_queue.claim("worker-2") is None
+    assert work_queue.complete(item["item_id"], "worker-1", {"category": "invoice"})
+    assert work_queue.items(status="done")[0]["result"] == {"category": "invoice"}
+
+def test_items_of_crashed_workers_are_claimed_again(work_queue):
+    work_queue.enqueue("files/a.pdf", "key-1")
+    item = work_queue.claim("worker-1")
+
+    # The lease of the crashed worker expires
+    reclaimed = work_queue.claim("worker-2", now=time.time() + 61)
+
+    assert reclaimed["item_id"] == item["item_id"]
+    assert reclaimed["attempts"] == 2
+    assert not work_queue.complete(item["item_id"], "worker-1", {"category": "invoice"})
+    # An item crashing its worker on its last attempt is dead-lettered
+    assert work_queue.claim("worker-3", now=time.time() + 122) is None
+    assert work_queue.items(status="dead")[0]["error"] == "Worker lost while processing"
+
+def test_failed_items_are_retried_then_dead_lettered(work_queue):
+    work_queue.enqueue("files/a.pdf", "key-1")
+
+    item = work_queue.claim("worker-1")
+    assert work_queue.fail(item["item_id"], "worker-1", "Rate limited") == "pending"
+    assert work_queue.claim("worker-1") is None
+    item = work_queue.claim("worker-1", now=time.time() + 11)
+    assert work_queue.fail(item["item_id"], "worker-1", "Rate limited") == "dead"
+
+    assert work_queue.retry_dead() == 1
+    assert work_queue.claim("worker-1")["attempts"] == 1
+
+def test_permanent_failures_are_dead_lettered_right_away(work_queue):
+    work_queue.enqueue("files/a.pdf", "key-1")
+    item = work_queue.claim("worker-1")
+
+    assert work_queue.fail(item["item_id"], "worker-1", "No such file", retry=False) == "dead"
+
+def test_concurrent_workers_claim_each_item_once(work_queue):
+    for i in range(40):
+        work_queue.enqueue(f"files/{i}.pdf", f"key-{i}")
+
+    def drain(worker):
+        claimed = []
+        while (item := work_queue.claim(worker)) is not None:
+            claimed.append(item["item_id"])
+        return claimed
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        claimed = [item_id for items in executor.map(drain, [f"worker-{i}" for i in range(4)]) for item_id in items]
+
+    assert sorted(claimed) == list(range(1, 41))